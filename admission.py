@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict, Counter
+
+# ==============================================================================
+# Kiểm soát nhận kết nối: token bucket theo IP nguồn và toàn cục
+# ==============================================================================
+# Khi upstream chập chờn, mọi rover kết nối lại cùng một lúc. Bucket toàn cục giới hạn
+# tốc độ caster nhận kết nối mới (phần vượt chờ trong backlog của listen()), bucket theo IP
+# chặn một địa chỉ kết nối dồn dập, và số handshake đang chờ bị chặn trên bởi queue_size.
+
+DEFAULT_LISTEN_BACKLOG = 512
+DEFAULT_PER_IP_RATE = 20
+DEFAULT_PER_IP_BURST = 100
+DEFAULT_GLOBAL_RATE = 500
+DEFAULT_GLOBAL_BURST = 1000
+DEFAULT_ADMISSION_QUEUE = 1024
+DEFAULT_HANDSHAKE_TIMEOUT = 10
+MAX_TRACKED_IPS = 65536
+
+BUSY_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n\r\n"
+
+
+class TokenBucket:
+    """Bucket `rate` token/giây, chứa tối đa `burst`. Không thread-safe: dùng trong một luồng/loop."""
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self):
+        """Lấy trước một token (có thể âm) và trả về số giây phải chờ tới lượt mình.
+
+        Các kết nối đang xếp hàng mỗi cái ngủ đúng một lần thay vì cùng thức dậy tranh token.
+        """
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self):
+        """Số giây tới khi có token (0 nếu đã có sẵn)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Quyết định nhận hay từ chối kết nối mới; rate = 0 tắt bucket tương ứng.
+
+    shares > 1 khi caster chạy nhiều tiến trình cùng cổng: mỗi tiến trình giữ một phần
+    bằng nhau của hạn mức cấu hình để tổng cộng vẫn xấp xỉ hạn mức đó.
+    """
+    def __init__(self, settings=None, shares=1):
+        settings = settings or {}
+        self.per_ip_rate = settings.get('per_ip_rate', DEFAULT_PER_IP_RATE) / shares
+        self.per_ip_burst = max(1, settings.get('per_ip_burst', DEFAULT_PER_IP_BURST) / shares)
+        global_rate = settings.get('global_rate', DEFAULT_GLOBAL_RATE) / shares
+        self.global_bucket = (TokenBucket(global_rate, max(1, settings.get('global_burst', DEFAULT_GLOBAL_BURST) / shares))
+                              if global_rate else None)
+        self.queue_size = settings.get('queue_size', DEFAULT_ADMISSION_QUEUE)
+        self.handshake_timeout = settings.get('handshake_timeout', DEFAULT_HANDSHAKE_TIMEOUT)
+        self._ip_buckets = OrderedDict()
+        # Số kết nối bị từ chối theo lý do ('per_ip', 'queue_full', 'handshake_timeout')
+        self.rejected = Counter()
+
+    def global_wait(self):
+        """Số giây phải chờ trước khi được nhận thêm kết nối (0 = nhận ngay)."""
+        return 0.0 if self.global_bucket is None else self.global_bucket.wait_time()
+
+    def take_global(self):
+        return self.global_bucket is None or self.global_bucket.try_take()
+
+    def reserve_global(self):
+        return 0.0 if self.global_bucket is None else self.global_bucket.reserve()
+
+    def allow_ip(self, ip):
+        if not self.per_ip_rate:
+            return True
+        bucket = self._ip_buckets.get(ip)
+        if bucket is None:
+            bucket = self._ip_buckets[ip] = TokenBucket(self.per_ip_rate, self.per_ip_burst)
+            if len(self._ip_buckets) > MAX_TRACKED_IPS:
+                self._ip_buckets.popitem(last=False)
+        else:
+            self._ip_buckets.move_to_end(ip)
+        if bucket.try_take():
+            return True
+        self.rejected['per_ip'] += 1
+        return False
+
+    def queue_full(self, pending):
+        if pending < self.queue_size:
+            return False
+        self.rejected['queue_full'] += 1
+        return True
@@ -0,0 +1,426 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from ntrip_client import NtripClientEngine, NtripSession
+from rtcm import RtcmFramer, encode_frame
+
+# ==============================================================================
+# Benchmark fan-out của caster qua loopback: Base giả lập -> caster -> N rover
+# ==============================================================================
+# Caster chạy trong một tiến trình riêng (để đo CPU/RSS của riêng nó), Base giả lập đẩy
+# frame RTCM3 qua SOURCE, rover là các NtripSession của ntrip_client.py (cùng yêu cầu GET
+# và câu GGA như client thật) chia đều cho --rover-procs tiến trình tạo tải.
+# Mỗi frame mang số thứ tự và thời điểm gửi (time.time_ns) trong payload, nên rover tính
+# được độ trễ đầu-cuối và số frame bị mất.
+#
+# Ví dụ: python benchmark.py --engines thread,asyncio --rovers 500 --rate 10 --duration 30
+
+BENCH_MOUNTPOINT = "BENCH"
+BENCH_SOURCE_PASSWORD = "bench"
+BENCH_ACCOUNT = {"username": "bench", "password": "bench"}
+BENCH_MESSAGE_TYPE = 4095  # Dải message riêng (proprietary), caster không coi là message mồi
+BENCH_STAMP = struct.Struct(">QQ")  # Số thứ tự frame, thời điểm gửi (ns)
+BENCH_LOCATION = (21.0285, 105.8542)
+DEFAULT_BENCH_PORT = 2199
+PERCENTILES = (50, 90, 99, 99.9)
+
+# "spawn": tiến trình con không thừa kế thread của Base giả lập đang chạy
+_MP = multiprocessing.get_context("spawn")
+
+
+def build_payload(seq, size):
+    """Payload RTCM3 `size` byte: 12 bit số hiệu message, số thứ tự, thời điểm gửi, phần đệm."""
+    header = (BENCH_MESSAGE_TYPE << 4).to_bytes(2, 'big')
+    stamp = BENCH_STAMP.pack(seq, time.time_ns())
+    return header + stamp + bytes(max(0, size - len(header) - len(stamp)))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))
+    return sorted_values[index]
+
+
+# ====== Đo CPU / RSS của tiến trình caster qua /proc (Linux) ======
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def read_process_cpu(pid):
+    """Tổng thời gian CPU (user + system, giây) của tiến trình; None nếu không có /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def read_process_memory(pid):
+    """(RSS hiện tại, RSS đỉnh) tính bằng byte; (None, None) nếu không có /proc."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(':', 1)
+                    values[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def caster_process_ids(pid):
+    """Tiến trình caster cùng các worker con của nó (server_settings.workers > 1)."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [pid] + [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return [pid]
+
+
+def read_caster_cpu(pids):
+    values = [read_process_cpu(pid) for pid in pids]
+    return None if None in values else sum(values)
+
+
+def read_caster_memory(pids):
+    """RSS cộng dồn của các tiến trình; vùng shared memory chung bị tính lặp ở mỗi worker."""
+    values = [read_process_memory(pid) for pid in pids]
+    if any(rss is None for rss, _ in values):
+        return None, None
+    return sum(rss for rss, _ in values), sum(peak for _, peak in values)
+
+
+# ==============================================================================
+# Tiến trình caster
+# ==============================================================================
+def bench_caster_config(port, args, engine):
+    station = {
+        "name": "Benchmark", "mode": "NtripCaster", "base_source_password": BENCH_SOURCE_PASSWORD,
+        "caster_settings": {
+            "host": "127.0.0.1", "port": port, "mountpoint": BENCH_MOUNTPOINT,
+            "slow_rover_policy": args.slow_rover_policy,
+            "rover_coalesce_ms": args.coalesce_ms,
+            "sourcetable": (f"STR;{BENCH_MOUNTPOINT};Benchmark;RTCM 3.2;{BENCH_MESSAGE_TYPE};2;GPS;SNIP;VN;"
+                            f"{BENCH_LOCATION[0]:.2f};{BENCH_LOCATION[1]:.2f};0;0;PythonCaster;N;B;0"),
+        },
+    }
+    settings = {
+        "engine": engine,
+        "event_loop": args.event_loop,
+        "workers": args.workers,
+        "listen_backlog": max(512, args.rovers),
+        # Mọi rover đến từ 127.0.0.1 cùng lúc: tắt giới hạn nhận kết nối
+        "admission": {"per_ip_rate": 0, "global_rate": 0, "queue_size": args.rovers + 64},
+        "logging": {"level": "WARNING"},
+    }
+    return [station], [BENCH_ACCOUNT], settings
+
+
+def _run_caster(stations, accounts, settings):
+    import ntrip_caster
+    from event_log import configure_logging
+    configure_logging(settings.get('logging'))
+    server = ntrip_caster.NtripCasterServer(stations, accounts, settings)
+    # terminate() từ tiến trình đo: dừng gọn để các worker và shared memory được dọn
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop_event.set())
+    try:
+        server.start()
+    finally:
+        server.stop()
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+# ==============================================================================
+# Base giả lập: đẩy frame qua SOURCE theo nhịp cố định
+# ==============================================================================
+class SyntheticBase(threading.Thread):
+    """Mỗi epoch gửi `frames` frame `size` byte trong một lần sendall, `rate` epoch/giây."""
+    def __init__(self, port, rate, frames, size):
+        super().__init__(name="SyntheticBase", daemon=True)
+        self.port = port
+        self.rate = rate
+        self.frames = frames
+        self.size = size
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.late_epochs = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            sock = socket.create_connection(("127.0.0.1", self.port))
+            sock.sendall(f"SOURCE {BENCH_SOURCE_PASSWORD} /{BENCH_MOUNTPOINT}\r\n"
+                         f"Source-Agent: NTRIP PythonBenchmark/1.0\r\n\r\n".encode())
+            response = sock.recv(1024)
+            if b"200 OK" not in response:
+                raise ConnectionError(f"Caster từ chối SOURCE: {response!r}")
+            interval = 1.0 / self.rate
+            next_epoch = time.monotonic()
+            seq = 0
+            while not self._stop_event.is_set():
+                epoch = []
+                for _ in range(self.frames):
+                    epoch.append(encode_frame(build_payload(seq, self.size)))
+                    seq += 1
+                data = b"".join(epoch)
+                sock.sendall(data)
+                self.sent_frames += self.frames
+                self.sent_bytes += len(data)
+                next_epoch += interval
+                delay = next_epoch - time.monotonic()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                else:
+                    self.late_epochs += 1
+            sock.close()
+        except OSError as e:
+            self.error = e
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# ==============================================================================
+# Tiến trình tạo tải rover
+# ==============================================================================
+class RoverProbe:
+    """Callback on_data của một NtripSession: tách frame và ghi độ trễ trong cửa sổ đo."""
+    def __init__(self, window):
+        self.window_start, self.window_end = window
+        self.framer = RtcmFramer(validate_crc=False)
+        self.latencies = array('d')
+        self.first_seq = None
+        self.last_seq = None
+        self.frames = 0
+        self.bytes = 0
+
+    def __call__(self, data):
+        now = time.time_ns()
+        # Framer luôn được nạp để không lệch ranh giới frame ở mép cửa sổ đo
+        frames = self.framer.feed(data)
+        if not self.window_start <= now < self.window_end:
+            return
+        self.bytes += len(data)
+        for msg_type, frame in frames:
+            if msg_type != BENCH_MESSAGE_TYPE:
+                continue
+            seq, sent = BENCH_STAMP.unpack_from(frame, 5)
+            if self.first_seq is None:
+                self.first_seq = seq
+            self.last_seq = seq
+            self.frames += 1
+            self.latencies.append((now - sent) / 1e6)
+
+
+def _run_rovers(port, count, gga_interval, window, results):
+    engine = NtripClientEngine()
+    details = {"host": "127.0.0.1", "port": port, "mountpoint": BENCH_MOUNTPOINT,
+               "username": BENCH_ACCOUNT["username"], "password": BENCH_ACCOUNT["password"]}
+    probes, sessions = [], []
+    for _ in range(count):
+        probe = RoverProbe(window)
+        session = NtripSession(details, *BENCH_LOCATION, gga_interval, on_data=probe)
+        engine.add_session(session)
+        probes.append(probe)
+        sessions.append(session)
+
+    time.sleep(max(0.0, window[0] / 1e9 - time.time()))
+    cpu_start = time.process_time()
+    time.sleep(max(0.0, window[1] / 1e9 - time.time()))
+    cpu = time.process_time() - cpu_start
+    connected = sum(1 for session in sessions if session.state == "streaming")
+    for session in sessions:
+        engine.close_session(session)
+
+    # Mỗi rover: (số frame, byte, số frame lẽ ra phải nhận, độ trễ dạng bytes của array('d'))
+    rovers = []
+    for probe in probes:
+        expected = 0 if probe.first_seq is None else probe.last_seq - probe.first_seq + 1
+        rovers.append((probe.frames, probe.bytes, expected, probe.latencies.tobytes()))
+    results.put({'connected': connected, 'cpu': cpu, 'rovers': rovers})
+
+
+# ==============================================================================
+# Một lượt đo cho một engine
+# ==============================================================================
+def run_benchmark(engine, port, args):
+    stations, accounts, settings = bench_caster_config(port, args, engine)
+    # Khi có worker thì không đặt daemon: tiến trình daemon của multiprocessing không được tạo tiến trình con
+    caster = _MP.Process(target=_run_caster, args=(stations, accounts, settings),
+                                     name=f"caster-{engine}", daemon=args.workers <= 1)
+    caster.start()
+    base = None
+    workers = []
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"Caster ({engine}) không mở cổng {port}")
+        base = SyntheticBase(port, args.rate, args.frames, args.size)
+        base.start()
+
+        # Cửa sổ đo bắt đầu sau thời gian kết nối + làm nóng, tính bằng đồng hồ thật để mọi tiến trình dùng chung
+        window_start = time.time_ns() + int((args.ramp + args.warmup) * 1e9)
+        window = (window_start, window_start + int(args.duration * 1e9))
+        results = _MP.Queue()
+        procs = max(1, min(args.rover_procs, args.rovers))
+        for i in range(procs):
+            count = args.rovers // procs + (1 if i < args.rovers % procs else 0)
+            worker = _MP.Process(target=_run_rovers, name=f"rovers-{i}", daemon=True,
+                                             args=(port, count, args.gga_interval, window, results))
+            worker.start()
+            workers.append(worker)
+
+        time.sleep(max(0.0, window[0] / 1e9 - time.time()))
+        pids = caster_process_ids(caster.pid)
+        cpu_start = read_caster_cpu(pids)
+        base_frames_start = base.sent_frames
+        time.sleep(max(0.0, window[1] / 1e9 - time.time()))
+        cpu_end = read_caster_cpu(pids)
+        base_frames = base.sent_frames - base_frames_start
+        rss, peak_rss = read_caster_memory(pids)
+
+        parts = [results.get(timeout=60 + args.rovers / 100) for _ in workers]
+    finally:
+        if base is not None:
+            base.stop()
+        for worker in workers:
+            worker.join(timeout=5)
+        caster.terminate()
+        caster.join(timeout=10)
+
+    if base.error is not None:
+        raise RuntimeError(f"Base giả lập lỗi: {base.error}")
+    return summarize(engine, args, parts, base_frames, base.late_epochs,
+                     None if cpu_start is None or cpu_end is None else cpu_end - cpu_start, rss, peak_rss)
+
+
+def summarize(engine, args, parts, base_frames, late_epochs, caster_cpu, rss, peak_rss):
+    latencies = array('d')
+    rover_p99 = []
+    frames = received_bytes = expected = 0
+    for part in parts:
+        for rover_frames, rover_bytes, rover_expected, raw in part['rovers']:
+            frames += rover_frames
+            received_bytes += rover_bytes
+            expected += rover_expected
+            rover = array('d')
+            rover.frombytes(raw)
+            latencies.extend(rover)
+            if rover:
+                rover_p99.append(percentile(sorted(rover), 99))
+    latencies = sorted(latencies)
+    rover_p99.sort()
+    duration = args.duration
+    return {
+        'engine': engine,
+        'rovers': args.rovers,
+        'connected': sum(part['connected'] for part in parts),
+        'base_frames_per_s': base_frames / duration,
+        'base_late_epochs': late_epochs,
+        'frames_per_s': frames / duration,
+        'mbit_per_s': received_bytes * 8 / duration / 1e6,
+        'loss_pct': 100.0 * (1 - frames / expected) if expected else None,
+        'latency_ms': {f"p{q:g}": percentile(latencies, q) for q in PERCENTILES} | {'max': latencies[-1] if latencies else None},
+        'worst_rover_p99_ms': rover_p99[-1] if rover_p99 else None,
+        'median_rover_p99_ms': percentile(rover_p99, 50),
+        'caster_cpu_pct': None if caster_cpu is None else 100.0 * caster_cpu / duration,
+        'caster_rss_mb': None if rss is None else rss / 2**20,
+        'caster_peak_rss_mb': None if peak_rss is None else peak_rss / 2**20,
+        'generator_cpu_pct': [round(100.0 * part['cpu'] / duration, 1) for part in parts],
+    }
+
+
+def _fmt(value, spec=".2f"):
+    return "n/a" if value is None else format(value, spec)
+
+
+def print_report(results):
+    print("=" * 78)
+    header = f"{'engine':<10}{'rover':>8}{'frame/s':>10}{'Mbit/s':>9}{'mất %':>8}{'p50':>8}{'p99':>8}{'p99.9':>8}{'max':>8}"
+    print(header + "   (độ trễ ms)")
+    for r in results:
+        lat = r['latency_ms']
+        print(f"{r['engine']:<10}{r['connected']:>4}/{r['rovers']:<3}{r['frames_per_s']:>10.0f}{r['mbit_per_s']:>9.2f}"
+              f"{_fmt(r['loss_pct']):>8}{_fmt(lat['p50']):>8}{_fmt(lat['p99']):>8}{_fmt(lat['p99.9']):>8}{_fmt(lat['max']):>8}")
+    print("-" * 78)
+    print(f"{'engine':<10}{'CPU caster %':>14}{'RSS MB':>9}{'RSS đỉnh':>10}{'p99 rover tệ nhất':>19}{'CPU tạo tải %':>16}")
+    for r in results:
+        print(f"{r['engine']:<10}{_fmt(r['caster_cpu_pct'], '.1f'):>14}{_fmt(r['caster_rss_mb'], '.1f'):>9}"
+              f"{_fmt(r['caster_peak_rss_mb'], '.1f'):>10}{_fmt(r['worst_rover_p99_ms']):>19}"
+              f"{','.join(map(str, r['generator_cpu_pct'])):>16}")
+    print("=" * 78)
+    for r in results:
+        if r['base_late_epochs']:
+            print(f"[!] {r['engine']}: Base giả lập trễ nhịp {r['base_late_epochs']} epoch, tốc độ thực tế thấp hơn --rate.")
+        if any(cpu > 90 for cpu in r['generator_cpu_pct']):
+            print(f"[!] {r['engine']}: Tiến trình tạo tải gần 100% CPU, độ trễ đo được gồm cả phía rover; tăng --rover-procs.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark fan-out của NTRIP caster qua loopback.")
+    parser.add_argument('--engines', default="thread,asyncio", help="Danh sách engine, cách nhau bởi dấu phẩy")
+    parser.add_argument('--event-loop', default="asyncio", help="Event loop cho engine asyncio (asyncio, uvloop, ...)")
+    parser.add_argument('--workers', type=int, default=1, help="Số tiến trình caster dùng chung cổng (server_settings.workers)")
+    parser.add_argument('--rovers', type=int, default=100)
+    parser.add_argument('--rover-procs', type=int, default=1, help="Số tiến trình tạo tải rover")
+    parser.add_argument('--rate', type=float, default=1.0, help="Số epoch Base gửi mỗi giây")
+    parser.add_argument('--frames', type=int, default=5, help="Số frame RTCM3 mỗi epoch")
+    parser.add_argument('--size', type=int, default=300, help="Kích thước payload mỗi frame (byte, tối đa 1023)")
+    parser.add_argument('--duration', type=float, default=20.0, help="Thời gian đo (giây)")
+    parser.add_argument('--ramp', type=float, default=3.0, help="Thời gian chờ rover kết nối xong (giây)")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Thời gian làm nóng trước khi đo (giây)")
+    parser.add_argument('--gga-interval', type=float, default=10.0)
+    parser.add_argument('--slow-rover-policy', default="drop_oldest")
+    parser.add_argument('--coalesce-ms', type=float, default=0, help="Cửa sổ gộp frame trước khi ghi cho rover (ms)")
+    parser.add_argument('--port', type=int, default=DEFAULT_BENCH_PORT)
+    parser.add_argument('--json', help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+    if not BENCH_STAMP.size + 2 <= args.size <= 1023:
+        parser.error(f"--size phải trong khoảng {BENCH_STAMP.size + 2}..1023")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    for i, engine in enumerate(engines):
+        print(f"[*] Đo engine '{engine}': {args.rovers} rover, {args.rate:g} epoch/s x {args.frames} frame x {args.size} byte, "
+              f"{args.duration:g} giây...")
+        try:
+            # Mỗi engine một cổng riêng để không vướng socket TIME_WAIT của lượt trước
+            results.append(run_benchmark(engine, args.port + i, args))
+        except (RuntimeError, OSError) as e:
+            print(f"[!] Engine '{engine}' lỗi: {e}")
+    if results:
+        print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"[+] Đã ghi kết quả vào {args.json}")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
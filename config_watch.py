@@ -0,0 +1,166 @@
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import threading
+
+from event_log import EventLogger
+
+# ==============================================================================
+# Theo dõi file cấu hình để nạp lại khi đang chạy (inotify, dự phòng bằng polling)
+# ==============================================================================
+# inotify theo dõi thư mục chứa file chứ không phải bản thân file: trình soạn thảo thường
+# ghi ra file tạm rồi rename đè lên, khi đó inode cũ (và watch trên nó) biến mất.
+# Sau mỗi sự kiện chờ thêm một khoảng ngắn để gộp các lần ghi liên tiếp, và chỉ gọi
+# on_change khi nội dung thật sự khác lần đã áp dụng. SIGHUP gọi trigger() để nạp lại ngay.
+
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_SETTLE_DELAY = 0.2
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (theo sau là tên file)
+
+log = EventLogger("config")
+
+
+def _open_inotify(directory):
+    """Trả về fd inotify đang theo dõi `directory`, hoặc None nếu hệ điều hành không hỗ trợ."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    if add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ConfigWatcher(threading.Thread):
+    """Gọi on_change(config_data) mỗi khi file JSON đổi nội dung hợp lệ.
+
+    settings: "method" ("auto", "inotify", "poll"), "poll_interval" (giây).
+    File lỗi cú pháp được bỏ qua (giữ cấu hình đang chạy) và báo lỗi một lần.
+    """
+    def __init__(self, path, on_change, settings=None):
+        super().__init__(name="ConfigWatcher", daemon=True)
+        settings = settings or {}
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.method = settings.get('method', 'auto')
+        self.poll_interval = settings.get('poll_interval', DEFAULT_POLL_INTERVAL)
+        self.stop_event = threading.Event()
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_write, False)
+        self._digest = self._read()[1]
+        self._stat = self._stat_key()
+
+    def trigger(self):
+        """Yêu cầu nạp lại ngay; an toàn khi gọi từ signal handler."""
+        try:
+            os.write(self._wake_write, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def stop(self):
+        self.stop_event.set()
+        self.trigger()
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            return e, None
+        return raw, hashlib.sha256(raw).hexdigest()
+
+    def _check(self, forced=False):
+        raw, digest = self._read()
+        if digest is None:
+            log.error("config_reload_failed", "[!] Không đọc được file cấu hình %s: %s", self.path, raw)
+            return
+        if digest == self._digest and not forced:
+            return
+        try:
+            config_data = json.loads(raw.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as e:
+            if digest != self._digest:
+                log.error("config_reload_failed", "[!] File cấu hình %s không hợp lệ, giữ cấu hình đang chạy: %s", self.path, e)
+            self._digest = digest
+            return
+        self._digest = digest
+        try:
+            self.on_change(config_data)
+        except Exception as e:
+            log.error("config_reload_failed", "[!] Lỗi khi áp dụng cấu hình mới: %s", e)
+
+    def _drain(self, fd):
+        names = set()
+        try:
+            while True:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                offset = 0
+                while offset + _EVENT.size <= len(data):
+                    _, _, _, length = _EVENT.unpack_from(data, offset)
+                    offset += _EVENT.size
+                    names.add(data[offset:offset + length].rstrip(b"\0").decode(errors='ignore'))
+                    offset += length
+        except BlockingIOError:
+            pass
+        return names
+
+    def run(self):
+        inotify_fd = None
+        if self.method in ('auto', 'inotify'):
+            inotify_fd = _open_inotify(os.path.dirname(self.path))
+            if inotify_fd is None and self.method == 'inotify':
+                log.warning("config_watch_fallback", "[!] Không dùng được inotify, chuyển sang kiểm tra định kỳ.")
+        mode = "inotify" if inotify_fd is not None else f"kiểm tra mỗi {self.poll_interval:g}s"
+        log.info("config_watch_started", "[*] Đang theo dõi %s (%s); gửi SIGHUP để nạp lại ngay.", self.path, mode)
+        filename = os.path.basename(self.path)
+        watched = [self._wake_read] + ([inotify_fd] if inotify_fd is not None else [])
+        try:
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select(watched, [], [], 1.0 if inotify_fd is not None else self.poll_interval)
+                if self.stop_event.is_set():
+                    break
+                forced = False
+                changed = False
+                if self._wake_read in readable:
+                    os.read(self._wake_read, 4096)
+                    forced = True
+                if inotify_fd is not None:
+                    changed = inotify_fd in readable and filename in self._drain(inotify_fd)
+                else:
+                    stat = self._stat_key()
+                    changed, self._stat = stat != self._stat, stat
+                if not (forced or changed):
+                    continue
+                # Gộp các lần ghi liên tiếp của cùng một lần lưu file
+                self.stop_event.wait(DEFAULT_SETTLE_DELAY)
+                if inotify_fd is not None:
+                    self._drain(inotify_fd)
+                self._check(forced)
+        finally:
+            if inotify_fd is not None:
+                os.close(inotify_fd)
+            os.close(self._wake_read)
+            os.close(self._wake_write)
@@ -0,0 +1,238 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from event_log import EventLogger
+
+# ==============================================================================
+# Kho tài khoản rover: tra dict theo username, mật khẩu lưu dạng băm có salt
+# ==============================================================================
+# Tài khoản rover trong caster_config.json dùng "password_hash":
+#   pbkdf2_sha256$<số vòng lặp>$<salt base64>$<digest base64>
+# Tạo một mục bằng: python credentials.py <username> <password>
+# Chuyển cả file cấu hình cũ một lần: python credentials.py --migrate [caster_config.json]
+# Tài khoản cũ chỉ có "password" dạng rõ vẫn dùng được nhưng mỗi mục tốn một lần băm
+# hash_iterations vòng (~0.1 giây) khi nạp, để mọi lần tra tốn cùng một thời gian và không lộ
+# danh sách tài khoản; hàng chục nghìn mục như vậy làm caster khởi động chậm hàng phút.
+# Khi nạp lại cấu hình, bản ghi của tài khoản không đổi được lấy lại từ kho cũ, không băm lại.
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+DEFAULT_HASH_ITERATIONS = 200_000
+DEFAULT_AUTH_CACHE_SIZE = 4096
+DEFAULT_AUTH_CACHE_TTL = 300
+DEFAULT_AUTH_WORKERS = 4
+
+log = EventLogger("credentials")
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password, iterations=DEFAULT_HASH_ITERATIONS, salt=None):
+    salt = salt if salt is not None else os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{HASH_ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def parse_password_hash(encoded):
+    """Tách chuỗi password_hash thành (iterations, salt, digest); ValueError nếu sai định dạng."""
+    algorithm, iterations, salt, digest = encoded.split('$')
+    if algorithm != HASH_ALGORITHM:
+        raise ValueError(f"Thuật toán băm không được hỗ trợ: {algorithm}")
+    return int(iterations), base64.b64decode(salt), base64.b64decode(digest)
+
+
+def migrate_accounts(accounts, iterations=DEFAULT_HASH_ITERATIONS, workers=DEFAULT_AUTH_WORKERS):
+    """Đổi "password" dạng rõ thành "password_hash" (băm song song). Trả về (danh sách mới, số mục đã đổi)."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = [pool.submit(hash_password, account['password'], iterations)
+                  if 'password' in account and 'password_hash' not in account else None for account in accounts]
+        migrated = []
+        for account, future in zip(accounts, hashes):
+            if future is not None:
+                account = {key: value for key, value in account.items() if key != 'password'}
+                account['password_hash'] = future.result()
+            migrated.append(account)
+    return migrated, sum(future is not None for future in hashes)
+
+
+def migrate_config_file(path):
+    """Chuyển global_rover_accounts của file cấu hình sang password_hash, theo rover_auth.hash_iterations của file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        config_data = json.load(f)
+    auth_settings = config_data.get('server_settings', {}).get('rover_auth') or {}
+    accounts, count = migrate_accounts(config_data.get('global_rover_accounts', []),
+                                       auth_settings.get('hash_iterations', DEFAULT_HASH_ITERATIONS),
+                                       auth_settings.get('workers', DEFAULT_AUTH_WORKERS))
+    if count:
+        config_data['global_rover_accounts'] = accounts
+        # Ghi file tạm rồi thay thế: ConfigWatcher không bao giờ đọc phải file ghi dở
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(config_data, indent=2, ensure_ascii=False))
+        os.replace(temp_path, path)
+    return count
+
+
+class AuthTokenCache:
+    """LRU các giá trị header Authorization vừa xác thực thành công, mỗi mục hết hạn sau ttl giây."""
+    def __init__(self, max_size=DEFAULT_AUTH_CACHE_SIZE, ttl=DEFAULT_AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (username, hạn dùng)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token, username):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (username, time.monotonic() + self.ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RoverAccountStore:
+    """Xác thực header Basic của rover: O(1) theo username, so sánh thời gian hằng.
+
+    Phép băm chạy trong một ThreadPoolExecutor nhỏ nên luồng accept / event loop không
+    bị chặn và số lõi CPU dùng cho băm bị giới hạn khi cả nghìn rover kết nối lại cùng lúc.
+    Rover kết nối lại với cùng header trong thời gian ttl được chấp nhận từ cache.
+    previous (kho đang chạy, khi nạp lại cấu hình): tài khoản có mật khẩu và số vòng không đổi
+    dùng lại bản ghi đã băm của kho đó.
+    """
+    def __init__(self, accounts, settings=None, previous=None):
+        settings = settings or {}
+        iterations = settings.get('hash_iterations', DEFAULT_HASH_ITERATIONS)
+        self.iterations = iterations
+        if previous is not None and previous.iterations != iterations:
+            previous = None
+        reusable = previous._sources if previous is not None else {}
+        self.cache = AuthTokenCache(settings.get('cache_size', DEFAULT_AUTH_CACHE_SIZE),
+                                    settings.get('cache_ttl', DEFAULT_AUTH_CACHE_TTL))
+        workers = settings.get('workers', DEFAULT_AUTH_WORKERS)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="RoverAuth")
+        self._records = {}
+        # username -> mật khẩu trong cấu hình (chuỗi password_hash, hoặc ('password', mật khẩu rõ))
+        self._sources = {}
+        # Mật khẩu dạng rõ được băm song song (pbkdf2_hmac nhả GIL) trên một pool tạm, đóng hẳn trước
+        # khi trả về: pool xác thực chưa được có thread khi caster fork worker, nếu không các thread
+        # đó không tồn tại trong tiến trình con và mọi lần xác thực ở worker treo mãi
+        loader = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="RoverAuthLoad")
+        pending = {}
+        for account in accounts:
+            username = account.get('username')
+            source = account['password_hash'] if 'password_hash' in account else ('password', account.get('password'))
+            if username in reusable and reusable[username] == source:
+                self._records[username] = previous._records[username]
+                self._sources[username] = source
+                continue
+            try:
+                if 'password_hash' in account:
+                    record = parse_password_hash(account['password_hash'])
+                    if record[0] != iterations:
+                        log.warning("rover_account_iterations", "[!] Tài khoản rover '%s' băm %s vòng, khác hash_iterations (%s): "
+                                    "thời gian xác thực có thể lộ tài khoản này tồn tại.", username, record[0], iterations)
+                    self._records[username] = record
+                    self._sources[username] = source
+                else:
+                    pending[username] = (source, loader.submit(hash_password, account['password'], iterations))
+            except (KeyError, ValueError, TypeError) as e:
+                log.warning("rover_account_skipped", "[!] Bỏ qua tài khoản rover '%s': mật khẩu không hợp lệ (%s).",
+                            username, e)
+        for username, (source, future) in pending.items():
+            try:
+                self._records[username] = parse_password_hash(future.result())
+                self._sources[username] = source
+            except (AttributeError, TypeError) as e:
+                log.warning("rover_account_skipped", "[!] Bỏ qua tài khoản rover '%s': mật khẩu không hợp lệ (%s).",
+                            username, e)
+        loader.shutdown()
+        if pending:
+            log.warning("rover_accounts_plaintext", "[!] %s tài khoản rover còn dùng 'password' dạng rõ và phải băm lại mỗi lần "
+                        "khởi động. Chuyển sang 'password_hash': python credentials.py --migrate", len(pending))
+        # Username không tồn tại vẫn tốn một lần băm, để thời gian phản hồi không lộ danh sách tài khoản
+        if previous is not None:
+            self._dummy_record = previous._dummy_record
+        else:
+            self._dummy_record = parse_password_hash(hash_password(os.urandom(8).hex(), iterations=iterations))
+
+    def __len__(self):
+        return len(self._records)
+
+    def verify(self, auth_header):
+        """Trả về concurrent.futures.Future cho kết quả (is_auth, reason)."""
+        if not auth_header:
+            return self._done((False, "Authorization header is missing"))
+        token = auth_header.split(':', 1)[-1].strip()
+        username = self.cache.get(token)
+        if username is not None:
+            return self._done((True, f"Authenticated as {username}"))
+        return self._executor.submit(self._verify_token, token)
+
+    def authenticate(self, auth_header):
+        return self.verify(auth_header).result()
+
+    def shutdown(self, cancel_pending=True):
+        self._executor.shutdown(wait=False, cancel_futures=cancel_pending)
+
+    @staticmethod
+    def _done(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _verify_token(self, token):
+        try:
+            auth_type, auth_token = token.split()
+            if auth_type.lower() != 'basic':
+                return False, f"Unsupported Auth type: {auth_type}"
+            username, password = base64.b64decode(auth_token).decode().split(':', 1)
+        except Exception as e:
+            log.warning("auth_header_malformed", "[!] Lỗi phân tích Auth Header: %s", e)
+            return False, "Malformed Authorization header"
+
+        record = self._records.get(username)
+        iterations, salt, digest = record if record is not None else self._dummy_record
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+        if record is None or not hmac.compare_digest(candidate, digest):
+            return False, f"Invalid credentials for user '{username}'"
+        self.cache.put(token, username)
+        return True, f"Authenticated as {username}"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--migrate':
+        # Chuyển một lần mọi tài khoản dạng rõ trong file cấu hình sang password_hash
+        config_path = sys.argv[2] if len(sys.argv) == 3 else "caster_config.json"
+        print(f"Đã chuyển {migrate_config_file(config_path)} tài khoản sang password_hash trong {config_path}.")
+        sys.exit(0)
+    # Sinh một mục tài khoản để dán vào "global_rover_accounts"
+    if len(sys.argv) != 3:
+        print("Cách dùng: python credentials.py <username> <password>")
+        print("           python credentials.py --migrate [caster_config.json]")
+        sys.exit(1)
+    print(f'{{"username": "{sys.argv[1]}", "password_hash": "{hash_password(sys.argv[2])}"}}')
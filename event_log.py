@@ -0,0 +1,195 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+
+from admission import TokenBucket
+
+# ==============================================================================
+# Log sự kiện có cấu trúc, ghi bất đồng bộ, giới hạn tốc độ theo khóa sự kiện
+# ==============================================================================
+# Thread phát log (rover, base, event loop) chỉ kiểm tra hạn mức của khóa sự kiện rồi
+# đẩy LogRecord vào một hàng đợi có giới hạn; định dạng chuỗi và ghi ra stdout/file do
+# QueueListener làm trên thread riêng. Hàng đợi đầy thì bản ghi bị bỏ (và được đếm),
+# không bao giờ chặn đường dữ liệu. Khi chưa gọi configure_logging(), log được in thẳng
+# ra màn hình như print() trước đây.
+
+LOGGER_NAME = "ntrip"
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_LOG_FORMAT = "text"
+DEFAULT_LOG_QUEUE_SIZE = 10000
+
+_MARKER = re.compile(r"^\[[+\-!*]\] ")
+
+_limiter = None
+_listener = None
+_queue_handler = None
+_settings = None
+
+
+class EventRateLimiter:
+    """Hạn mức theo khóa sự kiện: "rate"/"burst" (token bucket) và "sample" (giữ 1 trên N).
+
+    Khóa không có luật riêng dùng luật "default" nếu có. Số bản ghi bị bỏ được báo kèm
+    ở bản ghi kế tiếp được phép của cùng khóa (trường "suppressed").
+    """
+    def __init__(self, rules):
+        self._rules = rules or {}
+        self._state = {}  # khóa -> [bucket hoặc None, sample, số lần gặp, số bị bỏ]
+        self._lock = threading.Lock()
+
+    def _new_state(self, key):
+        rule = self._rules.get(key, self._rules.get('default')) or {}
+        bucket = None
+        if rule.get('rate'):
+            bucket = TokenBucket(rule['rate'], rule.get('burst', rule['rate']))
+        state = self._state[key] = [bucket, max(1, int(rule.get('sample', 1))), 0, 0]
+        return state
+
+    def admit(self, key):
+        """Trả về (được ghi hay không, số bản ghi đã bị bỏ trước đó cần báo lại)."""
+        with self._lock:
+            state = self._state.get(key) or self._new_state(key)
+            state[2] += 1
+            if (state[1] > 1 and (state[2] - 1) % state[1]) or (state[0] is not None and not state[0].try_take()):
+                state[3] += 1
+                return False, 0
+            suppressed, state[3] = state[3], 0
+            return True, suppressed
+
+
+class EventLogger:
+    """Logger theo sự kiện: log.info("rover_auth_failed", "[-] Rover %s ...", address, reason=...).
+
+    Tham số định dạng được giữ nguyên tới thread ghi log nên bản ghi bị giới hạn tốc độ
+    không tốn công tạo chuỗi.
+    """
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+    def event(self, level, key, message, *args, **fields):
+        if _queue_handler is None:
+            print(message % args if args else message)
+            return
+        if not self._logger.isEnabledFor(level):
+            return
+        if _limiter is not None:
+            allowed, suppressed = _limiter.admit(key)
+            if not allowed:
+                return
+            if suppressed:
+                fields['suppressed'] = suppressed
+        self._logger.log(level, message, *args, extra={'event': key, 'fields': fields})
+
+    def info(self, key, message, *args, **fields):
+        self.event(logging.INFO, key, message, *args, **fields)
+
+    def warning(self, key, message, *args, **fields):
+        self.event(logging.WARNING, key, message, *args, **fields)
+
+    def error(self, key, message, *args, **fields):
+        self.event(logging.ERROR, key, message, *args, **fields)
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Mỗi bản ghi là một dòng JSON: ts, level, logger, event, msg và các trường riêng của sự kiện."""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', None),
+            'msg': _MARKER.sub('', record.getMessage()),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Giữ nguyên dạng dòng "[+] ..." quen thuộc trên màn hình."""
+    def format(self, record):
+        line = record.getMessage()
+        suppressed = (getattr(record, 'fields', None) or {}).get('suppressed')
+        if suppressed:
+            line += f" (đã bỏ {suppressed} dòng tương tự)"
+        return line
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không định dạng trên thread gọi và không bao giờ chặn khi hàng đợi đầy."""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(settings=None):
+    """Bật log qua hàng đợi theo server_settings["logging"]; gọi một lần khi khởi động."""
+    global _limiter, _listener, _queue_handler, _settings
+    settings = settings or {}
+    shutdown_logging()
+    _settings = settings
+
+    if settings.get('file'):
+        output = logging.handlers.WatchedFileHandler(settings['file'], encoding='utf-8')
+    else:
+        output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonLineFormatter() if settings.get('format', DEFAULT_LOG_FORMAT) == 'json' else TextFormatter())
+
+    log_queue = queue.Queue(maxsize=settings.get('queue_size', DEFAULT_LOG_QUEUE_SIZE))
+    _queue_handler = _DeferredQueueHandler(log_queue)
+    root = logging.getLogger(LOGGER_NAME)
+    root.setLevel(settings.get('level', DEFAULT_LOG_LEVEL))
+    root.addHandler(_queue_handler)
+    root.propagate = False
+    _limiter = EventRateLimiter(settings.get('rate_limits'))
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+
+def dropped_records():
+    return 0 if _queue_handler is None else _queue_handler.dropped
+
+
+def shutdown_logging():
+    """Ghi nốt các bản ghi còn trong hàng đợi rồi quay về chế độ in trực tiếp."""
+    global _limiter, _listener, _queue_handler, _settings
+    _settings = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    if _queue_handler is not None:
+        logging.getLogger(LOGGER_NAME).removeHandler(_queue_handler)
+    _limiter = _listener = _queue_handler = None
+
+
+def _reconfigure_after_fork():
+    # Thread QueueListener không tồn tại trong tiến trình con (worker của caster): dựng lại
+    # hàng đợi và listener riêng thay vì đẩy bản ghi vào hàng đợi không ai đọc
+    global _limiter, _listener, _queue_handler
+    if _queue_handler is None:
+        return
+    settings = _settings
+    logging.getLogger(LOGGER_NAME).removeHandler(_queue_handler)
+    _limiter = _listener = _queue_handler = None
+    configure_logging(settings)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reconfigure_after_fork)
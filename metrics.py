@@ -0,0 +1,321 @@
+import threading
+from bisect import bisect_left
+
+# ==============================================================================
+# Metric kiểu Prometheus, cộng dồn theo từng thread (không khóa trên đường nóng)
+# ==============================================================================
+# Mỗi thread ghi vào một dict "shard" riêng nên inc()/observe() không tranh chấp khóa
+# giữa các rover; vòng lặp của rover còn giữ sẵn ô của mình (RoverMeter). Khi
+# /metrics được đọc, các shard được cộng lại; shard của thread đã kết thúc được gộp vào
+# một shard chung để danh sách shard không phình theo số rover đã từng kết nối.
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_BYTES_BUCKETS = (0, 512, 2048, 8192, 16384, 32768, 65536, 131072, 262144)
+DEFAULT_SLOTS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def log_linear_buckets(lowest, highest, steps_per_octave):
+    """Cận bucket kiểu HDR: mỗi khoảng gấp đôi chia đều thành steps_per_octave bucket.
+
+    Sai số tương đối của mọi bucket như nhau (khoảng 1/steps_per_octave) từ mili giây tới hàng chục giây.
+    """
+    bounds = []
+    octave = lowest
+    while octave < highest:
+        step = octave / steps_per_octave
+        bounds.extend(round(octave + step * i, 6) for i in range(steps_per_octave))
+        octave *= 2
+    bounds.append(round(octave, 6))
+    return tuple(bounds)
+
+
+DEFAULT_GAP_BUCKETS = log_linear_buckets(0.01, 60, 2)
+
+
+def _observe(row, bounds, value):
+    row[bisect_left(bounds, value)] += 1
+    row[-1] += value
+
+
+class _Bound:
+    """Metric đã gắn nhãn. Giá trị nằm trong "ô" (list) riêng của từng thread.
+
+    Counter/gauge là ô 1 phần tử; histogram là len(buckets) bucket + bucket +Inf + tổng
+    (số lần quan sát được tính lại từ các bucket khi xuất).
+    Vòng lặp nóng lấy cell() một lần rồi cộng thẳng vào ô, không tra shard ở mỗi lần cập nhật.
+    """
+    __slots__ = ('_registry', '_key', '_size', 'bounds')
+
+    def __init__(self, registry, key, bounds=None):
+        self._registry = registry
+        self._key = key
+        self.bounds = bounds
+        self._size = 1 if bounds is None else len(bounds) + 2
+
+    def cell(self):
+        """Ô của thread hiện tại; chỉ được ghi từ chính thread đó."""
+        shard = self._registry.shard()
+        cell = shard.get(self._key)
+        if cell is None:
+            cell = shard[self._key] = [0] * self._size
+        return cell
+
+    def inc(self, amount=1):
+        self.cell()[0] += amount
+
+    def dec(self, amount=1):
+        self.cell()[0] -= amount
+
+    def observe(self, value):
+        _observe(self.cell(), self.bounds, value)
+
+
+class Metric:
+    """Một họ metric (counter, gauge hoặc histogram); labels() trả về đối tượng gắn sẵn nhãn để dùng lại."""
+    def __init__(self, registry, kind, name, help_text, labelnames=(), buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+
+    def labels(self, **labels):
+        key = (self.name, tuple(str(labels[n]) for n in self.labelnames))
+        return _Bound(self.registry, key, self.buckets)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, dict)
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._callbacks = []
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Metric(self, 'counter', name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Metric(self, 'gauge', name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Metric(self, 'histogram', name, help_text, labelnames, buckets))
+
+    def add_callback(self, callback):
+        """callback() trả về danh sách (tên, kiểu, help, [(dict nhãn, giá trị)]) đọc tại thời điểm scrape."""
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    @staticmethod
+    def _merge(target, source):
+        for key, cell in source.items():
+            row = target.get(key)
+            if row is None:
+                target[key] = list(cell)
+            else:
+                for i, v in enumerate(cell):
+                    row[i] += v
+
+    def collect(self):
+        """Cộng mọi shard thành một dict {(tên, giá trị nhãn): ô đã cộng}."""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # Thread đã kết thúc không còn ghi vào shard này nữa
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            totals = {}
+            self._merge(totals, self._retired)
+            for _, shard in alive:
+                # dict.copy() là nguyên tử dưới GIL nên không cần khóa thread đang ghi
+                self._merge(totals, shard.copy())
+        return totals
+
+    def render(self):
+        """Xuất toàn bộ metric theo định dạng văn bản Prometheus 0.0.4."""
+        totals = self.collect()
+        by_name = {}
+        for (name, label_values), value in totals.items():
+            by_name.setdefault(name, []).append((label_values, value))
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for label_values, value in sorted(by_name.get(metric.name, ())):
+                labels = dict(zip(metric.labelnames, label_values))
+                if metric.kind != 'histogram':
+                    lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value[0])}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(f"{metric.name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {cumulative}")
+        for callback in list(self._callbacks):
+            for name, kind, help_text, samples in callback():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return ("\n".join(lines) + "\n").encode()
+
+    def http_response(self):
+        body = self.render()
+        return (b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def serve_metrics(registry, host, port):
+    """Cổng phụ chỉ phục vụ GET /metrics (thread daemon), khi không muốn dùng chung cổng caster."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"Metrics-{port}", daemon=True).start()
+    return server
+
+
+REGISTRY = MetricsRegistry()
+
+# ====== Metric của caster ======
+BYTES_IN = REGISTRY.counter('ntrip_mountpoint_bytes_in_total', 'Byte nhận từ nguồn dữ liệu', ('mountpoint',))
+FRAMES_IN = REGISTRY.counter('ntrip_mountpoint_frames_in_total', 'Gói (frame RTCM hoặc chunk) phát vào ring', ('mountpoint',))
+BYTES_OUT = REGISTRY.counter('ntrip_mountpoint_bytes_out_total', 'Byte đã giao cho socket rover', ('mountpoint',))
+FRAMES_OUT = REGISTRY.counter('ntrip_mountpoint_frames_out_total', 'Gói đã đưa vào bộ đệm gửi của rover', ('mountpoint',))
+SEND_BATCHES = REGISTRY.counter('ntrip_mountpoint_send_batches_total', 'Số lượt ghi gộp (sendmsg/writelines) vào socket rover',
+                                ('mountpoint',))
+ROVERS_CONNECTED = REGISTRY.gauge('ntrip_rovers_connected', 'Số rover đang nhận dữ liệu', ('mountpoint',))
+ROVER_DELIVERY_SECONDS = REGISTRY.histogram(
+    'ntrip_rover_delivery_seconds', 'Thời gian từ lúc gói vào ring tới lúc được giao hết cho socket rover', ('mountpoint',))
+ROVER_SEND_BUFFER_BYTES = REGISTRY.histogram(
+    'ntrip_rover_send_buffer_bytes', 'Byte còn chờ trong bộ đệm gửi của rover sau mỗi lần gửi', ('mountpoint',),
+    buckets=DEFAULT_BYTES_BUCKETS)
+ROVER_RING_LAG_SLOTS = REGISTRY.histogram(
+    'ntrip_rover_ring_lag_slots', 'Số slot rover phải đọc bù ở mỗi lần đọc ring', ('mountpoint',),
+    buckets=DEFAULT_SLOTS_BUCKETS)
+AUTH_SECONDS = REGISTRY.histogram('ntrip_auth_seconds', 'Thời gian xác thực rover', ('result',))
+SOURCETABLE_REQUESTS = REGISTRY.counter('ntrip_sourcetable_requests_total', 'Yêu cầu sourcetable theo kiểu phản hồi',
+                                        ('response',))
+UPSTREAM_RECONNECTS = REGISTRY.counter('ntrip_upstream_reconnects_total', 'Số lần kết nối lại upstream', ('upstream',))
+UPSTREAM_FAILOVERS = REGISTRY.counter('ntrip_upstream_failovers_total', 'Số lần chuyển endpoint upstream của mountpoint',
+                                     ('mountpoint',))
+SOURCE_ARRIVAL_GAP_SECONDS = REGISTRY.histogram(
+    'ntrip_source_arrival_gap_seconds', 'Khoảng cách giữa hai lần nhận dữ liệu từ nguồn', ('source',),
+    buckets=DEFAULT_GAP_BUCKETS)
+SOURCE_EPOCH_SECONDS = REGISTRY.histogram(
+    'ntrip_source_epoch_interval_seconds', 'Khoảng cách giữa hai epoch quan trắc RTCM của nguồn', ('source',),
+    buckets=DEFAULT_GAP_BUCKETS)
+SOURCE_STALLS = REGISTRY.counter('ntrip_source_stalls_total', 'Số lần nguồn im lặng quá ngưỡng và bị ngắt', ('source',))
+
+
+class RoverMeter:
+    """Ô metric của một rover trong shard của thread đang phục vụ nó (tạo và dùng trên cùng thread).
+
+    Cập nhật được viết thẳng vào list thay vì gọi observe(): mỗi vòng gửi chỉ còn vài phép
+    cộng list, và trường hợp phổ biến nhất (đã gửi hết, bộ đệm rỗng) không cần bisect.
+    """
+    __slots__ = ('_frames_out', '_bytes_out', '_send_batches', '_lag', '_lag_bounds', '_buffer', '_buffer_bounds',
+                 '_delivery', '_delivery_bounds')
+
+    def __init__(self, metrics):
+        self._frames_out = metrics.frames_out.cell()
+        self._bytes_out = metrics.bytes_out.cell()
+        self._send_batches = metrics.send_batches.cell()
+        self._lag, self._lag_bounds = metrics.ring_lag.cell(), metrics.ring_lag.bounds
+        self._buffer, self._buffer_bounds = metrics.send_buffer.cell(), metrics.send_buffer.bounds
+        self._delivery, self._delivery_bounds = metrics.delivery.cell(), metrics.delivery.bounds
+
+    def on_read(self, frame_count):
+        self._frames_out[0] += frame_count
+        lag = self._lag
+        lag[bisect_left(self._lag_bounds, frame_count)] += 1
+        lag[-1] += frame_count
+
+    def on_send(self, sent_bytes, pending_bytes, delivery_seconds=None):
+        if sent_bytes:
+            self._bytes_out[0] += sent_bytes
+            self._send_batches[0] += 1
+        buffer = self._buffer
+        if pending_bytes:
+            buffer[bisect_left(self._buffer_bounds, pending_bytes)] += 1
+            buffer[-1] += pending_bytes
+        else:
+            # Bucket đầu tiên có cận trên 0
+            buffer[0] += 1
+        if delivery_seconds is not None:
+            delivery = self._delivery
+            delivery[bisect_left(self._delivery_bounds, delivery_seconds)] += 1
+            delivery[-1] += delivery_seconds
+
+
+class MountpointMetrics:
+    """Các metric đã gắn nhãn của một mountpoint, tạo một lần khi dựng stream."""
+    def __init__(self, mountpoint):
+        self.bytes_in = BYTES_IN.labels(mountpoint=mountpoint)
+        self.frames_in = FRAMES_IN.labels(mountpoint=mountpoint)
+        self.bytes_out = BYTES_OUT.labels(mountpoint=mountpoint)
+        self.frames_out = FRAMES_OUT.labels(mountpoint=mountpoint)
+        self.send_batches = SEND_BATCHES.labels(mountpoint=mountpoint)
+        self.rovers = ROVERS_CONNECTED.labels(mountpoint=mountpoint)
+        self.delivery = ROVER_DELIVERY_SECONDS.labels(mountpoint=mountpoint)
+        self.send_buffer = ROVER_SEND_BUFFER_BYTES.labels(mountpoint=mountpoint)
+        self.ring_lag = ROVER_RING_LAG_SLOTS.labels(mountpoint=mountpoint)
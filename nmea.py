@@ -0,0 +1,91 @@
+import time
+
+# ==============================================================================
+# Tạo câu NMEA GGA cho vị trí cố định từ mẫu dựng sẵn
+# ==============================================================================
+# Chỉ trường thời gian thay đổi giữa các lần gửi, nên phần đầu/cuối câu và checksum
+# XOR của chúng được tính một lần; mỗi tick chỉ ghép 3 cặp chữ số giờ/phút/giây
+# và XOR thêm 3 giá trị tra bảng.
+
+_TWO_DIGITS = tuple(f"{i:02d}".encode() for i in range(100))
+_TWO_DIGITS_XOR = tuple(pair[0] ^ pair[1] for pair in _TWO_DIGITS)
+_HEX_BYTE = tuple(f"{i:02X}".encode() for i in range(256))
+
+
+# ====== Chuyển đổi tọa độ từ decimal degrees sang NMEA format ======
+def convert_to_nmea_format(lat, lon):
+    lat_abs = abs(lat)
+    lat_deg = int(lat_abs)
+    lat_min = (lat_abs - lat_deg) * 60
+    lat_dir = "N" if lat >= 0 else "S"
+    lat_nmea = f"{lat_deg:02d}{lat_min:06.3f}"
+    lon_abs = abs(lon)
+    lon_deg = int(lon_abs)
+    lon_min = (lon_abs - lon_deg) * 60
+    lon_dir = "E" if lon >= 0 else "W"
+    lon_nmea = f"{lon_deg:03d}{lon_min:06.3f}"
+    return lat_nmea, lat_dir, lon_nmea, lon_dir
+
+
+def nmea_checksum(data):
+    checksum = 0
+    for byte in data:
+        checksum ^= byte
+    return checksum
+
+
+class GgaTemplate:
+    """Câu $GPGGA cho một vị trí cố định; render() trả về bytes sẵn sàng gửi."""
+    def __init__(self, lat, lon):
+        lat_nmea, lat_dir, lon_nmea, lon_dir = convert_to_nmea_format(lat, lon)
+        self.lat = lat
+        self.lon = lon
+        self._prefix = b"$GPGGA,"
+        self._suffix = f".00,{lat_nmea},{lat_dir},{lon_nmea},{lon_dir},1,12,1.0,10.0,M,0.0,M,,".encode()
+        # Checksum NMEA là XOR mọi ký tự giữa '$' và '*'
+        self._partial_checksum = nmea_checksum(self._prefix[1:]) ^ nmea_checksum(self._suffix)
+        self._last_second = None
+        self._last_sentence = None
+
+    def render(self, now=None):
+        second_of_day = int(time.time() if now is None else now) % 86400
+        if second_of_day == self._last_second:
+            return self._last_sentence
+        hours, remainder = divmod(second_of_day, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        checksum = (self._partial_checksum ^ _TWO_DIGITS_XOR[hours]
+                    ^ _TWO_DIGITS_XOR[minutes] ^ _TWO_DIGITS_XOR[seconds])
+        sentence = b"".join((self._prefix, _TWO_DIGITS[hours], _TWO_DIGITS[minutes], _TWO_DIGITS[seconds],
+                             self._suffix, b"*", _HEX_BYTE[checksum], b"\r\n"))
+        self._last_second = second_of_day
+        self._last_sentence = sentence
+        return sentence
+
+
+def parse_gga(sentence):
+    """Lấy (lat, lon) từ một câu $xxGGA; None nếu không phải GGA, sai checksum hoặc chưa có fix."""
+    if isinstance(sentence, (bytes, bytearray)):
+        sentence = sentence.decode('ascii', errors='ignore')
+    sentence = sentence.strip()
+    if not sentence.startswith('$') or sentence[3:6] != 'GGA':
+        return None
+    body, _, checksum = sentence[1:].partition('*')
+    if checksum:
+        try:
+            if nmea_checksum(body.encode('ascii', errors='ignore')) != int(checksum[:2], 16):
+                return None
+        except ValueError:
+            return None
+    fields = body.split(',')
+    try:
+        if len(fields) < 7 or fields[6] in ('', '0'):
+            return None
+        lat = int(fields[2][:2]) + float(fields[2][2:]) / 60
+        lon = int(fields[4][:3]) + float(fields[4][3:]) / 60
+    except ValueError:
+        return None
+    if fields[3] == 'S':
+        lat = -lat
+    if fields[5] == 'W':
+        lon = -lon
+    return lat, lon
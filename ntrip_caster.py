@@ -2,170 +2,873 @@ import socket
 import threading
 import time
 import base64
+import hmac
 import json
 import os
-from queue import Queue, Empty
-from datetime import datetime
+import random
+import asyncio
+import importlib
+import multiprocessing
+import selectors
+import select
+import signal
+import weakref
+from collections import deque, Counter
+from itertools import islice
+
+from admission import AdmissionController, BUSY_RESPONSE, DEFAULT_LISTEN_BACKLOG
+from config_watch import ConfigWatcher
+from credentials import RoverAccountStore
+from event_log import EventLogger, configure_logging, dropped_records, shutdown_logging
+from metrics import (REGISTRY, AUTH_SECONDS, SOURCETABLE_REQUESTS, UPSTREAM_FAILOVERS, UPSTREAM_RECONNECTS, MountpointMetrics,
+                     RoverMeter, serve_metrics)
+from nmea import GgaTemplate, parse_gga
+from ntrip_http import (CHUNK_END, HEAD_END, LAST_CHUNK, METHOD_NOT_ALLOWED_RESPONSE, ChunkedDecoder, ResponseReader,
+                        basic_auth_credentials, chunk_header, encode_chunk, ntrip_version, recv_head, request_chunked,
+                        request_keep_alive, request_method, source_response, split_head, stream_response)
+from rtcm import RtcmFramer, DEFAULT_PRIMING_MESSAGE_TYPES, is_end_of_epoch
+from shared_ring import SharedRtcmRing, WorkerWakeup, channel_pair, DEFAULT_SHARED_RING_MB, DEFAULT_SHARED_RING_SLOTS
+from rtcm_archive import RtcmArchiveReader, RtcmArchiveWriter, archive_directory, parse_time, DEFAULT_ARCHIVE_DIRECTORY
+from sourcetable import EncodedSourcetable, station_entry
+from stream_health import StreamWatchdog
+from spatial_index import KdTree, haversine_km
 
 CONFIG_FILE = "caster_config.json"
+DEFAULT_RING_SLOTS = 256
+DEFAULT_ENGINE = "thread"
+DEFAULT_ROVER_SEND_BUFFER = 64 * 1024
+# Cửa sổ gộp frame trước khi ghi (ms, 0 = ghi ngay) và ngưỡng byte ghi ngay không chờ hết cửa sổ
+DEFAULT_ROVER_COALESCE_MS = 0
+COALESCE_FLUSH_BYTES = 16 * 1024
+# Số buffer tối đa trong một lần sendmsg (IOV_MAX của hệ điều hành)
+SENDMSG_MAX_BUFFERS = min(os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 16, 1024)
+SLOW_ROVER_POLICIES = ("drop_oldest", "skip_to_latest", "disconnect")
+DEFAULT_SLOW_ROVER_POLICY = "drop_oldest"
+DEFAULT_NEAREST_MOUNTPOINT = "NEAREST"
+DEFAULT_REROUTE_DISTANCE_KM = 10.0
+DEFAULT_GGA_TIMEOUT = 30
+# Backoff kết nối lại upstream (giây) và thời gian chờ endpoint mới đăng ký có gói đầu tiên
+# (kết nối TCP + handshake tới caster ở xa) trước khi coi là mất
+DEFAULT_RECONNECT_INITIAL = 1.0
+DEFAULT_RECONNECT_MAX = 30.0
+DEFAULT_UPSTREAM_CONNECT_GRACE = 5.0
+# Timeout socket cũ của nguồn, nay là trần của StreamWatchdog; và timeout nhỏ nhất cho một lần đọc nguồn
+BASE_READ_TIMEOUT = 30
+UPSTREAM_READ_TIMEOUT = 15
+MIN_SOURCE_READ_TIMEOUT = 0.05
+# Method Base dùng để đẩy dữ liệu: SOURCE (NTRIP 1.0) và POST (NTRIP 2.0)
+SOURCE_METHODS = ('SOURCE', 'POST')
+# Kích thước tối đa một lần bàn giao socket Base từ worker: header + RTCM đã đọc (base64) + JSON
+HANDOFF_MAX_PAYLOAD = 256 * 1024
+# Failover nhiều endpoint: thời gian endpoint ưu tiên phải ổn định trước khi quay về, số lần lỗi để bỏ dự phòng
+DEFAULT_FAILBACK_AFTER = 30.0
+STANDBY_MAX_FAILURES = 3
+# Endpoint đang dùng bị coi là im lặng sau silence_multiple lần nhịp đã học, không dưới min_silence giây
+# và không dưới phân vị FAILOVER_GAP_PERCENTILE của khoảng cách nhận đã thấy (upstream gửi theo đợt)
+DEFAULT_FAILOVER_SILENCE_MULTIPLE = 2.0
+DEFAULT_FAILOVER_MIN_SILENCE = 1.0
+FAILOVER_GAP_PERCENTILE = 0.99
+FAILOVER_CHECK_INTERVAL = 0.2
+DEFAULT_METRICS_PATH = "/metrics"
+# server_settings chỉ có hiệu lực khi khởi động; đổi khi đang chạy chỉ được cảnh báo
+RESTART_REQUIRED_SETTINGS = ('host', 'port', 'engine', 'event_loop', 'workers', 'listen_backlog', 'metrics_host',
+                             'metrics_port', 'shared_ring_mb', 'shared_ring_slots', 'config_reload')
+
+log = EventLogger("caster")
 
 # ==============================================================================
-# Lớp NtripClientWorker (Không thay đổi)
+# Bộ đệm vòng broadcast (1 producer - nhiều consumer) cho dữ liệu RTCM
 # ==============================================================================
+class SlowConsumerError(Exception):
+    """Con trỏ đọc của rover bị writer bỏ xa quá giới hạn lag cho phép."""
+    def __init__(self, lag):
+        super().__init__(f"lag {lag} slot")
+        self.lag = lag
+
+
+class MountpointClosedError(Exception):
+    """Mountpoint đã bị gỡ khỏi cấu hình (nạp lại khi đang chạy), rover phải ngắt kết nối."""
+
+
+class RtcmBroadcastBuffer:
+    """Vòng cố định các slot memoryview, mỗi rover giữ một con trỏ đọc riêng.
+
+    Writer không bao giờ bị chặn: slot cũ nhất bị ghi đè, và rover nào tụt lại
+    quá `max_lag` slot sẽ nhận SlowConsumerError ở lần đọc kế tiếp. Mọi rover
+    đọc chung cùng một đối tượng memoryview, không có bản sao riêng cho từng rover.
+    """
+    def __init__(self, capacity=DEFAULT_RING_SLOTS, max_lag=None):
+        self.capacity = capacity
+        self.max_lag = min(max_lag or capacity, capacity)
+        self._slots = [None] * capacity
+        self._types = [None] * capacity
+        # Thời điểm (monotonic) gói được ghi vào slot, để đo độ trễ giao tới rover
+        self._stamps = [0.0] * capacity
+        self._write_seq = 0
+        self._cond = threading.Condition()
+        self._listeners = []
+        # Con trỏ đọc đang sống (rover bỏ RingReader thì tự rời khỏi tập), để producer đo độ tụt
+        self._readers = weakref.WeakSet()
+        self.closed = False
+
+    @property
+    def write_seq(self):
+        return self._write_seq
+
+    def publish(self, data, msg_type=None):
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        now = time.monotonic()
+        with self._cond:
+            index = self._write_seq % self.capacity
+            self._slots[index] = view
+            self._types[index] = msg_type
+            self._stamps[index] = now
+            self._write_seq += 1
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def publish_many(self, frames):
+        """Ghi một loạt (msg_type, memoryview) với một lần khóa và một lần đánh thức reader."""
+        now = time.monotonic()
+        with self._cond:
+            seq, capacity = self._write_seq, self.capacity
+            for msg_type, view in frames:
+                index = seq % capacity
+                self._slots[index] = view
+                self._types[index] = msg_type
+                self._stamps[index] = now
+                seq += 1
+            self._write_seq = seq
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def add_listener(self, callback):
+        # Callback được gọi (từ thread producer) sau mỗi lần publish, dùng để đánh thức event loop
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def close(self):
+        """Đánh thức mọi reader để chúng nhận MountpointClosedError."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def subscribe(self):
+        # Rover mới bắt đầu từ vị trí writer hiện tại, không nhận lại dữ liệu cũ
+        with self._cond:
+            reader = RingReader(self, self._write_seq)
+            self._readers.add(reader)
+            return reader
+
+    def max_reader_lag(self):
+        """Số slot reader chậm nhất còn chưa đọc (0 nếu không có reader)."""
+        with self._cond:
+            seq = self._write_seq
+            return max((seq - reader.cursor for reader in self._readers), default=0)
+
+
+class RingReader:
+    def __init__(self, ring, cursor):
+        self.ring = ring
+        self.cursor = cursor
+        # Thời điểm publish của gói mới nhất đã đọc
+        self.last_stamp = None
+
+    def lag(self):
+        return self.ring.write_seq - self.cursor
+
+    def read(self, timeout=None):
+        """Trả về danh sách (msg_type, memoryview) mới kể từ lần đọc trước (rỗng nếu hết timeout)."""
+        ring = self.ring
+        with ring._cond:
+            if self.cursor == ring._write_seq and not ring.closed:
+                ring._cond.wait(timeout)
+            if ring.closed:
+                raise MountpointClosedError()
+            end = ring._write_seq
+            lag = end - self.cursor
+            if lag > ring.max_lag:
+                raise SlowConsumerError(lag)
+            slots, types, capacity = ring._slots, ring._types, ring.capacity
+            items = [(types[i % capacity], slots[i % capacity]) for i in range(self.cursor, end)]
+            if items:
+                self.last_stamp = ring._stamps[(end - 1) % capacity]
+            self.cursor = end
+        return items
+
+# ==============================================================================
+# Bộ đệm gửi giới hạn theo byte cho từng rover, kèm chính sách xử lý rover chậm
+# ==============================================================================
+class RoverOutputBuffer:
+    """Hàng đợi frame chờ gửi của một rover, tối đa `max_bytes` byte.
+
+    Khi vượt ngưỡng, áp dụng một trong các chính sách:
+      - drop_oldest: bỏ các frame cũ nhất cho tới khi về dưới ngưỡng
+      - skip_to_latest: bỏ mọi thứ trước epoch quan trắc hoàn chỉnh mới nhất
+      - disconnect: báo cho handler ngắt kết nối rover
+    Frame đang gửi dở (head_offset > 0) không bao giờ bị bỏ để rover không nhận frame cụt.
+
+    coalesce_window (giây) > 0 bật gộp kiểu Nagle: lô frame đến khi bộ đệm đang rỗng được
+    giữ lại tối đa chừng đó thời gian, hoặc tới khi gặp frame kết thúc epoch / đủ
+    COALESCE_FLUSH_BYTES, rồi mới ghi một lần.
+
+    chunked=True (rover NTRIP 2.0) bọc mỗi lô ghi thành một chunk HTTP. Header và CRLF của
+    chunk được chèn vào hàng đợi ngay khi bắt đầu ghi lô; `committed` phần tử đầu hàng đợi
+    từ đó đã thuộc chunk đang ghi dở nên cũng không bị bỏ.
+    """
+    def __init__(self, max_bytes=DEFAULT_ROVER_SEND_BUFFER, policy=DEFAULT_SLOW_ROVER_POLICY, stats=None,
+                 coalesce_window=0.0, chunked=False):
+        if policy not in SLOW_ROVER_POLICIES:
+            raise ValueError(f"Chính sách rover chậm không hợp lệ: {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.coalesce_window = coalesce_window
+        self.chunked = chunked
+        self._hold_until = None
+        self.frames = deque()
+        self.pending_bytes = 0
+        self.head_offset = 0
+        self.committed = 0
+        # Tổng byte đã ghi xuống socket, kể cả phần đóng khung chunk
+        self.written = 0
+        # Bộ đếm riêng của rover; `stats` (Counter dùng chung của mountpoint) được cộng dồn theo
+        self.counters = Counter()
+        self._shared_stats = stats
+
+    def push(self, frames):
+        if frames and self.coalesce_window and not self.pending_bytes:
+            self._hold_until = time.monotonic() + self.coalesce_window
+        for item in frames:
+            self.frames.append(item)
+            self.pending_bytes += len(item[1])
+
+    def hold_time(self):
+        """Số giây còn phải giữ lô hiện tại trước khi ghi (0 = ghi ngay)."""
+        if self._hold_until is None:
+            return 0.0
+        if self.frames and self.pending_bytes < COALESCE_FLUSH_BYTES:
+            msg_type, frame = self.frames[-1]
+            if msg_type is None or not is_end_of_epoch(msg_type, frame):
+                remaining = self._hold_until - time.monotonic()
+                if remaining > 0:
+                    return remaining
+        self._hold_until = None
+        return 0.0
+
+    def enforce_limit(self):
+        """Gọi sau khi đã thử gửi; trả về False nếu rover phải bị ngắt theo chính sách 'disconnect'."""
+        if self.pending_bytes <= self.max_bytes:
+            return True
+        return self._on_overflow()
+
+    def _count(self, key, amount=1):
+        self.counters[key] += amount
+        if self._shared_stats is not None:
+            self._shared_stats[key] += amount
+
+    def _first_droppable(self):
+        return max(self.committed, 1 if self.head_offset else 0)
+
+    def _drop_front(self, keep_from):
+        # Bỏ các frame từ vị trí an toàn đầu tiên tới trước chỉ số keep_from
+        first = self._first_droppable()
+        dropped_frames = dropped_bytes = 0
+        frames = self.frames
+        kept = [frames.popleft() for _ in range(first)]
+        for _ in range(max(0, keep_from - first)):
+            dropped_bytes += len(frames.popleft()[1])
+            dropped_frames += 1
+        frames.extendleft(reversed(kept))
+        self.pending_bytes -= dropped_bytes
+        self._count('dropped_frames', dropped_frames)
+        self._count('dropped_bytes', dropped_bytes)
+
+    def _latest_epoch_start(self):
+        # Tìm đầu epoch hoàn chỉnh mới nhất: ngay sau dấu kết thúc epoch áp chót
+        ends = [i for i, (msg_type, frame) in enumerate(self.frames)
+                if msg_type is not None and is_end_of_epoch(msg_type, frame)]
+        if len(ends) >= 2:
+            return ends[-2] + 1
+        return None
+
+    def _on_overflow(self):
+        self._count('overflows')
+        if self.policy == 'disconnect':
+            self._count('disconnects')
+            return False
+        if self.policy == 'skip_to_latest':
+            start = self._latest_epoch_start()
+            if start is not None:
+                self._count('epoch_skips')
+                self._drop_front(start)
+        if self.pending_bytes > self.max_bytes:
+            # drop_oldest, hoặc skip_to_latest khi chưa đủ hai epoch để nhảy
+            frames = self.frames
+            excess = self.pending_bytes - self.max_bytes
+            index = self._first_droppable()
+            while excess > 0 and index < len(frames):
+                excess -= len(frames[index][1])
+                index += 1
+            self._drop_front(index)
+        return True
+
+    def _open_chunk(self):
+        # Đóng khung tối đa SENDMSG_MAX_BUFFERS - 2 frame đầu hàng đợi thành một chunk
+        frames = self.frames
+        count = min(len(frames), SENDMSG_MAX_BUFFERS - 2)
+        header = chunk_header(sum(len(frame) for _, frame in islice(frames, count)))
+        frames.insert(count, (None, CHUNK_END))
+        frames.appendleft((None, header))
+        self.pending_bytes += len(header) + len(CHUNK_END)
+        self.committed = count + 2
+
+    def flush(self, sendmsg):
+        """Gửi không chặn bằng `sendmsg` (socket.sendmsg): mỗi lần một syscall cho cả lô frame.
+
+        Trả về True nếu đã gửi hết.
+        """
+        frames = self.frames
+        while frames:
+            if self.chunked and not self.committed:
+                self._open_chunk()
+            buffers = [frame for _, frame in islice(frames, self.committed or SENDMSG_MAX_BUFFERS)]
+            if self.head_offset:
+                buffers[0] = memoryview(buffers[0])[self.head_offset:]
+            try:
+                sent = sendmsg(buffers)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.pending_bytes -= sent
+            self.written += sent
+            # Bỏ các frame đã gửi trọn; phần còn lại của frame đầu là head_offset mới
+            sent += self.head_offset
+            done = 0
+            while frames and sent >= len(frames[0][1]):
+                sent -= len(frames.popleft()[1])
+                done += 1
+            self.head_offset = sent
+            self.committed = max(0, self.committed - done)
+            if done < len(buffers):
+                return False
+        return True
+
+    def take_all(self):
+        """Lấy toàn bộ dữ liệu chờ gửi (đã trừ phần gửi dở) để chuyển xuống transport asyncio."""
+        views = [frame for _, frame in self.frames]
+        if views and self.head_offset:
+            views[0] = views[0][self.head_offset:]
+        self.written += self.pending_bytes
+        if self.chunked:
+            views = encode_chunk(views)
+            if views:
+                self.written += len(views[0]) + len(CHUNK_END)
+        self.frames.clear()
+        self.pending_bytes = 0
+        self.head_offset = 0
+        self.committed = 0
+        return views
+
+
+# ==============================================================================
+# Lớp NtripClientWorker: kết nối upstream, kết nối lại với backoff có jitter
+# ==============================================================================
+class ReconnectBackoff:
+    """Backoff lũy thừa có jitter toàn phần: lần thứ n chờ ngẫu nhiên trong [0, min(max, initial * 2^n)].
+
+    Jitter làm các trạm cùng mất một upstream không kết nối lại đồng loạt cùng một nhịp.
+    """
+    def __init__(self, initial=DEFAULT_RECONNECT_INITIAL, maximum=DEFAULT_RECONNECT_MAX):
+        self.initial = initial
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next(self):
+        ceiling = min(self.maximum, self.initial * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempts = 0
+
+
 class NtripClientWorker(threading.Thread):
-    def __init__(self, config, data_queue):
+    def __init__(self, config, on_data):
         super().__init__()
         self.config = config
-        self.data_queue = data_queue
+        self.on_data = on_data
+        self._gga = None
         self.stop_event = threading.Event()
         self.name = f"ClientWorker-{config.get('mountpoint', 'UNKNOWN')}"
         self.daemon = True
+        backoff = config.get('reconnect') or {}
+        self._backoff = ReconnectBackoff(backoff.get('initial', DEFAULT_RECONNECT_INITIAL),
+                                         backoff.get('max', DEFAULT_RECONNECT_MAX))
+        self.watchdog = StreamWatchdog(f"{config['host']}:{config['port']}/{config['mountpoint']}", config.get('watchdog'),
+                                       UPSTREAM_READ_TIMEOUT)
+        # Trạng thái cho UpstreamFailover chấm điểm endpoint
+        self.connected = False
+        self.connect_latency = None  # EWMA thời gian từ lúc connect tới khi nhận header 200 OK (giây)
+        self.failures = 0            # số lần thất bại liên tiếp
 
     def _generate_gga(self):
-        lat = self.config['location']['lat']
-        lon = self.config['location']['lon']
-        now = datetime.utcnow()
-        time_str = now.strftime("%H%M%S.00")
-        
-        lat_abs = abs(lat)
-        lat_deg = int(lat_abs)
-        lat_min = (lat_abs - lat_deg) * 60
-        lat_dir = "N" if lat >= 0 else "S"
-        lat_nmea = f"{lat_deg:02d}{lat_min:06.3f}"
-        
-        lon_abs = abs(lon)
-        lon_deg = int(lon_abs)
-        lon_min = (lon_abs - lon_deg) * 60
-        lon_dir = "E" if lon >= 0 else "W"
-        lon_nmea = f"{lon_deg:03d}{lon_min:06.3f}"
-
-        gga_body = f"$GPGGA,{time_str},{lat_nmea},{lat_dir},{lon_nmea},{lon_dir},1,12,1.0,10.0,M,0.0,M,,"
-        checksum = 0
-        for char in gga_body[1:]:
-            checksum ^= ord(char)
-        return f"{gga_body}*{checksum:02X}\r\n".encode()
+        if self._gga is None:
+            self._gga = GgaTemplate(self.config['location']['lat'], self.config['location']['lon'])
+        return self._gga.render()
+
+    def _request(self):
+        credentials = f"{self.config.get('username', '')}:{self.config.get('password', '')}"
+        auth_str = base64.b64encode(credentials.encode()).decode()
+        return (
+            f"GET /{self.config['mountpoint']} HTTP/1.1\r\n"
+            f"Host: {self.config['host']}\r\n"
+            f"Ntrip-Version: Ntrip/2.0\r\n"
+            f"User-Agent: PythonNTRIPCaster/1.0\r\n"
+            f"Authorization: Basic {auth_str}\r\n"
+            f"Connection: keep-alive\r\n\r\n"
+        ).encode()
 
     def run(self):
-        print(f"[*] Bắt đầu {self.name}: Kết nối đến {self.config['host']}:{self.config['port']}/{self.config['mountpoint']}")
+        log.info("upstream_starting", "[*] Bắt đầu %s: Kết nối đến %s:%s/%s", self.name, self.config['host'],
+                 self.config['port'], self.config['mountpoint'], worker=self.name)
+        reconnects = UPSTREAM_RECONNECTS.labels(
+            upstream=f"{self.config['host']}:{self.config['port']}/{self.config['mountpoint']}")
+        first_attempt = True
+        s = None
+        leftover = b""
         while not self.stop_event.is_set():
+            if not first_attempt:
+                reconnects.inc()
+            first_attempt = False
+            reuse = False
+            delay = None
+            connect_started = time.monotonic()
             try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                if s is None:
+                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    s.settimeout(10)
+                    s.connect((self.config['host'], self.config['port']))
+                    leftover = b""
                 s.settimeout(10)
-                s.connect((self.config['host'], self.config['port']))
-                
-                credentials = f"{self.config.get('username', '')}:{self.config.get('password', '')}"
-                auth_str = base64.b64encode(credentials.encode()).decode()
-                
-                request = (
-                    f"GET /{self.config['mountpoint']} HTTP/1.1\r\n"
-                    f"Host: {self.config['host']}\r\n"
-                    f"Ntrip-Version: Ntrip/2.0\r\n"
-                    f"User-Agent: PythonNTRIPCaster/1.0\r\n"
-                    f"Authorization: Basic {auth_str}\r\n"
-                    f"Connection: keep-alive\r\n\r\n"
-                )
-                s.sendall(request.encode())
-                
-                response = s.recv(2048)
-                if not (b"ICY 200 OK" in response or b"HTTP/1.1 200 OK" in response):
-                    print(f"[!] {self.name}: Kết nối Base thất bại. Phản hồi: {response.decode(errors='ignore')}")
-                    s.close()
-                    time.sleep(10)
+                s.sendall(self._request())
+
+                # Header có thể tới trong nhiều gói, và gói cuối có thể đã chứa dữ liệu RTCM đầu tiên
+                response = ResponseReader()
+                pieces = response.feed(leftover) if leftover else []
+                while response.head is None:
+                    data = s.recv(4096)
+                    if not data:
+                        raise ConnectionError("Base đóng kết nối trước khi trả lời")
+                    pieces = response.feed(data)
+                if not response.head.is_stream:
+                    self.failures += 1
+                    delay = self._backoff.next()
+                    log.warning("upstream_rejected", "[!] %s: Kết nối Base thất bại. Phản hồi: %s. Thử lại sau %.1f giây.",
+                                self.name, response.head.status_line, delay, worker=self.name)
                     continue
 
-                print(f"[+] {self.name}: Kết nối Base thành công. Bắt đầu nhận dữ liệu.")
+                latency = time.monotonic() - connect_started
+                self.connect_latency = latency if self.connect_latency is None else 0.7 * self.connect_latency + 0.3 * latency
+                self.connected = True
+                self.failures = 0
+                log.info("upstream_connected", "[+] %s: Kết nối Base thành công (%s). Bắt đầu nhận dữ liệu.", self.name,
+                         "NTRIP 2.0, chunked" if response.head.chunked else response.head.protocol, worker=self.name)
                 if self.config.get('gga_interval', 0) > 0:
                     s.sendall(self._generate_gga())
                     last_gga_time = time.time()
                 
-                s.settimeout(15)
-                
+                watchdog = self.watchdog
+                watchdog.start()
                 while not self.stop_event.is_set():
-                    data = s.recv(4096)
+                    if pieces:
+                        # Upstream đã thật sự có dữ liệu: lần mất kết nối sau lại bắt đầu từ backoff ngắn nhất
+                        self._backoff.reset()
+                    for piece in pieces:
+                        self.on_data(piece)
+                    if response.finished:
+                        # Caster kết thúc luồng bằng chunk cuối; nếu giữ kết nối thì gửi lại yêu cầu trên cùng socket
+                        reuse = response.head.keep_alive
+                        leftover = response.leftover
+                        log.warning("upstream_lost", "[!] %s: Base kết thúc luồng dữ liệu. Sẽ kết nối lại...", self.name,
+                                    worker=self.name)
+                        break
+                    # Timeout theo nhịp đã học của upstream thay vì 15 giây cố định
+                    s.settimeout(max(watchdog.remaining(), MIN_SOURCE_READ_TIMEOUT))
+                    try:
+                        data = s.recv(4096)
+                    except socket.timeout:
+                        if not watchdog.stalled():
+                            pieces = []
+                            continue
+                        watchdog.on_stall()
+                        break
                     if not data:
-                        print(f"[!] {self.name}: Mất kết nối đến Base. Sẽ kết nối lại...")
+                        log.warning("upstream_lost", "[!] %s: Mất kết nối đến Base. Sẽ kết nối lại...", self.name, worker=self.name)
                         break
-                    self.data_queue.put(data)
+                    watchdog.on_arrival(time.monotonic())
+                    pieces = response.feed(data)
                     if self.config.get('gga_interval', 0) > 0 and (time.time() - last_gga_time >= self.config['gga_interval']):
                         s.sendall(self._generate_gga())
                         last_gga_time = time.time()
             except (socket.error, socket.timeout) as e:
-                print(f"[!] {self.name}: Lỗi socket ({e}). Đang thử kết nối lại sau 5 giây...")
+                self.failures += 1
+                delay = self._backoff.next()
+                log.warning("upstream_socket_error", "[!] %s: Lỗi socket (%s). Đang thử kết nối lại sau %.1f giây...", self.name,
+                            e, delay, worker=self.name)
             except Exception as e:
-                print(f"[!] {self.name}: Lỗi không xác định ({e}). Đang thử kết nối lại sau 10 giây...")
+                self.failures += 1
+                delay = self._backoff.next()
+                log.error("upstream_error", "[!] %s: Lỗi không xác định (%s). Đang thử kết nối lại sau %.1f giây...", self.name,
+                          e, delay, worker=self.name)
             finally:
-                if 's' in locals() and s:
-                    s.close()
-                if not self.stop_event.is_set():
-                    time.sleep(5)
-        print(f"[-] {self.name} đã dừng.")
+                if not reuse:
+                    self.connected = False
+                    if s is not None:
+                        s.close()
+                        s = None
+                    if not self.stop_event.is_set():
+                        self.stop_event.wait(self._backoff.next() if delay is None else delay)
+        if s is not None:
+            s.close()
+        log.info("upstream_stopped", "[-] %s đã dừng.", self.name, worker=self.name)
 
     def stop(self):
         self.stop_event.set()
 
 # ==============================================================================
-# Lớp BaseStationHandler (Không thay đổi)
+# Lớp ArchiveReplayWorker: nguồn dữ liệu của mode Replay
+# ==============================================================================
+class ArchiveReplayWorker(threading.Thread):
+    """Phát lại một thư mục lưu trữ RTCM (rtcm_archive.py) như Base đang chạy.
+
+    "speed": 1 giữ nhịp gốc giữa các frame, N nhanh gấp N lần, 0 hoặc "max" phát nhanh nhất mà
+    rover còn theo kịp: lô nhỏ hơn nhiều so với ring, và chờ khi reader chậm nhất tụt quá nửa ring
+    (nếu không một lô đã đủ vượt vòng mọi rover và tất cả bị ngắt vì "nhận quá chậm").
+    Frame đi thẳng từ mmap vào ring dưới dạng memoryview, không sao chép.
+    """
+    MAX_SPEED_BATCH = 64
+    MAX_SPEED_WAIT = 0.002
+
+    def __init__(self, replay_config, stream):
+        super().__init__()
+        self.directory = replay_config['directory']
+        speed = replay_config.get('speed', 1.0)
+        self.speed = 0.0 if speed in (None, 'max') else float(speed)
+        self.start_ns = parse_time(str(replay_config['from'])) if replay_config.get('from') else None
+        self.end_ns = parse_time(str(replay_config['to'])) if replay_config.get('to') else None
+        self.loop = replay_config.get('loop', True)
+        self.stream = stream
+        self.stop_event = threading.Event()
+        self._origin = None
+        self.name = f"ReplayWorker-{stream.name}"
+        self.daemon = True
+
+    def run(self):
+        log.info("replay_starting", "[*] %s: Phát lại %s (tốc độ %s).", self.name, self.directory,
+                 f"{self.speed:g}x" if self.speed else "tối đa", worker=self.name)
+        reader = RtcmArchiveReader(self.directory)
+        while not self.stop_event.is_set():
+            try:
+                count = self._play(reader)
+            except (OSError, ValueError) as e:
+                log.error("replay_error", "[!] %s: Không đọc được file lưu trữ (%s).", self.name, e, worker=self.name)
+                break
+            if not count:
+                log.warning("replay_empty", "[!] %s: Không có frame nào trong khoảng thời gian cần phát.", self.name,
+                            worker=self.name)
+                break
+            if not self.loop or self.stop_event.is_set():
+                break
+            log.info("replay_loop", "[*] %s: Hết dữ liệu (%s frame), phát lại từ đầu.", self.name, count, worker=self.name)
+        log.info("replay_stopped", "[-] %s đã dừng.", self.name, worker=self.name)
+
+    def _play(self, reader):
+        self._origin = None
+        count = 0
+        group, group_ts = [], None
+        batch = max(1, min(self.MAX_SPEED_BATCH, self.stream.rtcm_buffer.capacity // 4))
+        # Cùng nhịp gốc: gom các frame nhận cùng thời điểm; tốc độ tối đa: gom theo lô cố định
+        for ts_ns, msg_type, view in reader.frame_views(self.start_ns, self.end_ns):
+            if group and (ts_ns != group_ts if self.speed else len(group) >= batch):
+                self._publish(group, group_ts)
+                group = []
+                if self.stop_event.is_set():
+                    return count
+            if not group:
+                group_ts = ts_ns
+            group.append((msg_type, view))
+            count += 1
+        if group:
+            self._publish(group, group_ts)
+        return count
+
+    def _publish(self, group, ts_ns):
+        if self.speed:
+            if self._origin is None:
+                self._origin = (ts_ns, time.monotonic())
+            delay = self._origin[1] + (ts_ns - self._origin[0]) / 1e9 / self.speed - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                return
+        else:
+            time.sleep(0)  # Nhường GIL cho thread rover / event loop giữa các lô
+            while self.stream.reader_backlog() > 0.5:
+                if self.stop_event.wait(self.MAX_SPEED_WAIT):
+                    return
+        self.stream.metrics.bytes_in.inc(sum(len(view) for _, view in group))
+        self.stream.publish_frames(group)
+
+    def stop(self):
+        self.stop_event.set()
+
+# ==============================================================================
+# Các hàm xử lý handshake dùng chung cho engine thread và engine asyncio
+# ==============================================================================
+def is_source_request(request_data):
+    """SOURCE (NTRIP 1.0) hoặc POST (NTRIP 2.0): Base đẩy dữ liệu lên caster."""
+    return request_method(request_data) in SOURCE_METHODS
+
+def check_source_request(request_data, config):
+    """Kiểm tra yêu cầu SOURCE/POST của Base. Trả về (True, None) hoặc (False, (lý do, phản hồi)).
+
+    NTRIP 2.0 gửi mật khẩu nguồn qua Authorization Basic (username không được kiểm tra).
+    """
+    method = request_method(request_data)
+    if method == 'POST':
+        credentials = basic_auth_credentials(request_data)
+        if credentials is None:
+            return False, ("Yêu cầu POST thiếu Authorization Basic.",
+                           b"HTTP/1.1 401 Unauthorized\r\nWWW-Authenticate: Basic realm=\"NTRIP\"\r\n\r\n")
+        password = credentials[1]
+    elif method == 'SOURCE':
+        parts = request_data.split()
+        if len(parts) < 2:
+            return False, ("Yêu cầu SOURCE không đầy đủ.",
+                           b"HTTP/1.1 400 Bad Request\r\n\r\nERROR - Malformed SOURCE request\r\n")
+        password = parts[1]
+    else:
+        return False, ("Yêu cầu không hợp lệ. Chỉ chấp nhận 'SOURCE' hoặc 'POST'.",
+                       b"HTTP/1.1 400 Bad Request\r\n\r\nERROR - Use SOURCE method\r\n")
+
+    expected = str(config.get("base_source_password", "")).encode()
+    if not expected or not hmac.compare_digest(password.encode(), expected):
+        return False, ("Sai mật khẩu nguồn.",
+                       b"HTTP/1.1 401 Unauthorized\r\n\r\nERROR - Bad Password\r\n")
+    return True, None
+
+def find_source_stream(request_data, mountpoints):
+    """SOURCE <mật khẩu> /<mountpoint> hoặc POST /<mountpoint> HTTP/1.1: chọn trạm NtripCaster nhận dữ liệu từ Base.
+
+    Base cũ không gửi mountpoint vẫn được chấp nhận nếu chỉ có đúng một trạm NtripCaster.
+    """
+    parts = request_data.partition('\r\n')[0].split()
+    mountpoint = parts[1] if parts[:1] == ['POST'] and len(parts) >= 2 else parts[2] if len(parts) >= 3 else None
+    if mountpoint is not None:
+        stream = mountpoints.get(mountpoint.lstrip('/'))
+        return stream if stream and stream.config['mode'] == 'NtripCaster' else None
+    caster_streams = [m for m in mountpoints.values() if m.config['mode'] == 'NtripCaster']
+    return caster_streams[0] if len(caster_streams) == 1 else None
+
+class SourceBody:
+    """Thân yêu cầu của Base: dữ liệu thô (SOURCE) hoặc chunked (POST NTRIP 2.0) cần giải mã trước khi ingest."""
+    def __init__(self, request_data):
+        self.decoder = ChunkedDecoder() if request_chunked(request_data) else None
+
+    @property
+    def finished(self):
+        """Base NTRIP 2.0 đã gửi chunk cuối: kết thúc luồng đúng cách."""
+        return self.decoder is not None and self.decoder.finished
+
+    def decode(self, data):
+        if self.decoder is None:
+            return data
+        return b"".join(self.decoder.feed(data))
+
+def parse_rover_request(request_data):
+    """Tách method, mountpoint và header Authorization từ yêu cầu GET của rover."""
+    headers = request_data.split('\r\n')
+    method, mountpoint, _ = headers[0].split()
+    auth_header = next((h for h in headers if h.lower().startswith('authorization:')), None)
+    return method, mountpoint, auth_header
+
+def resolve_rover_mountpoint(mountpoint, mountpoints, nearest_router=None):
+    """Stream của mountpoint (tra dict), nearest_router cho mountpoint định tuyến theo GGA, hoặc None."""
+    mountpoint = mountpoint.lstrip('/')
+    stream = mountpoints.get(mountpoint)
+    if stream is None and nearest_router is not None and mountpoint == nearest_router.name:
+        stream = nearest_router
+    return stream
+
+def route_rover_request(request_data, mountpoints, rover_accounts, nearest_router=None):
+    """Tìm stream của mountpoint được yêu cầu rồi xác thực rover qua RoverAccountStore (chờ kết quả).
+
+    Trả về (stream, is_auth, reason); stream là None khi mountpoint không tồn tại.
+    """
+    method, mountpoint, auth_header = parse_rover_request(request_data)
+    stream = resolve_rover_mountpoint(mountpoint, mountpoints, nearest_router)
+    if stream is None:
+        return None, False, "Bad Mountpoint"
+    is_auth, reason = rover_accounts.authenticate(auth_header)
+    return stream, is_auth, reason
+
+def request_body(request_data):
+    """Phần dữ liệu rover gửi kèm ngay sau header (thường là câu GGA đầu tiên)."""
+    return request_data.partition('\r\n\r\n')[2].encode(errors='ignore')
+
+def rejection_response(reason):
+    if reason == "Bad Mountpoint":
+        return b"HTTP/1.1 404 Not Found\r\n\r\n"
+    return b"HTTP/1.1 401 Unauthorized\r\n\r\n"
+
+# ==============================================================================
+# Mountpoint định tuyến theo vị trí rover (GGA -> trạm gần nhất)
+# ==============================================================================
+class NearestStationRouter:
+    """Mountpoint ảo: rover gửi GGA, caster nối rover vào mountpoint có vị trí gần nhất.
+
+    Vị trí các trạm được đưa vào một k-d tree trên tọa độ ECEF một lần lúc khởi động,
+    nên mỗi lần tra chỉ tốn O(log n) dù GGA đến từ hàng nghìn rover.
+    """
+    def __init__(self, settings, mountpoints):
+        self.name = settings.get('mountpoint', DEFAULT_NEAREST_MOUNTPOINT)
+        self.reroute_distance_km = float(settings.get('reroute_distance_km', DEFAULT_REROUTE_DISTANCE_KM))
+        self.gga_timeout = settings.get('gga_timeout', DEFAULT_GGA_TIMEOUT)
+        self.sourcetable = settings.get('sourcetable')
+        located = []
+        for stream in mountpoints.values():
+            if stream.config['mode'] in ('Replay', 'Derived'):
+                continue  # Dữ liệu phát lại không phải hiệu chỉnh thời gian thực; mountpoint lọc trùng vị trí với nguồn
+            position = stream.position()
+            if position is None:
+                log.warning("nearest_station_unlocated", "[!] /%s: Bỏ qua /%s vì không có tọa độ trạm.", self.name, stream.name,
+                            mountpoint=stream.name)
+                continue
+            located.append((position[0], position[1], stream))
+        self.index = KdTree(located)
+
+    def locate(self, lat, lon):
+        """Trả về (stream gần nhất, khoảng cách km)."""
+        return self.index.nearest(lat, lon)
+
+
+class RoverPositionTracker:
+    """Tách câu GGA từ dữ liệu rover gửi lên và giữ stream gần nhất hiện tại.
+
+    Chỉ tra lại k-d tree khi rover đã di chuyển quá reroute_distance_km so với
+    vị trí lần định tuyến trước, nên GGA gửi mỗi giây không gây tra cứu liên tục.
+    """
+    MAX_LINE = 512
+
+    def __init__(self, router):
+        self.router = router
+        self.stream = None
+        self.distance_km = None
+        self._anchor = None
+        self._pending = b""
+
+    def feed(self, data):
+        *lines, rest = (self._pending + data).split(b"\n")
+        # Dòng dở dang dài bất thường không phải NMEA, chỉ giữ phần đuôi
+        self._pending = rest[-self.MAX_LINE:]
+        for line in lines:
+            position = parse_gga(line)
+            if position is not None:
+                self._update(position)
+        return self.stream
+
+    def _update(self, position):
+        if self._anchor is not None and haversine_km(*self._anchor, *position) < self.router.reroute_distance_km:
+            return
+        self._anchor = position
+        stream, distance = self.router.locate(*position)
+        if stream is not None:
+            self.stream = stream
+            self.distance_km = distance
+
+# ==============================================================================
+# Lớp BaseStationHandler: nhận dữ liệu từ Base (SOURCE hoặc POST NTRIP 2.0, kể cả socket bàn giao từ worker)
 # ==============================================================================
 class BaseStationHandler(threading.Thread):
-    def __init__(self, client_socket, address, config, data_queue, on_disconnect_callback):
+    def __init__(self, client_socket, address, config, on_data, on_disconnect_callback, request_data=None, watchdog=None,
+                 initial_data=b""):
         super().__init__()
         self.client_socket = client_socket
         self.address = address
         self.config = config
-        self.data_queue = data_queue
+        # Yêu cầu SOURCE đã được worker đọc trước khi bàn giao socket (chế độ nhiều tiến trình),
+        # và các byte RTCM đã đọc kèm sau header
+        self.request_data = request_data
+        self.initial_data = initial_data
+        self.on_data = on_data
         self.stop_event = threading.Event()
         self.on_disconnect_callback = on_disconnect_callback
+        # StreamWatchdog của mountpoint; None thì dùng timeout cố định như trước
+        self.watchdog = watchdog
         self.name = f"BaseHandler-{address[0]}:{address[1]}"
         self.daemon = True
 
     def run(self):
-        print(f"[+] Base Station kết nối từ {self.address}. Đang xác thực...")
+        log.info("base_connected", "[+] Base Station kết nối từ %s. Đang xác thực...", self.address, peer=self.address)
         try:
             self.client_socket.settimeout(10)
-            request_data = self.client_socket.recv(2048).decode(errors='ignore')
+            request_data, initial_data = self.request_data, self.initial_data
+            if request_data is None:
+                request_data, initial_data = split_head(recv_head(self.client_socket))
 
-            if not request_data.startswith("SOURCE"):
-                print(f"[-] Base {self.address}: Yêu cầu không hợp lệ. Chỉ chấp nhận 'SOURCE'.")
-                self.client_socket.sendall(b"HTTP/1.1 400 Bad Request\r\n\r\nERROR - Use SOURCE method\r\n")
+            is_valid, error = check_source_request(request_data, self.config)
+            if not is_valid:
+                reason, response = error
+                log.info("base_rejected", "[-] Base %s: %s", self.address, reason, peer=self.address)
+                self.client_socket.sendall(response)
                 return
-
-            parts = request_data.split()
-            if len(parts) < 2:
-                print(f"[-] Base {self.address}: Yêu cầu SOURCE không đầy đủ.")
-                self.client_socket.sendall(b"HTTP/1.1 400 Bad Request\r\n\r\nERROR - Malformed SOURCE request\r\n")
-                return
-
-            source_password = parts[1]
-            expected_password = self.config.get("base_source_password")
-
-            if source_password != expected_password:
-                print(f"[-] Base {self.address}: Sai mật khẩu nguồn.")
-                self.client_socket.sendall(b"HTTP/1.1 401 Unauthorized\r\n\r\nERROR - Bad Password\r\n")
-                return
-            
-            print(f"[+] Base {self.address} xác thực thành công. Bắt đầu nhận dữ liệu RTCM.")
-            self.client_socket.sendall(b"ICY 200 OK\r\n\r\n")
             
-            while not self.data_queue.empty():
-                self.data_queue.get()
+            log.info("base_authenticated", "[+] Base %s xác thực thành công. Bắt đầu nhận dữ liệu RTCM.", self.address,
+                     peer=self.address)
+            self.client_socket.sendall(source_response(request_data))
 
-            self.client_socket.settimeout(30)
-            
-            while not self.stop_event.is_set():
-                data = self.client_socket.recv(4096)
+            self.client_socket.settimeout(BASE_READ_TIMEOUT)
+            watchdog = self.watchdog
+            if watchdog is not None:
+                watchdog.start()
+            body = SourceBody(request_data)
+            data = body.decode(initial_data)
+            if data:
+                self.on_data(data)
+
+            while not self.stop_event.is_set() and not body.finished:
+                if watchdog is not None:
+                    self.client_socket.settimeout(max(watchdog.remaining(), MIN_SOURCE_READ_TIMEOUT))
+                    try:
+                        data = self.client_socket.recv(4096)
+                    except socket.timeout:
+                        if not watchdog.stalled():
+                            continue
+                        watchdog.on_stall()
+                        break
+                else:
+                    data = self.client_socket.recv(4096)
                 if not data:
-                    print(f"[-] Base {self.address} đã ngắt kết nối.")
+                    log.info("base_disconnected", "[-] Base %s đã ngắt kết nối.", self.address, peer=self.address)
                     break
-                self.data_queue.put(data)
+                data = body.decode(data)
+                if data:
+                    self.on_data(data)
+            if body.finished:
+                log.info("base_stream_ended", "[-] Base %s đã kết thúc luồng (chunk cuối).", self.address, peer=self.address)
 
         except (socket.timeout, IndexError, ValueError):
-            print(f"[-] Yêu cầu từ Base {self.address} không hợp lệ hoặc timeout.")
+            log.info("base_bad_request", "[-] Yêu cầu từ Base %s không hợp lệ hoặc timeout.", self.address, peer=self.address)
         except Exception as e:
-            print(f"[!] Lỗi không xác định trong {self.name}: {e}")
+            log.error("handler_error", "[!] Lỗi không xác định trong %s: %s", self.name, e)
         finally:
             self.client_socket.close()
             self.on_disconnect_callback()
-            print(f"[-] Đã đóng kết nối với Base Station {self.address}.")
+            log.info("base_closed", "[-] Đã đóng kết nối với Base Station %s.", self.address, peer=self.address)
 
     def stop(self):
         self.stop_event.set()
@@ -174,210 +877,1858 @@ class BaseStationHandler(threading.Thread):
 # Lớp RoverHandler (Cập nhật)
 # ==============================================================================
 class RoverHandler(threading.Thread):
-    # <<< THAY ĐỔI: Constructor giờ nhận global_rover_accounts thay vì station_config
-    def __init__(self, client_socket, address, caster_settings, global_rover_accounts, data_queue):
+    # Khi socket đang nghẽn, thời gian chờ ghi được trước khi quay lại đọc ring
+    WRITE_WAIT = 0.05
+
+    # Khi rover gửi GGA (mountpoint định tuyến), chu kỳ tối đa giữa hai lần đọc dữ liệu rover gửi lên
+    POSITION_POLL = 1.0
+
+    # <<< THAY ĐỔI: Constructor nhận dict mountpoint -> MountpointStream để tự định tuyến
+    def __init__(self, client_socket, address, mountpoints, rover_accounts, nearest_router=None):
         super().__init__()
         self.client_socket = client_socket
         self.address = address
-        self.caster_settings = caster_settings
-        self.rover_accounts = global_rover_accounts # <<< THAY ĐỔI: Sử dụng danh sách tài khoản toàn cục
-        self.data_queue = data_queue
+        self.mountpoints = mountpoints
+        self.rover_accounts = rover_accounts # RoverAccountStore dùng chung của server
+        self.nearest_router = nearest_router
         self.stop_event = threading.Event()
         self.name = f"RoverHandler-{address[0]}:{address[1]}"
         self.daemon = True
 
-    # Phương thức _is_authenticated không cần thay đổi, vì nó đã dùng self.rover_accounts
-    def _is_authenticated(self, auth_header, mountpoint):
-        if mountpoint != f"/{self.caster_settings['mountpoint']}":
-            return False, "Bad Mountpoint"
-        
-        if not auth_header:
-            return False, "Authorization header is missing"
+    def _wait_for_position(self, tracker, initial_data):
+        """Chờ câu GGA hợp lệ đầu tiên để chọn trạm; None nếu hết gga_timeout hoặc rover ngắt."""
+        deadline = time.monotonic() + tracker.router.gga_timeout
+        stream = tracker.feed(initial_data)
+        while stream is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.client_socket.settimeout(remaining)
+            try:
+                data = self.client_socket.recv(1024)
+            except socket.timeout:
+                return None
+            if not data:
+                return None
+            stream = tracker.feed(data)
+        return stream
 
+    def _poll_position(self, tracker):
+        # Socket đang ở chế độ không chặn: chỉ lấy những gì rover đã gửi
         try:
-            auth_type, auth_token = auth_header.replace("Authorization: ", "").strip().split()
-            if auth_type.lower() != 'basic':
-                return False, f"Unsupported Auth type: {auth_type}"
-            
-            decoded_creds = base64.b64decode(auth_token).decode()
-            username, password = decoded_creds.split(':', 1)
-
-            for acc in self.rover_accounts:
-                if acc['username'] == username and acc['password'] == password:
-                    return True, f"Authenticated as {username}"
-            
-            return False, f"Invalid credentials for user '{username}'"
-        except Exception as e:
-            print(f"[!] Lỗi phân tích Auth Header: {e}")
-            return False, "Malformed Authorization header"
+            data = self.client_socket.recv(1024)
+        except BlockingIOError:
+            return
+        if not data:
+            raise ConnectionResetError("rover closed")
+        tracker.feed(data)
 
     def run(self):
-        print(f"[+] Rover mới kết nối từ: {self.address}")
+        log.info("rover_connected", "[+] Rover mới kết nối từ: %s", self.address, peer=self.address)
+        output = None
+        metrics = None
         try:
             self.client_socket.settimeout(10)
-            request_data = self.client_socket.recv(2048).decode(errors='ignore')
+            request_data = recv_head(self.client_socket).decode(errors='ignore')
             
             if not request_data:
-                print(f"[-] Không nhận được dữ liệu từ {self.address}. Đóng kết nối.")
+                log.info("rover_empty_request", "[-] Không nhận được dữ liệu từ %s. Đóng kết nối.", self.address, peer=self.address)
                 return
 
-            headers = request_data.split('\r\n')
-            request_line = headers[0]
-            method, mountpoint, _ = request_line.split()
-
-            auth_header = next((h for h in headers if h.lower().startswith('authorization:')), None)
-            is_auth, reason = self._is_authenticated(auth_header, mountpoint)
+            auth_started = time.monotonic()
+            stream, is_auth, reason = route_rover_request(request_data, self.mountpoints, self.rover_accounts,
+                                                          self.nearest_router)
+            if stream is not None:
+                AUTH_SECONDS.labels(result='ok' if is_auth else 'rejected').observe(time.monotonic() - auth_started)
 
             if not is_auth:
-                print(f"[-] Rover {self.address} xác thực thất bại: {reason}")
-                if reason == "Bad Mountpoint":
-                    self.client_socket.sendall(b"HTTP/1.1 404 Not Found\r\n\r\n")
-                else:
-                    self.client_socket.sendall(b"HTTP/1.1 401 Unauthorized\r\n\r\n")
+                log.info("rover_auth_failed", "[-] Rover %s xác thực thất bại: %s", self.address, reason, peer=self.address)
+                self.client_socket.sendall(rejection_response(reason))
                 return
 
-            print(f"[+] Rover {self.address} xác thực thành công: {reason}. Bắt đầu truyền dữ liệu.")
-            self.client_socket.sendall(b"ICY 200 OK\r\n\r\n")
+            # NTRIP 2.0: "HTTP/1.1 200 OK" và dữ liệu bọc chunked; NTRIP 1.0: "ICY 200 OK" và dữ liệu thô
+            version = ntrip_version(request_data)
+            tracker = None
+            if stream is self.nearest_router:
+                # Rover chỉ gửi GGA sau khi nhận 200 OK, nên trả lời trước rồi mới chọn trạm
+                tracker = RoverPositionTracker(self.nearest_router)
+                self.client_socket.sendall(stream_response(version))
+                stream = self._wait_for_position(tracker, request_body(request_data))
+                if stream is None:
+                    log.info("rover_no_position", "[-] Rover %s không gửi GGA hợp lệ cho /%s. Đóng kết nối.", self.address,
+                             self.nearest_router.name, peer=self.address)
+                    return
+                log.info("rover_authenticated", "[+] Rover %s xác thực thành công: %s. /%s -> /%s (%.1f km).", self.address, reason,
+                         self.nearest_router.name, stream.name, tracker.distance_km,
+                         peer=self.address, mountpoint=stream.name)
+                reader, priming_frames = stream.attach()
+                output = stream.new_output_buffer(chunked=version == 2)
+            else:
+                log.info("rover_authenticated", "[+] Rover %s xác thực thành công: %s. Bắt đầu truyền dữ liệu từ /%s.",
+                         self.address, reason, stream.name, peer=self.address, mountpoint=stream.name)
+                reader, priming_frames = stream.attach()
+                output = stream.new_output_buffer(chunked=version == 2)
+                self.client_socket.sendall(stream_response(version))
             
-            self.client_socket.settimeout(None)
+            # Ghi không chặn: rover trên đường truyền nghẽn chỉ làm đầy bộ đệm của chính nó
+            self.client_socket.setblocking(False)
+            sendmsg = getattr(self.client_socket, 'sendmsg', None) or \
+                (lambda buffers: self.client_socket.send(b"".join(buffers)))
+            output.push(priming_frames)
+            read_timeout = 15 if tracker is None else self.POSITION_POLL
+            metrics = stream.metrics
+            metrics.rovers.inc()
+            meter = RoverMeter(metrics)
+            hold = 0.0
             
             while not self.stop_event.is_set():
                 try:
-                    rtcm_data = self.data_queue.get(timeout=15)
-                    self.client_socket.sendall(rtcm_data)
-                except Empty:
-                    continue
+                    if output.pending_bytes and not hold:
+                        select.select([], [self.client_socket], [], self.WRITE_WAIT)
+                        frames = reader.read(timeout=0)
+                    else:
+                        # Đang gộp lô: chỉ chờ thêm frame trong phần còn lại của cửa sổ
+                        frames = reader.read(timeout=hold or read_timeout)
+                    if frames:
+                        meter.on_read(len(frames))
+                    output.push(frames)
+                    if tracker is not None:
+                        self._poll_position(tracker)
+                        if tracker.stream is not stream:
+                            # Phần đang chờ gửi của trạm cũ vẫn được gửi hết, sau đó là mồi của trạm mới
+                            log.info("rover_rerouted", "[*] Rover %s di chuyển: /%s -> /%s (%.1f km).", self.address, stream.name,
+                                     tracker.stream.name, tracker.distance_km, peer=self.address, mountpoint=tracker.stream.name)
+                            stream = tracker.stream
+                            reader, priming_frames = stream.attach()
+                            output.push(priming_frames)
+                            metrics.rovers.dec()
+                            metrics = stream.metrics
+                            metrics.rovers.inc()
+                            meter = RoverMeter(metrics)
+                    hold = output.hold_time()
+                    if not hold:
+                        pending_before = output.pending_bytes
+                        written_before = output.written
+                        drained = output.flush(sendmsg)
+                        delivery = None
+                        if drained and reader.last_stamp is not None and pending_before:
+                            delivery = time.monotonic() - reader.last_stamp
+                        meter.on_send(output.written - written_before, output.pending_bytes, delivery)
+                    if not output.enforce_limit():
+                        log.info("rover_buffer_overflow", "[-] Rover %s vượt %s byte đệm gửi. Ngắt kết nối (chính sách 'disconnect').",
+                                 self.address, output.max_bytes, peer=self.address)
+                        break
+                except SlowConsumerError as e:
+                    log.info("rover_too_slow", "[-] Rover %s nhận quá chậm (tụt %s gói so với nguồn). Ngắt kết nối.", self.address, e.lag,
+                             peer=self.address)
+                    break
+                except MountpointClosedError:
+                    log.info("rover_mountpoint_removed", "[-] /%s đã bị gỡ khỏi cấu hình. Ngắt kết nối Rover %s.", stream.name,
+                             self.address, peer=self.address, mountpoint=stream.name)
+                    # Rover NTRIP 2.0 nhận chunk cuối để biết luồng kết thúc đúng cách
+                    try:
+                        if output.chunked and output.flush(sendmsg):
+                            self.client_socket.send(LAST_CHUNK)
+                    except OSError:
+                        pass
+                    break
                 except socket.error:
-                    print(f"[-] Rover {self.address} đã ngắt kết nối.")
+                    log.info("rover_disconnected", "[-] Rover %s đã ngắt kết nối.", self.address, peer=self.address)
                     break
         except (socket.timeout, IndexError, ValueError):
-            print(f"[-] Yêu cầu từ {self.address} không hợp lệ hoặc bị timeout khi chờ yêu cầu.")
+            log.info("rover_bad_request", "[-] Yêu cầu từ %s không hợp lệ hoặc bị timeout khi chờ yêu cầu.", self.address,
+                     peer=self.address)
         except Exception as e:
-            print(f"[!] Lỗi không xác định trong {self.name}: {e}")
+            log.error("handler_error", "[!] Lỗi không xác định trong %s: %s", self.name, e)
         finally:
             self.client_socket.close()
-            print(f"[-] Đã đóng kết nối với Rover {self.address}.")
+            if metrics is not None:
+                metrics.rovers.dec()
+            if output is not None and output.counters:
+                log.info("rover_slow_stats", "[*] Rover %s - thống kê rover chậm: %s", self.address, dict(output.counters),
+                         peer=self.address)
+            log.info("rover_closed", "[-] Đã đóng kết nối với Rover %s.", self.address, peer=self.address)
 
 # ==============================================================================
-# Lớp Caster Server chính (Cập nhật)
+# Engine asyncio: toàn bộ Rover/Base chạy trên một event loop
 # ==============================================================================
-class NtripCasterServer:
-    # <<< THAY ĐỔI: Constructor nhận thêm global_rover_accounts
-    def __init__(self, station_config, global_rover_accounts):
+def resolve_loop_factory(name):
+    """'asyncio' -> loop mặc định, 'uvloop' -> uvloop nếu có, 'module:ham' -> factory tự chọn."""
+    if not name or name == 'asyncio':
+        return None
+    module_name, _, attr = (name, None, 'new_event_loop') if name == 'uvloop' else name.partition(':')
+    try:
+        module = importlib.import_module(module_name)
+        return getattr(module, attr or 'new_event_loop')
+    except (ImportError, AttributeError) as e:
+        log.warning("event_loop_unavailable", "[!] Không tải được event loop '%s' (%s). Dùng event loop asyncio mặc định.",
+                    name, e)
+        return None
+
+def raise_open_file_limit():
+    # Mỗi rover chiếm một file descriptor, nâng soft limit lên hard limit nếu hệ điều hành cho phép
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+class LoopWaker:
+    """Đánh thức các rover asyncio của một mountpoint khi ring có dữ liệu mới.
+
+    Được gọi từ thread producer; nhiều lần publish liên tiếp chỉ gây một lần đánh thức loop.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self._pending = False
+
+    def __call__(self):
+        if self._pending:
+            return
+        self._pending = True
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self._pending = False
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+class AsyncCasterEngine:
+    """Phục vụ SOURCE, GET và sourcetable trên asyncio streams thay vì mỗi kết nối một thread.
+
+    Nguồn dữ liệu NtripClient vẫn là một NtripClientWorker thread; mỗi lần nó publish
+    vào ring, loop được đánh thức một lần và mọi rover đang chờ cùng đọc tiếp.
+    """
+    STOP_POLL_INTERVAL = 1.0
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = None
+        self._wakers = {}  # MountpointStream -> LoopWaker
+        self._handshakes = 0
+        # Task phục vụ kết nối -> StreamWriter, để đóng và hủy hết khi server dừng
+        self._connections = {}
+        self._closing = False
+
+    def run(self):
+        raise_open_file_limit()
+        loop_factory = resolve_loop_factory(self.server.server_settings.get('event_loop'))
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        for stream in self.server.mountpoints.values():
+            self._waker(stream)
+
+        listeners = []
+        for host, port in self.server.listen_addresses():
+            try:
+                listeners.append(await asyncio.start_server(self._handle_connection, host, port, reuse_address=True,
+                                                            reuse_port=self.server.reuse_port or None,
+                                                            backlog=self.server.listen_backlog))
+            except OSError as e:
+                log.error("bind_failed", "[!] LỖI NGHIÊM TRỌNG: Không thể bind tới %s:%s. Lỗi: %s", host, port, e)
+                for listener in listeners:
+                    listener.close()
+                return
+            log.info("listening", "[+] Caster (asyncio) đang lắng nghe trên %s:%s cho tất cả mountpoint", host, port)
+
+        try:
+            while not self.server.stop_event.is_set():
+                await asyncio.sleep(self.STOP_POLL_INTERVAL)
+        finally:
+            for listener in listeners:
+                listener.close()
+            await self._close_connections()
+            for stream, waker in self._wakers.items():
+                stream.rtcm_buffer.remove_listener(waker)
+        log.info("server_stopped", "[-] Event loop của server đã dừng.")
+
+    async def _close_connections(self):
+        """Đóng transport rồi hủy và chờ mọi task kết nối, trước khi asyncio.Runner đóng loop.
+
+        Để Runner tự hủy thì mỗi kết nối còn mở in một traceback CancelledError từ callback của
+        StreamReaderProtocol; ở đây task bị hủy khi _closing đã bật sẽ kết thúc bình thường.
+        """
+        self._closing = True
+        connections = list(self._connections.items())
+        for task, writer in connections:
+            writer.transport.abort()
+        for task, _ in connections:
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
+
+    def _waker(self, stream):
+        """LoopWaker của stream; stream được thêm khi nạp lại cấu hình nhận waker ở lần dùng đầu tiên."""
+        waker = self._wakers.get(stream)
+        if waker is None:
+            waker = self._wakers[stream] = LoopWaker(self.loop)
+            stream.rtcm_buffer.add_listener(waker)
+        return waker
+
+    async def _admit(self, reader, address):
+        """Áp dụng giới hạn theo IP, hàng đợi và token toàn cục; trả về yêu cầu đầu tiên hoặc None nếu bị từ chối."""
+        admission = self.server.admission
+        if not admission.allow_ip(address[0]):
+            log.warning("connection_rejected", "[!] Từ chối kết nối %s: vượt giới hạn kết nối theo IP", address,
+                        peer=address, reason='per_ip')
+            return None
+        if admission.queue_full(self._handshakes):
+            log.warning("connection_rejected", "[!] Từ chối kết nối %s: hàng đợi handshake đầy", address,
+                        peer=address, reason='queue_full')
+            return None
+        self._handshakes += 1
+        try:
+            async with asyncio.timeout(admission.handshake_timeout):
+                delay = admission.reserve_global()
+                if delay:
+                    await asyncio.sleep(delay)
+                return await self._read_head(reader)
+        except TimeoutError:
+            admission.rejected['handshake_timeout'] += 1
+            raise
+        finally:
+            self._handshakes -= 1
+
+    @staticmethod
+    async def _read_head(reader):
+        """Đọc tới hết header yêu cầu (dòng trống), dù header tới trong nhiều gói.
+
+        Phần thân gửi kèm (câu GGA đầu tiên) vẫn nằm lại trong reader cho lần đọc sau.
+        """
+        try:
+            return (await reader.readuntil(HEAD_END)).decode(errors='ignore')
+        except asyncio.IncompleteReadError as e:
+            return e.partial.decode(errors='ignore')
+        except asyncio.LimitOverrunError:
+            raise ValueError("Header yêu cầu quá dài")
+
+    async def _handle_connection(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            request_data = await self._admit(reader, address)
+            if request_data is None:
+                writer.write(BUSY_RESPONSE)
+                return
+
+            while request_data.startswith('GET / '):
+                log.info("sourcetable_sent", "[*] Gửi Sourcetable cho %s", address, peer=address)
+                keep_alive = ntrip_version(request_data) == 2 and request_keep_alive(request_data)
+                writer.write(self.server.sourcetable_response(request_data, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+                # NTRIP 2.0 keep-alive: chờ yêu cầu kế tiếp trên cùng kết nối
+                async with asyncio.timeout(self.server.admission.handshake_timeout):
+                    request_data = await self._read_head(reader)
+                if not request_data:
+                    return
+
+            if self.server.is_metrics_request(request_data):
+                writer.write(REGISTRY.http_response())
+                await writer.drain()
+            elif is_source_request(request_data):
+                await self._serve_base(request_data, reader, writer, address)
+            elif request_data and request_method(request_data) != 'GET':
+                log.info("bad_request", "[-] %s gửi method không hỗ trợ: %s", address, request_method(request_data), peer=address)
+                writer.write(METHOD_NOT_ALLOWED_RESPONSE)
+                await writer.drain()
+            else:
+                await self._serve_rover(request_data, reader, writer, address)
+        except (asyncio.TimeoutError, IndexError, ValueError):
+            log.info("bad_request", "[-] Yêu cầu từ %s không hợp lệ hoặc bị timeout.", address, peer=address)
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            log.error("handler_error", "[!] Lỗi không xác định khi xử lý %s: %s", address, e, peer=address)
+        except asyncio.CancelledError:
+            if not self._closing:
+                raise
+        finally:
+            writer.close()
+            self._connections.pop(task, None)
+
+    async def _serve_base(self, request_data, reader, writer, address):
+        if self.server.source_handoff is not None:
+            # Dừng đọc rồi chuyển luôn phần RTCM StreamReader đã nhận sau header, không để rơi mất
+            writer.transport.pause_reading()
+            self.server.handoff_source(writer.get_extra_info('socket'), request_data, address, bytes(reader._buffer))
+            return
+        stream = find_source_stream(request_data, self.server.mountpoints)
+        if stream is None:
+            log.info("base_rejected", "[-] Base %s: Mountpoint trong yêu cầu SOURCE/POST không tồn tại.", address, peer=address)
+            writer.write(b"HTTP/1.1 404 Not Found\r\n\r\nERROR - Bad Mountpoint\r\n")
+            await writer.drain()
+            return
+        if stream.has_active_source():
+            log.warning("base_rejected", "[!] /%s đã có Base kết nối. Từ chối kết nối Base mới từ %s", stream.name, address,
+                        peer=address, mountpoint=stream.name)
+            writer.write(b"HTTP/1.1 409 Conflict\r\n\r\nERROR - Caster already has a source\r\n")
+            await writer.drain()
+            return
+
+        is_valid, error = check_source_request(request_data, stream.config)
+        if not is_valid:
+            reason, response = error
+            log.info("base_rejected", "[-] Base %s: %s", address, reason, peer=address)
+            writer.write(response)
+            await writer.drain()
+            return
+
+        log.info("base_authenticated", "[+] Base %s xác thực thành công cho /%s. Bắt đầu nhận dữ liệu RTCM.", address,
+                 stream.name, peer=address, mountpoint=stream.name)
+        stream.data_source_worker = address
+        watchdog = stream.watchdog
+        body = SourceBody(request_data)
+        try:
+            writer.write(source_response(request_data))
+            await writer.drain()
+            watchdog.start()
+            while stream.data_source_worker == address and not body.finished:
+                try:
+                    data = await asyncio.wait_for(reader.read(4096), timeout=max(watchdog.remaining(), MIN_SOURCE_READ_TIMEOUT))
+                except asyncio.TimeoutError:
+                    if not watchdog.stalled():
+                        continue
+                    watchdog.on_stall()
+                    break
+                if not data:
+                    log.info("base_disconnected", "[-] Base %s đã ngắt kết nối.", address, peer=address)
+                    break
+                data = body.decode(data)
+                if data:
+                    stream.ingest(data)
+            if body.finished:
+                log.info("base_stream_ended", "[-] Base %s đã kết thúc luồng (chunk cuối).", address, peer=address)
+        finally:
+            stream.on_base_disconnect()
+
+    async def _wait_for_position(self, tracker, initial_data, reader):
+        stream = tracker.feed(initial_data)
+        try:
+            async with asyncio.timeout(tracker.router.gga_timeout):
+                while stream is None:
+                    data = await reader.read(1024)
+                    if not data:
+                        return None
+                    stream = tracker.feed(data)
+        except TimeoutError:
+            return None
+        return stream
+
+    async def _follow_position(self, tracker, reader, writer):
+        """Đọc GGA rover gửi lên trong suốt phiên; đánh thức vòng gửi khi trạm gần nhất thay đổi."""
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                current = tracker.stream
+                if tracker.feed(data) is not current:
+                    # Đánh thức trực tiếp (đang ở trong loop); các rover khác của trạm chỉ tỉnh dậy một lần thừa
+                    self._waker(current)._wake()
+        except (ConnectionError, OSError):
+            pass
+        writer.transport.close()
+        self._waker(tracker.stream)._wake()
+
+    async def _serve_rover(self, request_data, reader, writer, address):
+        if not request_data:
+            log.info("rover_empty_request", "[-] Không nhận được dữ liệu từ %s. Đóng kết nối.", address, peer=address)
+            return
+
+        nearest_router = self.server.nearest_router
+        method, mountpoint, auth_header = parse_rover_request(request_data)
+        stream = resolve_rover_mountpoint(mountpoint, self.server.mountpoints, nearest_router)
+        if stream is None:
+            is_auth, reason = False, "Bad Mountpoint"
+        else:
+            # Băm mật khẩu chạy trên thread pool của kho tài khoản, loop vẫn phục vụ rover khác
+            auth_started = time.monotonic()
+            is_auth, reason = await asyncio.wrap_future(self.server.rover_accounts.verify(auth_header))
+            AUTH_SECONDS.labels(result='ok' if is_auth else 'rejected').observe(time.monotonic() - auth_started)
+        if not is_auth:
+            log.info("rover_auth_failed", "[-] Rover %s xác thực thất bại: %s", address, reason, peer=address)
+            writer.write(rejection_response(reason))
+            await writer.drain()
+            return
+
+        version = ntrip_version(request_data)
+        tracker = None
+        peer_task = None
+        if stream is nearest_router:
+            tracker = RoverPositionTracker(nearest_router)
+            writer.write(stream_response(version))
+            stream = await self._wait_for_position(tracker, request_body(request_data), reader)
+            if stream is None:
+                log.info("rover_no_position", "[-] Rover %s không gửi GGA hợp lệ cho /%s. Đóng kết nối.", address,
+                         nearest_router.name, peer=address)
+                return
+            log.info("rover_authenticated", "[+] Rover %s xác thực thành công: %s. /%s -> /%s (%.1f km).", address, reason,
+                     nearest_router.name, stream.name, tracker.distance_km, peer=address, mountpoint=stream.name)
+        else:
+            log.info("rover_authenticated", "[+] Rover %s xác thực thành công: %s. Bắt đầu truyền dữ liệu từ /%s.",
+                     address, reason, stream.name, peer=address, mountpoint=stream.name)
+        waker = self._waker(stream)
+        ring_reader, priming_frames = stream.attach()
+        output = stream.new_output_buffer(chunked=version == 2)
+        transport = writer.transport
+        # Transport chỉ giữ tối đa một lô đang gửi dở; phần còn lại nằm trong RoverOutputBuffer
+        # để chính sách rover chậm được áp dụng giống engine thread
+        transport.set_write_buffer_limits(high=0)
+        # Luôn có một task đọc phía rover: vòng gửi chờ cả task này nên rover ngắt kết nối
+        # được phát hiện ngay cả khi mountpoint không có dữ liệu (Base offline, Replay đứng, Derived lọc hết)
+        if tracker is None:
+            writer.write(stream_response(version))
+            peer_task = asyncio.ensure_future(self._read_until_eof(reader))
+        else:
+            peer_task = asyncio.ensure_future(self._follow_position(tracker, reader, writer))
+        output.push(priming_frames)
+        metrics = stream.metrics
+        metrics.rovers.inc()
+        meter = RoverMeter(metrics)
+        try:
+            while not transport.is_closing():
+                data_event = waker.event
+                frames = ring_reader.read(timeout=0)
+                if frames:
+                    meter.on_read(len(frames))
+                output.push(frames)
+                if tracker is not None and tracker.stream is not stream:
+                    log.info("rover_rerouted", "[*] Rover %s di chuyển: /%s -> /%s (%.1f km).", address, stream.name,
+                             tracker.stream.name, tracker.distance_km, peer=address, mountpoint=tracker.stream.name)
+                    stream = tracker.stream
+                    waker = self._waker(stream)
+                    data_event = waker.event
+                    ring_reader, priming_frames = stream.attach()
+                    output.push(priming_frames)
+                    metrics.rovers.dec()
+                    metrics = stream.metrics
+                    metrics.rovers.inc()
+                    meter = RoverMeter(metrics)
+                hold = output.hold_time()
+                if not hold:
+                    sent = delivery = None
+                    if output.pending_bytes and transport.get_write_buffer_size() == 0:
+                        sent = output.written
+                        writer.writelines(output.take_all())
+                        sent = output.written - sent
+                        if ring_reader.last_stamp is not None:
+                            delivery = time.monotonic() - ring_reader.last_stamp
+                    meter.on_send(sent, output.pending_bytes + transport.get_write_buffer_size(), delivery)
+                if not output.enforce_limit():
+                    log.info("rover_buffer_overflow", "[-] Rover %s vượt %s byte đệm gửi. Ngắt kết nối (chính sách 'disconnect').",
+                             address, output.max_bytes, peer=address)
+                    break
+                if hold:
+                    # Đang gộp lô: chờ thêm frame nhưng không quá phần còn lại của cửa sổ
+                    await self._wait_data_or_drain(data_event, writer, peer_task, drain=False, timeout=hold)
+                else:
+                    await self._wait_data_or_drain(data_event, writer, peer_task,
+                                                   drain=transport.get_write_buffer_size() > 0)
+        except SlowConsumerError as e:
+            log.info("rover_too_slow", "[-] Rover %s nhận quá chậm (tụt %s gói so với nguồn). Ngắt kết nối.", address, e.lag,
+                     peer=address)
+        except MountpointClosedError:
+            log.info("rover_mountpoint_removed", "[-] /%s đã bị gỡ khỏi cấu hình. Ngắt kết nối Rover %s.", stream.name, address,
+                     peer=address, mountpoint=stream.name)
+            if output.chunked and not transport.is_closing():
+                writer.writelines(output.take_all())
+                writer.write(LAST_CHUNK)
+        except (ConnectionError, OSError):
+            log.info("rover_disconnected", "[-] Rover %s đã ngắt kết nối.", address, peer=address)
+        finally:
+            metrics.rovers.dec()
+            if peer_task is not None:
+                peer_task.cancel()
+            if output.counters:
+                log.info("rover_slow_stats", "[*] Rover %s - thống kê rover chậm: %s", address, dict(output.counters), peer=address)
+            log.info("rover_closed", "[-] Đã đóng kết nối với Rover %s.", address, peer=address)
+
+    @staticmethod
+    async def _read_until_eof(reader):
+        """Đọc bỏ dữ liệu rover gửi lên (GGA...) tới khi rover đóng kết nối."""
+        try:
+            while await reader.read(4096):
+                pass
+        except (ConnectionError, OSError):
+            pass
+
+    @staticmethod
+    async def _wait_data_or_drain(data_event, writer, peer_task, drain=True, timeout=None):
+        """Chờ frame mới, socket ghi được tiếp (nếu drain) hoặc rover đóng kết nối (peer_task kết thúc)."""
+        wait_data = asyncio.ensure_future(data_event.wait())
+        tasks = [wait_data, peer_task]
+        if drain:
+            drain = asyncio.ensure_future(writer.drain())
+            tasks.append(drain)
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            wait_data.cancel()
+            if drain and not drain.done():
+                drain.cancel()
+        if drain in done:
+            drain.result()
+        if peer_task in done:
+            raise ConnectionResetError("Rover đã đóng kết nối")
+
+# ==============================================================================
+# Pool kết nối upstream dùng chung (NtripClient mode)
+# ==============================================================================
+class SharedUpstream:
+    """Một NtripClientWorker duy nhất cho một endpoint, phát dữ liệu tới mọi subscriber."""
+    def __init__(self, key, config):
+        self.key = key
+        self.config = config
+        # Tuple bất biến, thay thế nguyên khối khi đăng ký/hủy để dispatch không cần khóa
+        self.subscribers = ()
+        self.worker = NtripClientWorker(config, self.dispatch)
+
+    def dispatch(self, data):
+        for on_data in self.subscribers:
+            on_data(data)
+
+
+class UpstreamPool:
+    """Pool đếm tham chiếu các kết nối upstream theo (host, port, mountpoint, username, password, vị trí GGA).
+
+    Bao nhiêu mountpoint cục bộ cùng trỏ tới một upstream cũng chỉ dùng một kết nối TCP;
+    kết nối bị đóng khi subscriber cuối cùng rời đi. Upstream được gửi GGA trả số hiệu chỉnh cho
+    đúng vị trí đó nên vị trí là một phần của khóa; chỉ upstream "position_independent" mới dùng
+    chung giữa các vị trí, với GGA của trạm đăng ký đầu tiên.
+    """
+    def __init__(self):
+        self._upstreams = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(config):
+        """Khóa chia sẻ; upstream nhận GGA (VRS/NEAREST) chỉ dùng chung giữa các trạm cùng vị trí,
+        trừ khi kết nối khai báo "position_independent": true."""
+        position = None
+        if config.get('gga_interval', 0) > 0 and not config.get('position_independent'):
+            position = (float(config['location']['lat']), float(config['location']['lon']))
+        return (config['host'], int(config['port']), config['mountpoint'],
+                config.get('username', ''), config.get('password', ''), position)
+
+    def acquire(self, config, on_data):
+        key = self.key_for(config)
+        with self._lock:
+            upstream = self._upstreams.get(key)
+            is_new = upstream is None
+            if is_new:
+                upstream = SharedUpstream(key, config)
+                self._upstreams[key] = upstream
+            upstream.subscribers = upstream.subscribers + (on_data,)
+        if is_new:
+            upstream.worker.start()
+        else:
+            log.info("upstream_shared", "[*] Dùng chung kết nối upstream %s:%s/%s (%s subscriber).", key[0], key[1], key[2],
+                     len(upstream.subscribers))
+        return upstream
+
+    def release(self, upstream, on_data, mountpoint=None):
+        with self._lock:
+            upstream.subscribers = tuple(cb for cb in upstream.subscribers if cb != on_data)
+            if upstream.subscribers or self._upstreams.get(upstream.key) is not upstream:
+                return
+            del self._upstreams[upstream.key]
+        worker = upstream.worker
+        if worker.is_alive():
+            log.info("source_stopping", "[*] Đang dừng nguồn dữ liệu (%s)...", worker.name, mountpoint=mountpoint)
+            worker.stop()
+            worker.join(timeout=5)
+
+
+def upstream_endpoints(station_config):
+    """Các endpoint upstream của trạm NtripClient theo thứ tự ưu tiên: base_connection rồi fallback_connections.
+
+    Endpoint dự phòng không khai báo gga_interval/location/reconnect/watchdog thì dùng giá trị của base_connection;
+    endpoint không khai báo "watchdog" thì dùng "watchdog" của trạm.
+    """
+    primary = station_config.get('base_connection')
+    if not primary:
+        return []
+    if 'watchdog' in station_config and 'watchdog' not in primary:
+        primary = dict(primary, watchdog=station_config['watchdog'])
+    endpoints = [primary]
+    for fallback in station_config.get('fallback_connections') or ():
+        endpoint = {key: primary[key] for key in ('gga_interval', 'location', 'reconnect', 'watchdog') if key in primary}
+        endpoint.update(fallback)
+        endpoints.append(endpoint)
+    return endpoints
+
+
+class UpstreamEndpoint:
+    """Tình trạng một endpoint của UpstreamFailover; chỉ đọc/ghi khi giữ khóa của UpstreamFailover."""
+    def __init__(self, index, config, on_data):
+        self.index = index
+        self.config = config
+        self.on_data = on_data
+        self.label = f"{config['host']}:{config['port']}/{config['mountpoint']}"
+        self.upstream = None        # SharedUpstream khi đang đăng ký với pool
+        self.subscribed_at = None
+        self.last_data = None
+        self.healthy_since = None
+        self.rate = 0.0             # EWMA byte/giây
+        self.window_bytes = 0
+        self.retry_at = 0.0         # Không dùng làm dự phòng trước thời điểm này (sau nhiều lần lỗi liên tiếp)
+
+
+class UpstreamFailover(threading.Thread):
+    """Nguồn NtripClient có nhiều endpoint: một endpoint đang dùng và một endpoint dự phòng nóng.
+
+    Dự phòng được giữ kết nối sẵn qua UpstreamPool (dữ liệu của nó chỉ dùng để chấm điểm) nên khi
+    endpoint đang dùng mất kết nối hoặc im lặng quá ngưỡng, gói đầu tiên của dự phòng được phát ngay,
+    không phải chờ kết nối và handshake. Không còn dự phòng nào khỏe thì kết nối song song (hedge) tới
+    mọi endpoint còn lại, endpoint nào có dữ liệu trước thì dùng. Endpoint ưu tiên hơn khỏe liên tục
+    failback_after giây thì quay về. Tham số đọc từ "failover" của trạm ở mỗi vòng kiểm tra.
+
+    Ngưỡng im lặng là silence_multiple (mặc định 2) lần nhịp watchdog của endpoint đã học, không dưới
+    min_silence (mặc định 1 giây) và không dưới khoảng cách nhận p99 đã thấy, để upstream có jitter hoặc
+    gửi theo đợt không làm failover chập chờn: nguồn đều đặn đứng im được phát hiện trong khoảng hai
+    epoch, không phải một. Khi chưa học đủ nhịp (16 lần nhận hoặc 3 epoch)
+    ngưỡng là gap_limit() của watchdog (tối đa max_gap); mất kết nối thì luôn chuyển ngay.
+    "silence_timeout" (giây) nếu khai báo sẽ thay cả hai.
+    """
+    def __init__(self, stream, endpoints, upstream_pool):
+        super().__init__(name=f"UpstreamFailover-{stream.name}", daemon=True)
+        self.stream = stream
+        self.pool = upstream_pool
+        self.endpoints = [UpstreamEndpoint(i, config, lambda data, i=i: self._on_data(i, data))
+                          for i, config in enumerate(endpoints)]
+        self.active = self.endpoints[0]
+        self.silence_timeout = None
+        self.silence_multiple = DEFAULT_FAILOVER_SILENCE_MULTIPLE
+        self.min_silence = DEFAULT_FAILOVER_MIN_SILENCE
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._failovers = UPSTREAM_FAILOVERS.labels(mountpoint=stream.name)
+        self._window_start = time.monotonic()
+
+    def _on_data(self, index, data):
+        endpoint = self.endpoints[index]
+        now = time.monotonic()
+        with self._lock:
+            if endpoint.upstream is None:
+                return  # Gói cuối của endpoint vừa hủy đăng ký
+            endpoint.last_data = now
+            endpoint.window_bytes += len(data)
+            if endpoint.healthy_since is None:
+                endpoint.healthy_since = now
+            if endpoint is not self.active:
+                if not self._is_down(self.active, now):
+                    return
+                # Endpoint đang dùng đã mất: chuyển ngay ở gói này, không chờ vòng kiểm tra
+                self._switch(endpoint, "có dữ liệu trước")
+            self.stream.ingest(data)
+
+    def _is_down(self, endpoint, now):
+        if endpoint.upstream is None:
+            return True
+        if endpoint.last_data is None:
+            # Cho endpoint mới đăng ký thời gian kết nối trước khi coi là mất
+            grace = DEFAULT_UPSTREAM_CONNECT_GRACE if self.silence_timeout is None else self.silence_timeout
+            return now - endpoint.subscribed_at > grace
+        worker = endpoint.upstream.worker
+        return not worker.connected or now - endpoint.last_data > self._silence_limit(worker.watchdog)
+
+    def _silence_limit(self, watchdog):
+        if self.silence_timeout is not None:
+            return self.silence_timeout
+        expected = watchdog.expected_interval()
+        if expected is None:
+            return watchdog.gap_limit()
+        burst_gap = watchdog.arrival_gap(FAILOVER_GAP_PERCENTILE) or 0.0
+        return min(watchdog.gap_limit(), max(self.min_silence, self.silence_multiple * expected, burst_gap))
+
+    def _score(self, endpoint, reference_rate):
+        """Điểm càng thấp càng tốt: độ trễ kết nối, nhân theo số lần lỗi, chia theo tốc độ dữ liệu tương đối."""
+        worker = endpoint.upstream.worker
+        latency = worker.connect_latency or 1.0
+        return latency * (1 + worker.failures) / max(endpoint.rate / reference_rate, 0.25)
+
+    def _switch(self, endpoint, reason):
+        previous, self.active = self.active, endpoint
+        self.stream.reset_framing()
+        self._failovers.inc()
+        log.warning("upstream_failover", "[!] /%s: Chuyển upstream %s -> %s (%s).", self.stream.name, previous.label,
+                    endpoint.label, reason, mountpoint=self.stream.name, upstream=endpoint.label)
+
+    def _subscribe(self, endpoint, now):
+        endpoint.subscribed_at = now
+        endpoint.last_data = endpoint.healthy_since = None
+        endpoint.rate = 0.0
+        endpoint.window_bytes = 0
+        endpoint.upstream = self.pool.acquire(endpoint.config, endpoint.on_data)
+
+    def _unsubscribe(self, endpoint):
+        """Hủy đăng ký ở thread riêng: pool.release join NtripClientWorker khi không còn subscriber."""
+        upstream, endpoint.upstream = endpoint.upstream, None
+        endpoint.healthy_since = None
+        release = threading.Thread(target=self.pool.release, args=(upstream, endpoint.on_data, self.stream.name),
+                                   name=f"UpstreamRelease-{endpoint.label}", daemon=True)
+        release.start()
+        return release
+
+    def _update_rates(self, now):
+        elapsed = now - self._window_start
+        if elapsed < 1.0:
+            return
+        for endpoint in self.endpoints:
+            endpoint.rate = 0.7 * endpoint.rate + 0.3 * endpoint.window_bytes / elapsed
+            endpoint.window_bytes = 0
+        self._window_start = now
+
+    def _check(self, settings, now):
+        for endpoint in self.endpoints:
+            if endpoint.last_data is None or self._is_down(endpoint, now):
+                endpoint.healthy_since = None
+        healthy = [e for e in self.endpoints if e.healthy_since is not None and e is not self.active]
+
+        if self._is_down(self.active, now):
+            if healthy:
+                reference_rate = max(e.rate for e in healthy) or 1.0
+                self._switch(min(healthy, key=lambda e: self._score(e, reference_rate)), "endpoint đang dùng im lặng")
+            elif settings.get('hedge', True):
+                for endpoint in self.endpoints:
+                    if endpoint.upstream is None:
+                        self._subscribe(endpoint, now)
+            return
+
+        failback_after = settings.get('failback_after', DEFAULT_FAILBACK_AFTER)
+        for endpoint in healthy:
+            if endpoint.index < self.active.index and now - endpoint.healthy_since >= failback_after:
+                self._switch(endpoint, "endpoint ưu tiên đã ổn định")
+                break
+
+        # Giữ đúng một dự phòng nóng, ưu tiên theo thứ tự cấu hình; dự phòng lỗi liên tiếp bị tạm bỏ qua
+        for endpoint in self.endpoints:
+            if endpoint is not self.active and endpoint.upstream is not None and endpoint.last_data is None \
+                    and endpoint.upstream.worker.failures >= STANDBY_MAX_FAILURES:
+                self._unsubscribe(endpoint)
+                endpoint.retry_at = now + failback_after
+        standby = None
+        if settings.get('warm_standby', True):
+            standby = next((e for e in self.endpoints if e is not self.active and e.retry_at <= now), None)
+        for endpoint in self.endpoints:
+            if endpoint is self.active or endpoint is standby:
+                if endpoint.upstream is None:
+                    self._subscribe(endpoint, now)
+            elif endpoint.upstream is not None:
+                self._unsubscribe(endpoint)
+
+    def run(self):
+        log.info("upstream_failover_started", "[*] /%s: Nguồn NtripClient với %s endpoint, bắt đầu từ %s.", self.stream.name,
+                 len(self.endpoints), self.active.label, mountpoint=self.stream.name)
+        with self._lock:
+            self._subscribe(self.active, time.monotonic())
+        try:
+            while not self.stop_event.wait(FAILOVER_CHECK_INTERVAL):
+                settings = self.stream.config.get('failover') or {}
+                now = time.monotonic()
+                with self._lock:
+                    self.silence_timeout = settings.get('silence_timeout')
+                    self.silence_multiple = settings.get('silence_multiple', DEFAULT_FAILOVER_SILENCE_MULTIPLE)
+                    self.min_silence = settings.get('min_silence', DEFAULT_FAILOVER_MIN_SILENCE)
+                    self._update_rates(now)
+                    self._check(settings, now)
+        finally:
+            with self._lock:
+                releases = [self._unsubscribe(e) for e in self.endpoints if e.upstream is not None]
+            for release in releases:
+                release.join(timeout=5)
+            log.info("upstream_failover_stopped", "[-] %s đã dừng.", self.name, mountpoint=self.stream.name)
+
+    def stop(self):
+        self.stop_event.set()
+
+# ==============================================================================
+# Lớp MountpointStream: trạng thái của một trạm trong caster
+# ==============================================================================
+class MountpointStream:
+    # Khóa cấu hình trạm xác định nguồn dữ liệu: đổi một trong số này khi nạp lại thì nguồn được khởi động lại
+    SOURCE_KEYS = ('mode', 'base_connection', 'fallback_connections', 'replay')
+
+    def __init__(self, station_config):
+        self.name = station_config['caster_settings']['mountpoint']
+        self.rtcm_buffer = RtcmBroadcastBuffer(
+            station_config['caster_settings'].get('ring_slots', DEFAULT_RING_SLOTS),
+            station_config['caster_settings'].get('rover_max_lag')
+        )
+        self.framer = None
+        self._framing = None
+        self._priming_cache = {}
+        self._attach_lock = threading.Lock()
+        # Khoảng trống giữa các lần nhận và nhịp epoch của nguồn; Base im lặng quá ngưỡng bị ngắt
+        self.watchdog = StreamWatchdog(self.name, station_config.get('watchdog'), BASE_READ_TIMEOUT)
+        self.apply_settings(station_config)
+        # Tổng các hành động xử lý rover chậm của mountpoint (overflows, dropped_frames, ...)
+        self.slow_rover_stats = Counter()
+        self.metrics = MountpointMetrics(self.name)
+        # NtripClientWorker, BaseStationHandler, hoặc địa chỉ Base (engine asyncio) đang cấp dữ liệu
+        self.data_source_worker = None
+        # Mountpoint Derived: stream nguồn của nó; stream nguồn: tuple các mountpoint lọc nhận frame từ nó
+        # (thay nguyên khối khi nạp lại cấu hình, xem NtripCasterServer._link_derived)
+        self.derived_from = None
+        self.derived = ()
+        self.upstream = None
+        self.upstream_pool = None
+        # RtcmArchiveWriter khi server_settings.archive bật (xem start_archive)
+        self.archive = None
+        # SharedRtcmRing khi chạy nhiều tiến trình: tiến trình chính chép mọi frame sang cho các worker
+        self.shared_ring = None
+
+    def apply_settings(self, station_config):
+        """Đọc các tham số có thể đổi khi đang chạy; rover đã kết nối giữ bộ đệm gửi cũ, rover mới dùng giá trị mới."""
+        caster_settings = station_config['caster_settings']
+        # Mặc định tách frame RTCM3 để mỗi slot của ring là một frame hoàn chỉnh;
+        # đặt "rtcm_framing": false để chuyển tiếp nguyên chunk cho nguồn không phải RTCM3
+        framing = (caster_settings.get('rtcm_framing', True), caster_settings.get('rtcm_validate_crc', True))
+        if framing != self._framing:
+            self._framing = framing
+            self.framer = RtcmFramer(validate_crc=framing[1]) if framing[0] else None
         self.config = station_config
-        self.caster_settings = station_config['caster_settings']
+        self.caster_settings = caster_settings
+        self.watchdog.configure(station_config.get('watchdog'))
+        # Frame mới nhất của mỗi message tĩnh (1005/1006, ephemeris...) để gửi mồi cho rover vừa kết nối
+        self.priming_types = tuple(caster_settings.get('priming_message_types', DEFAULT_PRIMING_MESSAGE_TYPES))
+        self.rover_send_buffer = caster_settings.get('rover_send_buffer_bytes', DEFAULT_ROVER_SEND_BUFFER)
+        self.rover_coalesce_window = caster_settings.get('rover_coalesce_ms', DEFAULT_ROVER_COALESCE_MS) / 1000
+        self.slow_rover_policy = caster_settings.get('slow_rover_policy', DEFAULT_SLOW_ROVER_POLICY)
+        # Mountpoint Derived: tập message giữ lại ("message_types") hoặc bỏ đi ("exclude_message_types")
+        derived = station_config.get('derived') or {}
+        self.message_types = frozenset(derived['message_types']) if derived.get('message_types') else None
+        self.excluded_message_types = frozenset(derived.get('exclude_message_types') or ())
+        if self.slow_rover_policy not in SLOW_ROVER_POLICIES:
+            log.warning("invalid_slow_rover_policy", "[!] /%s: Chính sách rover chậm '%s' không hợp lệ, dùng '%s'.", self.name,
+                        self.slow_rover_policy, DEFAULT_SLOW_ROVER_POLICY, mountpoint=self.name)
+            self.slow_rover_policy = DEFAULT_SLOW_ROVER_POLICY
+
+    def source_changed(self, station_config):
+        return any(station_config.get(key) != self.config.get(key) for key in self.SOURCE_KEYS)
+
+    def close(self):
+        """Gỡ mountpoint: dừng nguồn, ghi nốt archive và ngắt các rover đang nhận."""
+        self.derived = ()
+        self.stop_source()
+        self.stop_archive()
+        self.rtcm_buffer.close()
+
+    def position(self):
+        """(lat, lon) của trạm: caster_settings.location, rồi lat/lon trong dòng STR, rồi base_connection.location."""
+        fields = (self.caster_settings.get('sourcetable') or '').split(';')
+        candidates = (
+            self.caster_settings.get('location'),
+            {'lat': fields[9], 'lon': fields[10]} if len(fields) > 10 else None,
+            self.config.get('base_connection', {}).get('location'),
+        )
+        for location in candidates:
+            try:
+                return float(location['lat']), float(location['lon'])
+            except (TypeError, KeyError, ValueError):
+                continue
+        if self.derived_from is not None:
+            return self.derived_from.position()
+        return None
+
+    def has_active_source(self):
+        if self.derived_from is not None:
+            return self.derived_from.has_active_source()
+        worker = self.data_source_worker
+        if isinstance(worker, threading.Thread):
+            return worker.is_alive()
+        return worker is not None
+
+    def ingest(self, data):
+        """Nhận chunk thô từ nguồn và phát các frame hoàn chỉnh vào ring.
+
+        Rover mới đăng ký tại vị trí writer nên luôn bắt đầu đúng ranh giới frame.
+        """
+        self.metrics.bytes_in.inc(len(data))
+        now = time.monotonic()
+        self.watchdog.on_arrival(now)
+        archive = self.archive
+        if self.framer is None:
+            self.metrics.frames_in.inc()
+            self.rtcm_buffer.publish(data)
+            if self.shared_ring is not None:
+                self.shared_ring.publish_many(((None, data),))
+            if archive is not None:
+                archive.append(data)
+            return
+        frames = self.framer.feed(data)
+        if not frames:
+            return
+        self.watchdog.on_frames(frames, now)
+        self.publish_frames(frames)
+        if archive is not None:
+            archive.append_frames(frames)
+
+    def publish_frames(self, frames):
+        """Phát các (msg_type, frame) đã tách sẵn vào ring và cập nhật cache mồi."""
+        self.metrics.frames_in.inc(len(frames))
+        priming_types = self.priming_types
+        with self._attach_lock:
+            for msg_type, frame in frames:
+                if msg_type in priming_types:
+                    self._priming_cache[msg_type] = frame
+            self.rtcm_buffer.publish_many(frames)
+        if self.shared_ring is not None:
+            self.shared_ring.publish_many(frames)
+        for view in self.derived:
+            view.publish_filtered(frames)
+
+    def publish_filtered(self, frames):
+        """Mountpoint Derived: phát các frame có message được chọn.
+
+        Frame đã được phân loại (msg_type) khi stream nguồn tách frame, nên ở đây chỉ còn một
+        phép tra set cho mỗi frame; tuple (msg_type, frame) được dùng chung với ring của nguồn,
+        không chép dữ liệu.
+        """
+        if self.message_types is not None:
+            selected = [item for item in frames if item[0] in self.message_types]
+        else:
+            excluded = self.excluded_message_types
+            selected = [item for item in frames if item[0] not in excluded]
+        if selected:
+            self.metrics.bytes_in.inc(sum(len(frame) for _, frame in selected))
+            self.publish_frames(selected)
+
+    def reader_backlog(self):
+        """Độ tụt của reader chậm nhất trên ring của trạm và các mountpoint Derived, theo tỷ lệ dung lượng ring."""
+        rings = [self.rtcm_buffer] + [view.rtcm_buffer for view in self.derived]
+        return max(ring.max_reader_lag() / ring.capacity for ring in rings)
+
+    def attach(self):
+        """Đăng ký rover mới: trả về (RingReader, danh sách (msg_type, frame) mồi gửi ngay sau 200 OK).
+
+        Chụp cache và đăng ký con trỏ trong cùng một khóa với ingest nên không frame nào
+        bị lọt giữa phần mồi và phần dữ liệu trực tiếp.
+        """
+        with self._attach_lock:
+            reader = self.rtcm_buffer.subscribe()
+            cache = self._priming_cache
+            priming = [(t, cache[t]) for t in self.priming_types if t in cache]
+        return reader, priming
+
+    def new_output_buffer(self, chunked=False):
+        return RoverOutputBuffer(self.rover_send_buffer, self.slow_rover_policy, self.slow_rover_stats,
+                                 self.rover_coalesce_window, chunked)
+
+    def start_source(self, upstream_pool):
+        if self.config['mode'] == 'NtripClient':
+            endpoints = upstream_endpoints(self.config)
+            if len(endpoints) > 1:
+                self.data_source_worker = UpstreamFailover(self, endpoints, upstream_pool)
+                self.data_source_worker.start()
+                return
+            self.upstream_pool = upstream_pool
+            self.upstream = upstream_pool.acquire(endpoints[0], self.ingest)
+            self.data_source_worker = self.upstream.worker
+        elif self.config['mode'] == 'Replay':
+            self.data_source_worker = ArchiveReplayWorker(self.config['replay'], self)
+            self.data_source_worker.start()
+        elif self.config['mode'] == 'Derived':
+            log.info("derived_started", "[*] /%s (Derived): Lọc message từ /%s.", self.name, self.config['derived']['source'],
+                     mountpoint=self.name)
+        elif self.config['mode'] == 'NtripCaster':
+            log.info("waiting_for_base", "[*] /%s (NtripCaster): Đang chờ Base Station kết nối và đẩy dữ liệu...", self.name,
+                     mountpoint=self.name)
+
+    def start_archive(self, settings):
+        """Ghi mọi frame nhận được vào <directory>/<mountpoint>/; "record": false trong caster_settings để bỏ qua trạm.
+
+        Mountpoint Derived mặc định không ghi vì dữ liệu đã có trong archive của stream nguồn.
+        """
+        if not self.caster_settings.get('record', self.config['mode'] != 'Derived'):
+            return
+        directory = archive_directory(settings.get('directory', DEFAULT_ARCHIVE_DIRECTORY), self.name)
+        self.archive = RtcmArchiveWriter(directory, settings)
+        self.archive.start()
+
+    def stop_archive(self):
+        archive, self.archive = self.archive, None
+        if archive is not None:
+            archive.close()
+
+    def stop_source(self):
+        if self.upstream is not None:
+            self.upstream_pool.release(self.upstream, self.ingest, self.name)
+            self.upstream = None
+            return
+        worker = self.data_source_worker
+        if isinstance(worker, threading.Thread) and worker.is_alive():
+            log.info("source_stopping", "[*] Đang dừng nguồn dữ liệu (%s)...", worker.name, mountpoint=self.name)
+            worker.stop()
+            worker.join(timeout=5)
+        elif worker is not None:
+            self.data_source_worker = None  # Base trên engine asyncio tự dừng ở lần đọc kế tiếp
+
+    def on_base_disconnect(self):
+        log.warning("base_lost", "[!] Kết nối từ Base Station của /%s đã mất. Caster đang chờ kết nối Base mới.", self.name,
+                    mountpoint=self.name)
+        self.data_source_worker = None
+        self.reset_framing()
+
+    def reset_framing(self):
+        """Nguồn dữ liệu đổi: bỏ frame dở dang của nguồn cũ."""
+        if self.framer is not None:
+            self.framer.reset()
+        # Base mới có thể ở vị trí khác, không được mồi rover bằng thông tin trạm cũ
+        with self._attach_lock:
+            self._priming_cache.clear()
+        for view in self.derived:
+            view.reset_framing()
+
+# ==============================================================================
+# Lớp Caster Server chính (Cập nhật: nhiều trạm / nhiều mountpoint trong một tiến trình)
+# ==============================================================================
+class NtripCasterServer:
+    SUPPORTED_MODES = ('NtripClient', 'NtripCaster', 'Replay', 'Derived')
+
+    # <<< THAY ĐỔI: Constructor nhận toàn bộ danh sách trạm thay vì một trạm
+    def __init__(self, stations, global_rover_accounts, server_settings=None):
+        self.stations = stations
         self.global_rover_accounts = global_rover_accounts # <<< THAY ĐỔI: Lưu trữ tài khoản toàn cục
-        self.rtcm_data_queue = Queue(maxsize=100)
-        self.server_socket = None
+        self.server_settings = server_settings or {}
+        self.rover_accounts = RoverAccountStore(global_rover_accounts, self.server_settings.get('rover_auth'))
+        self.mountpoints = {name: MountpointStream(station) for name, station in self._valid_stations(stations).items()}
+        self.source_handoff = None  # Socket tới tiến trình chính (chỉ có trong worker)
+        self._link_derived(self.mountpoints)
+        self.nearest_router = self._build_router(self.server_settings.get('nearest_mountpoint'), self.mountpoints)
+        self.upstream_pool = UpstreamPool()
+        self.listen_backlog = self.server_settings.get('listen_backlog', DEFAULT_LISTEN_BACKLOG)
+        # "workers" > 1: các tiến trình con cùng lắng nghe một cổng (SO_REUSEPORT) và phục vụ rover;
+        # tiến trình chính giữ nguồn dữ liệu, chép frame sang worker qua SharedRtcmRing
+        self.workers = max(1, int(self.server_settings.get('workers', 1)))
+        self.worker_index = 0
+        self.reuse_port = False
+        self._workers = []          # (Process, wake_socket, handoff_socket) ở tiến trình chính
+        self._wakeup = None
+        self.admission = AdmissionController(self.server_settings.get('admission'), self.workers)
+        # /metrics trả lời trên cổng caster; đặt "metrics_path": null để tắt, "metrics_port" để mở cổng riêng
+        self.metrics_path = self.server_settings.get('metrics_path', DEFAULT_METRICS_PATH)
+        self.metrics_server = None
+        self._engine = None
+        self._pending_handshakes = {}
+        self._sourcetable = None  # (mountpoints, nearest_router, server_settings, EncodedSourcetable) gần nhất
+        self.server_sockets = []
         self.rover_handlers = []
-        self.data_source_worker = None
         self.stop_event = threading.Event()
+        # Nạp lại cấu hình khi đang chạy (xem enable_config_reload)
+        self.config_path = None
+        self.station_names = None
+        self._config_watcher = None
+        self._reload_lock = threading.Lock()
 
-    def _handle_sourcetable_request(self, client_socket):
-        print(f"[*] Gửi Sourcetable cho {client_socket.getpeername()}")
-        sourcetable = self.caster_settings.get("sourcetable", "")
-        response = (
-            "HTTP/1.1 200 OK\r\n"
-            "Content-Type: text/plain\r\n"
-            f"Content-Length: {len(sourcetable)}\r\n"
-            "Connection: close\r\n\r\n"
-            f"{sourcetable}\r\n"
-            "ENDSOURCETABLE\r\n"
-        )
-        client_socket.sendall(response.encode())
+    def _valid_stations(self, stations):
+        """mountpoint -> cấu hình trạm, bỏ qua (kèm cảnh báo) trạm không hợp lệ hoặc trùng mountpoint."""
+        valid = {}
+        for station in stations:
+            if station.get('mode') not in self.SUPPORTED_MODES:
+                log.warning("station_skipped", "[!] Bỏ qua trạm '%s': Mode '%s' không được hỗ trợ.", station.get('name'),
+                            station.get('mode'))
+                continue
+            if station['mode'] == 'NtripClient' and not upstream_endpoints(station):
+                log.warning("station_skipped", "[!] Bỏ qua trạm '%s': Mode NtripClient cần 'base_connection'.", station.get('name'))
+                continue
+            if station['mode'] == 'Replay' and not (station.get('replay') or {}).get('directory'):
+                log.warning("station_skipped", "[!] Bỏ qua trạm '%s': Mode Replay cần 'replay.directory'.", station.get('name'))
+                continue
+            name = station['caster_settings']['mountpoint']
+            if name in valid:
+                log.warning("station_skipped", "[!] Bỏ qua trạm '%s': Mountpoint /%s bị trùng.", station.get('name'), name)
+                continue
+            valid[name] = station
+        # Mountpoint Derived cần stream nguồn hợp lệ (không phải Derived khác) đang tách frame RTCM
+        for name, station in list(valid.items()):
+            if station['mode'] != 'Derived':
+                continue
+            derived = station.get('derived') or {}
+            source = valid.get(derived.get('source'))
+            if source is None or source['mode'] == 'Derived':
+                reason = "'derived.source' phải là mountpoint NtripClient, NtripCaster hoặc Replay"
+            elif not source['caster_settings'].get('rtcm_framing', True):
+                reason = f"nguồn /{derived['source']} tắt rtcm_framing nên không lọc được message"
+            elif not derived.get('message_types') and not derived.get('exclude_message_types'):
+                reason = "cần 'derived.message_types' hoặc 'derived.exclude_message_types'"
+            else:
+                continue
+            log.warning("station_skipped", "[!] Bỏ qua trạm '%s': %s.", station.get('name'), reason)
+            del valid[name]
+        return valid
+
+    def _link_derived(self, mountpoints):
+        """Gắn mỗi mountpoint Derived vào stream nguồn của nó.
+
+        Chỉ tiến trình chính phát frame sang mountpoint lọc; worker nhận frame của mountpoint lọc
+        qua SharedRtcmRing riêng của nó như mọi mountpoint khác.
+        """
+        views = {}
+        for stream in mountpoints.values():
+            stream.derived_from = None
+            if stream.config['mode'] == 'Derived':
+                stream.derived_from = mountpoints[stream.config['derived']['source']]
+                views.setdefault(stream.derived_from.name, []).append(stream)
+        for stream in mountpoints.values():
+            stream.derived = tuple(views.get(stream.name, ())) if self.source_handoff is None else ()
+
+    @staticmethod
+    def _build_router(nearest_settings, mountpoints):
+        if not nearest_settings:
+            return None
+        router = NearestStationRouter(nearest_settings, mountpoints)
+        if router.name in mountpoints:
+            log.warning("nearest_mountpoint_skipped", "[!] Bỏ qua mountpoint định tuyến /%s: trùng với một trạm thật.",
+                        router.name)
+        elif not router.index.size:
+            log.warning("nearest_mountpoint_skipped", "[!] Bỏ qua mountpoint định tuyến /%s: không trạm nào có tọa độ.",
+                        router.name)
+        else:
+            return router
+        return None
+
+    def listen_addresses(self):
+        """Các địa chỉ cần lắng nghe; mọi listener phục vụ chung tất cả mountpoint.
+
+        Nếu server_settings có 'port' thì chỉ mở một cổng duy nhất cho mọi trạm.
+        """
+        if 'port' in self.server_settings:
+            return [(self.server_settings.get('host', '0.0.0.0'), self.server_settings['port'])]
+        addresses = []
+        for stream in self.mountpoints.values():
+            address = (stream.caster_settings['host'], stream.caster_settings['port'])
+            if address not in addresses:
+                addresses.append(address)
+        return addresses
+
+    def sourcetable(self):
+        """EncodedSourcetable của cấu hình đang chạy; chỉ dựng lại khi reload_config thay mountpoint, router hoặc server_settings."""
+        mountpoints, router, settings = self.mountpoints, self.nearest_router, self.server_settings
+        cached = self._sourcetable
+        if cached is not None and cached[0] is mountpoints and cached[1] is router and cached[2] is settings:
+            return cached[3]
+        options = settings.get('sourcetable') or {}
+        entries = []
+        for stream in mountpoints.values():
+            entry = stream.caster_settings.get('sourcetable')
+            if not entry and options.get('generate_missing', True):
+                entry = station_entry(stream.name, stream.config.get('name', stream.name), stream.position())
+            if entry:
+                entries.append(entry)
+        if router is not None and router.sourcetable:
+            entries.append(router.sourcetable)
+        table = EncodedSourcetable(entries, options)
+        self._sourcetable = (mountpoints, router, settings, table)
+        return table
+
+    def sourcetable_response(self, request_data, keep_alive=False):
+        """Phản hồi sourcetable dựng sẵn (200, 200 gzip hoặc 304 theo If-None-Match) cho yêu cầu GET /."""
+        table = self.sourcetable()
+        variant = table.variant(ntrip_version(request_data), keep_alive, request_data)
+        SOURCETABLE_REQUESTS.labels(response=variant[2]).inc()
+        return table.response(variant)
+
+    def is_metrics_request(self, request_str):
+        return bool(self.metrics_path) and request_str.startswith(f"GET {self.metrics_path} ")
+
+    def handshake_queue_depth(self):
+        if isinstance(self._engine, AsyncCasterEngine):
+            return self._engine._handshakes
+        return len(self._pending_handshakes)
+
+    def collect_metrics(self):
+        """Gauge/counter đọc trực tiếp từ trạng thái server khi /metrics được scrape (không tốn gì trên đường nóng)."""
+        slow_rover, crc_errors, sources, archived, archive_dropped = [], [], [], [], []
+        for stream in self.mountpoints.values():
+            labels = {'mountpoint': stream.name}
+            slow_rover.extend((dict(labels, event=event), count) for event, count in stream.slow_rover_stats.items())
+            if stream.framer is not None:
+                crc_errors.append((labels, stream.framer.crc_errors))
+            sources.append((labels, 1 if stream.has_active_source() else 0))
+            if stream.archive is not None:
+                archived.append((labels, stream.archive.frames))
+                archive_dropped.append((labels, stream.archive.dropped_frames))
+        return [
+            ('ntrip_slow_rover_events_total', 'counter', 'Hành động xử lý rover chậm', slow_rover),
+            ('ntrip_rtcm_crc_errors_total', 'counter', 'Frame RTCM3 sai CRC bị bỏ', crc_errors),
+            ('ntrip_source_connected', 'gauge', 'Mountpoint đang có nguồn dữ liệu', sources),
+            ('ntrip_admission_rejected_total', 'counter', 'Kết nối bị từ chối ở bước nhận',
+             [({'reason': reason}, count) for reason, count in self.admission.rejected.items()]),
+            ('ntrip_handshake_queue_depth', 'gauge', 'Kết nối đang chờ gửi yêu cầu',
+             [({}, self.handshake_queue_depth())]),
+            ('ntrip_log_records_dropped_total', 'counter', 'Bản ghi log bị bỏ vì hàng đợi log đầy',
+             [({}, dropped_records())]),
+            ('ntrip_archive_frames_total', 'counter', 'Frame đã ghi xuống file lưu trữ', archived),
+            ('ntrip_archive_dropped_frames_total', 'counter', 'Frame không ghi được vào file lưu trữ', archive_dropped),
+        ]
+
+    def _handle_metrics_request(self, client_socket):
+        # Đọc hết yêu cầu (mới chỉ MSG_PEEK) để close() không gửi RST làm mất phản hồi
+        client_socket.recv(4096)
+        client_socket.sendall(REGISTRY.http_response())
         client_socket.close()
 
-    def _on_base_disconnect(self):
-        print("[!] Kết nối từ Base Station đã mất. Caster đang chờ kết nối Base mới.")
-        self.data_source_worker = None
+    def _handle_sourcetable_request(self, client_socket, request_str, first_bytes):
+        """Trả sourcetable; True nếu kết nối được giữ lại (NTRIP 2.0 keep-alive) để chờ yêu cầu kế tiếp."""
+        log.info("sourcetable_sent", "[*] Gửi Sourcetable cho %s", client_socket.getpeername())
+        # Đọc hết yêu cầu (mới chỉ MSG_PEEK): giữ kết nối thì yêu cầu sau bắt đầu đúng chỗ,
+        # đóng kết nối thì close() không gửi RST làm mất phản hồi
+        head_end = first_bytes.find(b"\r\n\r\n")
+        client_socket.recv(head_end + 4 if head_end >= 0 else len(first_bytes))
+        keep_alive = head_end >= 0 and ntrip_version(request_str) == 2 and request_keep_alive(request_str)
+        client_socket.sendall(self.sourcetable_response(request_str, keep_alive))
+        if not keep_alive:
+            client_socket.close()
+        return keep_alive
+
+    def _handle_source_request(self, client_socket, address, request_str, request_consumed=False, initial_data=b""):
+        if self.source_handoff is not None:
+            # Đọc thật header (mới chỉ MSG_PEEK); RTCM đọc kèm được chuyển nguyên byte sang tiến trình chính
+            client_socket.settimeout(self.admission.handshake_timeout)
+            try:
+                request_str, initial_data = split_head(recv_head(client_socket))
+            except OSError as e:
+                log.info("base_bad_request", "[-] Yêu cầu từ Base %s không hợp lệ hoặc timeout: %s", address, e, peer=address)
+            else:
+                client_socket.settimeout(None)
+                self.handoff_source(client_socket, request_str, address, initial_data)
+            client_socket.close()
+            return
+        stream = find_source_stream(request_str, self.mountpoints)
+        if stream is None:
+            log.info("base_rejected", "[-] Base %s: Mountpoint trong yêu cầu SOURCE/POST không tồn tại.", address, peer=address)
+            client_socket.sendall(b"HTTP/1.1 404 Not Found\r\n\r\nERROR - Bad Mountpoint\r\n")
+            client_socket.close()
+        elif stream.has_active_source():
+            log.warning("base_rejected", "[!] /%s đã có Base kết nối. Từ chối kết nối Base mới từ %s", stream.name, address,
+                        peer=address, mountpoint=stream.name)
+            client_socket.sendall(b"HTTP/1.1 409 Conflict\r\n\r\nERROR - Caster already has a source\r\n")
+            client_socket.close()
+        else:
+            stream.data_source_worker = BaseStationHandler(client_socket, address, stream.config,
+                                                           stream.ingest, stream.on_base_disconnect,
+                                                           request_str if request_consumed else None, stream.watchdog,
+                                                           initial_data)
+            stream.data_source_worker.start()
+
+    def _open_listeners(self):
+        for host, port in self.listen_addresses():
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                server_socket.bind((host, port))
+                server_socket.listen(self.listen_backlog)
+            except OSError as e:
+                log.error("bind_failed", "[!] LỖI NGHIÊM TRỌNG: Không thể bind tới %s:%s. Lỗi: %s", host, port, e)
+                server_socket.close()
+                return False
+            self.server_sockets.append(server_socket)
+            log.info("listening", "[+] Caster đang lắng nghe trên %s:%s cho tất cả mountpoint (Rover và Base mode NtripCaster)",
+                     host, port)
+        return True
 
     def start(self):
         print("="*45)
-        print(f"=== KHỞI ĐỘNG TRẠM: {self.config['name']} ===")
-        print(f"=== MODE: {self.config['mode']} ===")
+        print(f"=== KHỞI ĐỘNG CASTER: {len(self.mountpoints)} TRẠM ===")
+        for stream in self.mountpoints.values():
+            print(f"===  /{stream.name}: {stream.config['name']} (MODE: {stream.config['mode']})")
+        if self.nearest_router is not None:
+            print(f"===  /{self.nearest_router.name}: Trạm gần nhất theo GGA ({self.nearest_router.index.size} trạm)")
         print("="*45)
 
-        if self.config['mode'] == 'NtripClient':
-            self.data_source_worker = NtripClientWorker(self.config['base_connection'], self.rtcm_data_queue)
-            self.data_source_worker.start()
-        elif self.config['mode'] == 'NtripCaster':
-            print("[*] Chế độ NtripCaster: Đang chờ Base Station kết nối và đẩy dữ liệu...")
-        else:
-            print(f"[!] Lỗi: Mode '{self.config['mode']}' không được hỗ trợ.")
+        if not self.mountpoints:
+            print("[!] Lỗi: Không có trạm hợp lệ nào để khởi động.")
             return
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            host = self.caster_settings['host']
-            port = self.caster_settings['port']
-            self.server_socket.bind((host, port))
-            self.server_socket.listen(10)
-            print(f"[+] Caster đang lắng nghe trên {host}:{port} cho các kết nối từ Rover (và Base nếu ở mode NtripCaster)")
-        except OSError as e:
-            print(f"[!] LỖI NGHIÊM TRỌNG: Không thể bind tới {host}:{port}. Lỗi: {e}")
-            self.stop()
+        # Tách worker trước khi có thread nguồn nào chạy để tiến trình con chỉ mang theo trạng thái rỗng
+        if self.workers > 1 and not self._start_workers(self.workers):
             return
 
-        while not self.stop_event.is_set():
+        archive_settings = self.server_settings.get('archive') or {}
+        for stream in self.mountpoints.values():
+            if archive_settings.get('enabled'):
+                stream.start_archive(archive_settings)
+            stream.start_source(self.upstream_pool)
+
+        REGISTRY.add_callback(self.collect_metrics)
+        metrics_port = self.server_settings.get('metrics_port')
+        if metrics_port:
             try:
-                self.server_socket.settimeout(1.0)
-                client_socket, address = self.server_socket.accept()
-                
-                first_bytes = client_socket.recv(1024, socket.MSG_PEEK)
-                request_str = first_bytes.decode(errors='ignore')
+                self.metrics_server = serve_metrics(REGISTRY, self.server_settings.get('metrics_host', '0.0.0.0'), metrics_port)
+                log.info("metrics_listening", "[+] Metrics Prometheus tại http://%s:%s/metrics",
+                         self.server_settings.get('metrics_host', '0.0.0.0'), metrics_port)
+            except OSError as e:
+                log.error("bind_failed", "[!] Không mở được cổng metrics %s: %s", metrics_port, e)
 
-                if request_str.startswith('GET / '):
-                    self._handle_sourcetable_request(client_socket)
-                    continue
+        self._start_config_watcher()
+        self._run_engine()
 
-                if self.config['mode'] == 'NtripCaster' and request_str.startswith('SOURCE '):
-                    if self.data_source_worker and self.data_source_worker.is_alive():
-                        print(f"[!] Đã có Base kết nối. Từ chối kết nối Base mới từ {address}")
-                        client_socket.sendall(b"HTTP/1.1 409 Conflict\r\n\r\nERROR - Caster already has a source\r\n")
-                        client_socket.close()
-                    else:
-                        self.data_source_worker = BaseStationHandler(client_socket, address, self.config, self.rtcm_data_queue, self._on_base_disconnect)
-                        self.data_source_worker.start()
+    def _run_engine(self):
+        engine = self.server_settings.get('engine', DEFAULT_ENGINE)
+        if engine == 'asyncio':
+            self._engine = AsyncCasterEngine(self)
+            self._engine.run()
+            return
+        if engine != 'thread':
+            print(f"[!] Lỗi: Engine '{engine}' không được hỗ trợ.")
+            return
+
+        if not self._open_listeners():
+            if self.worker_index == 0:
+                self.stop()
+            return
+
+        self._accept_loop()
+
+    # ==========================================================================
+    # Chế độ nhiều tiến trình (server_settings.workers > 1, chỉ trên Linux)
+    # ==========================================================================
+    def _start_workers(self, count):
+        """Fork count - 1 worker; tiến trình chính cũng là một worker phục vụ rover."""
+        if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(socket, 'send_fds') or \
+                'fork' not in multiprocessing.get_all_start_methods():
+            log.warning("workers_unsupported", "[!] Hệ điều hành không hỗ trợ SO_REUSEPORT/fork, chạy một tiến trình.")
+            return True
+        self.reuse_port = True
+        ring_size = int(self.server_settings.get('shared_ring_mb', DEFAULT_SHARED_RING_MB) * 2**20)
+        ring_slots = int(self.server_settings.get('shared_ring_slots', DEFAULT_SHARED_RING_SLOTS))
+        try:
+            for stream in self.mountpoints.values():
+                stream.shared_ring = SharedRtcmRing(ring_size, ring_slots)
+        except OSError as e:
+            print(f"[!] Lỗi: Không tạo được shared memory cho worker: {e}")
+            self._close_shared_rings()
+            return False
+
+        context = multiprocessing.get_context('fork')
+        self._wakeup = WorkerWakeup()
+        for index in range(1, count):
+            wake_parent, wake_child = channel_pair()
+            handoff_parent, handoff_child = channel_pair()
+            process = context.Process(target=self._run_worker, args=(index, wake_child, handoff_child),
+                                      name=f"caster-worker-{index}", daemon=True)
+            process.start()
+            wake_child.close()
+            handoff_child.close()
+            self._wakeup.add(wake_parent)
+            self._workers.append((process, wake_parent, handoff_parent))
+        for stream in self.mountpoints.values():
+            stream.shared_ring.notify = self._wakeup
+        threading.Thread(target=self._receive_handoffs, name="source-handoff", daemon=True).start()
+        log.info("workers_started", "[+] Đã khởi động %s worker dùng chung cổng (SO_REUSEPORT).", count - 1,
+                 workers=count)
+        return True
+
+    def _receive_handoffs(self):
+        """Nhận socket Base (SOURCE) mà worker đã accept; nguồn dữ liệu luôn chạy ở tiến trình chính."""
+        selector = selectors.DefaultSelector()
+        for _, _, handoff_socket in self._workers:
+            selector.register(handoff_socket, selectors.EVENT_READ)
+        while not self.stop_event.is_set():
+            for key, _ in selector.select(timeout=1.0):
+                try:
+                    payload, fds, _, _ = socket.recv_fds(key.fileobj, HANDOFF_MAX_PAYLOAD, 1)
+                except OSError:
+                    selector.unregister(key.fileobj)
                     continue
-                
-                # <<< THAY ĐỔI: Truyền danh sách tài khoản toàn cục vào RoverHandler
-                handler = RoverHandler(
-                    client_socket, 
-                    address, 
-                    self.caster_settings, 
-                    self.global_rover_accounts, 
-                    self.rtcm_data_queue
-                )
-                handler.start()
-                self.rover_handlers.append(handler)
-                self.rover_handlers = [h for h in self.rover_handlers if h.is_alive()]
+                if not fds:
+                    continue
+                client_socket = socket.socket(fileno=fds[0])
+                client_socket.setblocking(True)
+                try:
+                    message = json.loads(payload)
+                    self._handle_source_request(client_socket, tuple(message['address']), message['request'],
+                                                request_consumed=True, initial_data=base64.b64decode(message['data']))
+                except (ValueError, KeyError, OSError) as e:
+                    log.error("source_handoff_failed", "[!] Không nhận được kết nối Base từ worker: %s", e)
+                    client_socket.close()
+        selector.close()
+
+    def handoff_source(self, client_socket, request_data, address, initial_data=b""):
+        """Trong worker: chuyển socket Base (kèm yêu cầu và các byte RTCM đã đọc sau header) về tiến trình chính."""
+        payload = json.dumps({'request': request_data, 'address': list(address[:2]),
+                              'data': base64.b64encode(initial_data).decode()}).encode()
+        try:
+            socket.send_fds(self.source_handoff, [payload], [client_socket.fileno()])
+        except OSError as e:
+            log.error("source_handoff_failed", "[!] Không chuyển được kết nối Base %s về tiến trình chính: %s", address, e,
+                      peer=address)
+
+    def _run_worker(self, index, wake_socket, handoff_socket):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_event.set())
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
+        self.worker_index = index
+        self.source_handoff = handoff_socket
+        for _, wake_parent, handoff_parent in self._workers:
+            wake_parent.close()
+            handoff_parent.close()
+        self._workers = []
+        self._wakeup = None
+        followers = []
+        for stream in self.mountpoints.values():
+            stream.derived = ()  # Mountpoint lọc nhận frame qua shared ring của chính nó
+            ring, stream.shared_ring = stream.shared_ring, None
+            ring.owner = False
+            followers.append((stream, ring, ring.cursor()))
+        follower = threading.Thread(target=self._follow_shared_rings, args=(wake_socket, followers),
+                                    name="shared-ring-follower", daemon=True)
+        follower.start()
 
+        REGISTRY.add_callback(self.collect_metrics)
+        self._start_config_watcher()
+        log.info("worker_started", "[+] Worker %s (pid %s) đã sẵn sàng.", index, os.getpid(), worker=index)
+        try:
+            self._run_engine()
+        finally:
+            self.stop_event.set()
+            if self._config_watcher is not None:
+                self._config_watcher.stop()
+            follower.join(timeout=2)
+            self._join_rover_handlers()
+            for _, ring, _ in followers:
+                ring.close()
+            wake_socket.close()
+            handoff_socket.close()
+            self.rover_accounts.shutdown()
+            shutdown_logging()
+
+    def _follow_shared_rings(self, wake_socket, followers):
+        """Trong worker: mỗi lần được đánh thức, chuyển frame mới từ shared memory vào ring cục bộ."""
+        wake_socket.settimeout(1.0)
+        parent = os.getppid()
+        while not self.stop_event.is_set():
+            if os.getppid() != parent:
+                # Tiến trình chính đã chết (bị kill): dừng để không giữ cổng mà không còn dữ liệu
+                log.error("worker_orphaned", "[!] Worker %s mất tiến trình chính, đang dừng.", self.worker_index)
+                self.stop_event.set()
+                break
+            try:
+                wake_socket.recv(64)
+                wake_socket.setblocking(False)
+                try:
+                    while wake_socket.recv(64):
+                        pass  # Gộp các lần báo dồn lại thành một lượt đọc
+                except BlockingIOError:
+                    pass
+                wake_socket.settimeout(1.0)
             except socket.timeout:
-                continue
+                pass
+            except OSError:
+                break
+            for stream, _, cursor in followers:
+                frames = cursor.read()
+                if frames:
+                    stream.metrics.bytes_in.inc(sum(len(frame) for _, frame in frames))
+                    stream.publish_frames(frames)
+
+    def _stop_workers(self):
+        for process, _, _ in self._workers:
+            process.terminate()
+        for process, wake_socket, handoff_socket in self._workers:
+            process.join(timeout=3)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            wake_socket.close()
+            handoff_socket.close()
+        self._workers = []
+        if self._wakeup is not None:
+            self._wakeup.close()
+            self._wakeup = None
+        self._close_shared_rings()
+
+    def _close_shared_rings(self):
+        for stream in self.mountpoints.values():
+            ring, stream.shared_ring = stream.shared_ring, None
+            if ring is not None:
+                ring.notify = None
+                ring.close()
+
+    def _reject(self, client_socket, address, reason):
+        log.warning("connection_rejected", "[!] Từ chối kết nối %s: %s", address, reason, peer=address)
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(BUSY_RESPONSE)
+        except OSError:
+            pass
+        client_socket.close()
+
+    def _accept_pending(self, listener, selector, pending):
+        """Nhận kết nối trong backlog trong giới hạn token toàn cục; chỉ đăng ký chờ handshake, không đọc."""
+        while self.admission.global_wait() == 0:
+            try:
+                client_socket, address = listener.accept()
+            except BlockingIOError:
+                return
+            # Chỉ trừ token khi đã thực sự nhận được kết nối (đánh thức giả không tốn token)
+            self.admission.take_global()
+            if not self.admission.allow_ip(address[0]):
+                self._reject(client_socket, address, "vượt giới hạn kết nối theo IP")
+            elif self.admission.queue_full(len(pending)):
+                self._reject(client_socket, address, "hàng đợi handshake đầy")
+            else:
+                pending[client_socket] = (address, time.monotonic() + self.admission.handshake_timeout)
+                selector.register(client_socket, selectors.EVENT_READ, address)
+
+    def _dispatch(self, client_socket, address):
+        # Socket đã sẵn sàng đọc nên MSG_PEEK trả về ngay
+        first_bytes = client_socket.recv(1024, socket.MSG_PEEK)
+        request_str = first_bytes.decode(errors='ignore')
+
+        if request_str.startswith('GET / '):
+            return self._handle_sourcetable_request(client_socket, request_str, first_bytes)
+
+        if self.is_metrics_request(request_str):
+            self._handle_metrics_request(client_socket)
+            return
+
+        if is_source_request(request_str):
+            self._handle_source_request(client_socket, address, request_str)
+            return
+
+        if request_str and request_method(request_str) != 'GET':
+            log.info("bad_request", "[-] %s gửi method không hỗ trợ: %s", address, request_method(request_str), peer=address)
+            client_socket.recv(len(first_bytes))  # Đọc phần đã MSG_PEEK để close() không gửi RST làm mất phản hồi
+            client_socket.sendall(METHOD_NOT_ALLOWED_RESPONSE)
+            client_socket.close()
+            return
+        
+        # <<< THAY ĐỔI: RoverHandler tự định tuyến theo mountpoint trong yêu cầu
+        handler = RoverHandler(
+            client_socket, 
+            address, 
+            self.mountpoints, 
+            self.rover_accounts,
+            self.nearest_router
+        )
+        handler.start()
+        self.rover_handlers.append(handler)
+        self.rover_handlers = [h for h in self.rover_handlers if h.is_alive()]
+
+    def _accept_loop(self):
+        """Một selector cho cả listener lẫn các kết nối chưa gửi yêu cầu.
+
+        Không lời gọi nào trong vòng lặp chờ một client cụ thể: kết nối chỉ được đọc khi đã
+        có dữ liệu, và bị đóng khi quá handshake_timeout. Khi hết token toàn cục, listener
+        tạm ngừng nhận và kết nối mới xếp hàng trong backlog của kernel.
+        """
+        selector = selectors.DefaultSelector()
+        for server_socket in self.server_sockets:
+            server_socket.setblocking(False)
+        listeners = set(self.server_sockets)
+        accepting = False
+        pending = self._pending_handshakes  # socket -> (address, hạn handshake)
+
+        while not self.stop_event.is_set():
+            try:
+                wait = self.admission.global_wait()
+                if accepting != (wait == 0):
+                    # Hết token: bỏ listener khỏi selector để không quay vòng rỗng trong lúc chờ
+                    accepting = wait == 0
+                    for server_socket in self.server_sockets:
+                        if accepting:
+                            selector.register(server_socket, selectors.EVENT_READ)
+                        else:
+                            selector.unregister(server_socket)
+                for key, _ in selector.select(timeout=min(wait, 1.0) if wait else 1.0):
+                    sock = key.fileobj
+                    if sock in listeners:
+                        self._accept_pending(sock, selector, pending)
+                        continue
+                    selector.unregister(sock)
+                    address, _ = pending.pop(sock)
+                    try:
+                        if self._dispatch(sock, address):
+                            # Kết nối keep-alive quay lại hàng chờ với hạn handshake mới (vẫn đúng thứ tự hết hạn)
+                            pending[sock] = (address, time.monotonic() + self.admission.handshake_timeout)
+                            selector.register(sock, selectors.EVENT_READ, address)
+                    except OSError as e:
+                        log.info("bad_request", "[-] Lỗi khi đọc yêu cầu từ %s: %s", address, e, peer=address)
+                        sock.close()
+
+                # Mọi kết nối có cùng handshake_timeout nên thứ tự chèn của dict cũng là thứ tự hết hạn
+                now = time.monotonic()
+                while pending:
+                    sock, (address, deadline) = next(iter(pending.items()))
+                    if deadline > now:
+                        break
+                    selector.unregister(sock)
+                    del pending[sock]
+                    self.admission.rejected['handshake_timeout'] += 1
+                    log.info("handshake_timeout", "[-] Yêu cầu từ %s bị timeout khi chờ yêu cầu.", address, peer=address)
+                    sock.close()
             except Exception as e:
                 if not self.stop_event.is_set():
-                    print(f"[!] Lỗi trong vòng lặp chính của server: {e}")
+                    log.error("accept_loop_error", "[!] Lỗi trong vòng lặp chính của server: %s", e)
                 break
-        
-        print("[-] Vòng lặp chính của server đã dừng.")
+
+        for sock in pending:
+            sock.close()
+        pending.clear()
+        selector.close()
+        log.info("server_stopped", "[-] Vòng lặp chính của server đã dừng.")
+
+    # ==========================================================================
+    # Nạp lại cấu hình khi đang chạy (theo dõi file và SIGHUP)
+    # ==========================================================================
+    def enable_config_reload(self, path, station_names=None):
+        """Theo dõi file cấu hình sau khi start(); station_names giới hạn các trạm được nạp (None = tất cả)."""
+        self.config_path = path
+        self.station_names = station_names
+
+    def _start_config_watcher(self):
+        settings = self.server_settings.get('config_reload') or {}
+        if self.config_path is None or not settings.get('enabled', True):
+            return
+        self._config_watcher = ConfigWatcher(self.config_path, self.reload_config, settings)
+        self._config_watcher.start()
+
+    def request_reload(self):
+        """Gọi từ handler SIGHUP: nạp lại ngay trên thread theo dõi, và chuyển tín hiệu cho các worker."""
+        if self._config_watcher is not None:
+            self._config_watcher.trigger()
+        for process, _, _ in self._workers:
+            try:
+                os.kill(process.pid, signal.SIGHUP)
+            except OSError:
+                pass
+
+    def reload_config(self, config_data):
+        """Áp dụng cấu hình mới mà không ngắt rover/Base đang kết nối.
+
+        Kho tài khoản, stream của trạm mới và router được dựng xong trước, sau đó mới thay
+        vào server bằng các phép gán tham chiếu; kết nối mới thấy trọn cấu hình cũ hoặc mới.
+        Mountpoint giữ nguyên tên thì giữ nguyên ring nên rover đang nhận không bị ảnh hưởng;
+        nguồn chỉ khởi động lại khi khóa nguồn (mode, base_connection, fallback_connections, replay) đổi.
+        """
+        with self._reload_lock:
+            settings = config_data.get('server_settings', {})
+            accounts = config_data.get('global_rover_accounts', [])
+            stations = config_data.get('stations', [])
+            if self.station_names is not None:
+                stations = [station for station in stations if station.get('name') in self.station_names]
+            for key in RESTART_REQUIRED_SETTINGS:
+                if settings.get(key) != self.server_settings.get(key):
+                    log.warning("config_restart_required", "[!] Thay đổi server_settings.%s chỉ có hiệu lực sau khi khởi động lại.",
+                                key, setting=key)
+            settings = dict(settings, **{key: self.server_settings.get(key) for key in RESTART_REQUIRED_SETTINGS
+                                         if key in self.server_settings})
+            # Nhiều tiến trình: ring dùng chung được tạo lúc fork nên không thêm/bớt được mountpoint
+            fixed_set = bool(self.reuse_port)
+
+            old = self.mountpoints
+            mountpoints, added, updated, restarted = {}, [], [], []
+            for name, station in self._valid_stations(stations).items():
+                stream = old.get(name)
+                if stream is None:
+                    if fixed_set:
+                        log.warning("config_restart_required", "[!] Thêm /%s cần khởi động lại khi chạy nhiều tiến trình.", name,
+                                    mountpoint=name)
+                        continue
+                    stream = MountpointStream(station)
+                    added.append(stream)
+                elif station != stream.config:
+                    ring_settings = ('ring_slots', 'rover_max_lag', 'host', 'port')
+                    if any(station['caster_settings'].get(key) != stream.caster_settings.get(key) for key in ring_settings):
+                        log.warning("config_restart_required", "[!] /%s: đổi %s chỉ có hiệu lực sau khi khởi động lại.", name,
+                                    "/".join(ring_settings), mountpoint=name)
+                    (restarted if stream.source_changed(station) else updated).append((stream, station))
+                mountpoints[name] = stream
+            removed = [stream for name, stream in old.items() if name not in mountpoints]
+            if fixed_set and removed:
+                log.warning("config_restart_required", "[!] Gỡ mountpoint cần khởi động lại khi chạy nhiều tiến trình.")
+                mountpoints.update((stream.name, stream) for stream in removed)
+                removed = []
+            router = self._build_router(settings.get('nearest_mountpoint'), mountpoints)
+            rover_accounts = None
+            if accounts != self.global_rover_accounts or settings.get('rover_auth') != self.server_settings.get('rover_auth'):
+                rover_accounts = RoverAccountStore(accounts, settings.get('rover_auth'), previous=self.rover_accounts)
+
+            for stream, station in restarted:
+                if self.worker_index == 0:
+                    stream.stop_source()
+                stream.apply_settings(station)
+            for stream, station in updated:
+                stream.apply_settings(station)
+            self._link_derived(mountpoints)
+
+            # Thay cấu hình đang phục vụ
+            old_accounts = self.rover_accounts
+            if rover_accounts is not None:
+                self.rover_accounts, self.global_rover_accounts = rover_accounts, accounts
+            self.mountpoints = mountpoints
+            self.nearest_router = router
+            self.stations = stations
+            if settings.get('admission') != self.server_settings.get('admission'):
+                self.admission = AdmissionController(settings.get('admission'), self.workers)
+            if settings.get('logging') != self.server_settings.get('logging'):
+                configure_logging(settings.get('logging'))
+            self.metrics_path = settings.get('metrics_path', DEFAULT_METRICS_PATH)
+            self.server_settings = settings
+
+            if self.worker_index == 0:
+                archive_settings = settings.get('archive') or {}
+                for stream in added:
+                    if archive_settings.get('enabled'):
+                        stream.start_archive(archive_settings)
+                    stream.start_source(self.upstream_pool)
+                for stream, _ in restarted:
+                    stream.start_source(self.upstream_pool)
+            for stream in removed:
+                stream.close()
+            if rover_accounts is not None:
+                # Xác thực đang chạy trên kho cũ vẫn được hoàn tất
+                old_accounts.shutdown(cancel_pending=False)
+            log.info("config_reloaded",
+                     "[+] Đã nạp lại cấu hình: thêm %s, cập nhật %s, khởi động lại nguồn %s, gỡ %s trạm; %s tài khoản rover.",
+                     len(added), len(updated), len(restarted), len(removed), len(self.rover_accounts),
+                     added=[stream.name for stream in added], updated=[stream.name for stream, _ in updated],
+                     restarted=[stream.name for stream, _ in restarted], removed=[stream.name for stream in removed])
+
+    def _join_rover_handlers(self, timeout=2):
+        """Báo mọi RoverHandler dừng rồi chờ chung một hạn, thay vì chờ lần lượt từng handler."""
+        for handler in self.rover_handlers:
+            handler.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for handler in self.rover_handlers:
+            handler.join(timeout=max(0.0, deadline - time.monotonic()))
 
     def stop(self):
         print("\n[*] Đang dừng Caster...")
         self.stop_event.set()
+        if self._config_watcher is not None:
+            self._config_watcher.stop()
         
-        if self.data_source_worker and self.data_source_worker.is_alive():
-            print(f"...Đang dừng nguồn dữ liệu ({self.data_source_worker.name})...")
-            self.data_source_worker.stop()
-            self.data_source_worker.join(timeout=5)
+        for stream in self.mountpoints.values():
+            stream.stop_source()
+            stream.stop_archive()
+        if self._workers or self._wakeup is not None:
+            print("...Đang dừng các worker...")
+            self._stop_workers()
 
-        if self.server_socket:
+        if self.server_sockets:
             print("...Đang đóng Server Socket...")
-            self.server_socket.close()
+            for server_socket in self.server_sockets:
+                server_socket.close()
             
-        for handler in self.rover_handlers:
-            if handler.is_alive():
-                handler.join(timeout=2)
+        self._join_rover_handlers()
+        self.rover_accounts.shutdown()
+        REGISTRY.remove_callback(self.collect_metrics)
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
                 
         print("="*45)
         print("======== NTRIP CASTER ĐÃ DỪNG HẲN ========")
@@ -398,6 +2749,8 @@ if __name__ == "__main__":
         # <<< THAY ĐỔI: Đọc cả stations và global_rover_accounts
         stations = config_data.get("stations", [])
         global_accounts = config_data.get("global_rover_accounts", [])
+        server_settings = config_data.get("server_settings", {})
+        configure_logging(server_settings.get("logging"))
         
         if not stations:
             print(f"[!] Lỗi: File cấu hình '{CONFIG_FILE}' không có trạm nào được định nghĩa trong 'stations'.")
@@ -413,6 +2766,7 @@ if __name__ == "__main__":
         exit(1)
 
     print("--- VUI LÒNG CHỌN TRẠM CORS ĐỂ KHỞI ĐỘNG ---")
+    print("  Enter. Tất cả các trạm (một tiến trình, chung cổng lắng nghe)")
     for i, station in enumerate(stations):
         print(f"  {i + 1}. {station.get('name', f'Trạm không tên {i+1}')} (Mode: {station.get('mode', 'Chưa rõ')})")
     print("  0. Thoát")
@@ -421,9 +2775,9 @@ if __name__ == "__main__":
     choice = -1
     while True:
         try:
-            choice_str = input("Nhập lựa chọn của bạn: ")
-            choice = int(choice_str)
-            if 0 <= choice <= len(stations):
+            choice_str = input("Nhập lựa chọn của bạn: ").strip()
+            choice = int(choice_str) if choice_str else None
+            if choice is None or 0 <= choice <= len(stations):
                 break
             else:
                 print("[!] Lựa chọn không hợp lệ. Vui lòng chọn một số từ danh sách trên.")
@@ -434,12 +2788,15 @@ if __name__ == "__main__":
         print("[-] Đã thoát chương trình.")
         exit(0)
     
-    selected_station_config = stations[choice - 1]
+    selected_stations = stations if choice is None else [stations[choice - 1]]
     
     caster = None
     try:
         # <<< THAY ĐỔI: Truyền danh sách tài khoản toàn cục khi khởi tạo Caster
-        caster = NtripCasterServer(selected_station_config, global_accounts)
+        caster = NtripCasterServer(selected_stations, global_accounts, server_settings)
+        caster.enable_config_reload(CONFIG_FILE, None if choice is None else {selected_stations[0].get('name')})
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: caster.request_reload())
         caster.start()
     except KeyboardInterrupt:
         print("\n[!] Nhận tín hiệu Ctrl+C, đang tắt chương trình...")
@@ -447,4 +2804,5 @@ if __name__ == "__main__":
         print(f"\n[!] Một lỗi nghiêm trọng đã xảy ra: {e}")
     finally:
         if caster:
-            caster.stop()
\ No newline at end of file
+            caster.stop()
+        shutdown_logging()
\ No newline at end of file
@@ -4,7 +4,15 @@ import time
 import json
 import os
 import threading
-from datetime import datetime
+import selectors
+import heapq
+import itertools
+import errno
+from collections import deque
+
+from nmea import GgaTemplate
+from ntrip_http import ResponseReader
+from rtcm_archive import ArchiveRecorder, archive_directory, DEFAULT_ARCHIVE_DIRECTORY
 
 # Định nghĩa đường dẫn tệp cấu hình và dữ liệu
 CONFIG_FILE = "ntrip_config.json"
@@ -18,37 +26,21 @@ DEFAULT_PROVINCES = {
 }
 
 # Quản lý các kết nối/threads đang hoạt động
-# Sẽ chứa dicts: {'id': str, 'thread': obj, 'name': str, 'province': str, 'stop_event': Event}
+# Sẽ chứa dicts: {'id': str, 'session': NtripSession, 'name': str, 'province': str, 'upstream_key': tuple}
 running_connection_threads = []
 thread_lock = threading.Lock() # Để bảo vệ truy cập vào running_connection_threads
 global_conn_counter = 0 # Để tạo ID duy nhất cho mỗi kết nối
 
+# Pool kết nối upstream dùng chung, key (host, port, mountpoint, username, password, tọa độ GGA hoặc None)
+# Sẽ chứa dicts: {'key': tuple, 'session': NtripSession, 'province': str, 'subscribers': {conn_id: callback hoặc None},
+#                  'recorder': ArchiveRecorder hoặc None}
+upstream_pool = {}
 
-# ====== Chuyển đổi tọa độ từ decimal degrees sang NMEA format ======
-def convert_to_nmea_format(lat, lon):
-    lat_abs = abs(lat)
-    lat_deg = int(lat_abs)
-    lat_min = (lat_abs - lat_deg) * 60
-    lat_dir = "N" if lat >= 0 else "S"
-    lat_nmea = f"{lat_deg:02d}{lat_min:06.3f}"
-    lon_abs = abs(lon)
-    lon_deg = int(lon_abs)
-    lon_min = (lon_abs - lon_deg) * 60
-    lon_dir = "E" if lon >= 0 else "W"
-    lon_nmea = f"{lon_deg:03d}{lon_min:06.3f}"
-    return lat_nmea, lat_dir, lon_nmea, lon_dir
 
 # ====== Tạo câu GGA từ tọa độ ======
+# Phiên chạy lâu dùng GgaTemplate (nmea.py) để không phải dựng lại cả câu mỗi lần gửi
 def generate_gga(lat, lon):
-    now = datetime.utcnow()
-    time_str = now.strftime("%H%M%S.00")
-    lat_nmea, lat_dir, lon_nmea, lon_dir = convert_to_nmea_format(lat, lon)
-    gga_body = f"$GPGGA,{time_str},{lat_nmea},{lat_dir},{lon_nmea},{lon_dir},1,12,1.0,10.0,M,0.0,M,,"
-    checksum = 0
-    for char in gga_body[1:]:
-        checksum ^= ord(char)
-    gga = f"{gga_body}*{checksum:02X}\r\n"
-    return gga
+    return GgaTemplate(lat, lon).render().decode()
 
 # ====== Tạo yêu cầu kết nối NTRIP ======
 def create_ntrip_request(host, mountpoint, username, password):
@@ -65,12 +57,6 @@ def create_ntrip_request(host, mountpoint, username, password):
     )
     return request
 
-# ====== Kiểm tra phản hồi kết nối (không print) ======
-def check_response_silent(response_bytes):
-    if b"ICY 200 OK" in response_bytes or b"HTTP/1.1 200 OK" in response_bytes:
-        return True
-    return False
-
 # ====== Lưu và đọc cấu hình (Giữ nguyên print cho menu) ======
 def save_config(config_data):
     try:
@@ -119,85 +105,317 @@ def load_provinces():
         _save_default_provinces()
         return DEFAULT_PROVINCES
 
-# ====== Quản lý kết nối NTRIP (chạy ẩn, ko log, có stop_event) ======
-def connect_ntrip_silent(connection_details, province_name, gga_interval, stop_event: threading.Event, conn_id_str: str):
-    host = connection_details["host"]
-    port = int(connection_details["port"])
-    mountpoint = connection_details["mountpoint"]
-    username = connection_details["username"]
-    password = connection_details["password"]
-
-    # Sử dụng load_provinces nhưng không in ra lỗi nếu có từ hàm này, vì đây là worker thread
-    # Lỗi load_provinces sẽ được xử lý ở menu hoặc khi khởi tạo
-    local_provinces_data = {}
-    try:
-        with open(PROVINCES_FILE, "r", encoding="utf-8") as f:
-            local_provinces_data = json.load(f)
-    except: # Bất kỳ lỗi nào khi đọc file tỉnh, dùng default (hoặc rỗng nếu muốn chặt chẽ hơn)
-        local_provinces_data = DEFAULT_PROVINCES
+# ====== Engine đa kênh: một thread + selectors quản lý mọi kết nối NTRIP ======
+class NtripSession:
+    """Một kết nối NTRIP do NtripClientEngine quản lý (thay cho một thread riêng mỗi kết nối)."""
+    CONNECT_TIMEOUT = 20.0
+
+    def __init__(self, connection_details, lat, lon, gga_interval, on_data=None):
+        self.host = connection_details["host"]
+        self.port = int(connection_details["port"])
+        self.request = create_ntrip_request(self.host, connection_details["mountpoint"],
+                                            connection_details["username"], connection_details["password"]).encode()
+        self.gga = GgaTemplate(lat, lon)
+        self.gga_interval = gga_interval
+        self.on_data = on_data
+        self.sock = None
+        self.state = "connecting"  # connecting -> handshake -> streaming -> closed
+        self.response = None  # ResponseReader của yêu cầu đang chờ/đang nhận
+        self.gga_started = False
+        self.outbox = bytearray()
+        self._done = threading.Event()
+
+    # Giữ giao diện giống threading.Thread để phần menu quản lý không phải thay đổi
+    def is_alive(self):
+        return not self._done.is_set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+
+class NtripClientEngine:
+    """Một thread duy nhất chờ trên selector cho mọi socket NTRIP.
+
+    GGA và timeout kết nối được lập lịch trong một heap hẹn giờ, nên thời gian chờ của
+    select() bằng đúng hạn gần nhất: không có kết nối nào bị đánh thức định kỳ khi rảnh.
+    Các thao tác từ thread khác (thêm/đóng phiên) được chuyển vào qua hàng đợi lệnh
+    và một socketpair để đánh thức selector.
+    """
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._commands = deque()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._sessions = set()
+        self._thread = threading.Thread(target=self._run, name="NtripClientEngine", daemon=True)
+        self._thread.start()
+
+    # --- Gọi từ thread khác ---
+    def _submit(self, fn, *args):
+        self._commands.append((fn, args))
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass # Socket đánh thức đã đầy nghĩa là engine sắp thức dậy rồi
 
+    def add_session(self, session):
+        # Phân giải DNS ngay tại thread gọi để không chặn vòng lặp của engine
+        try:
+            address = socket.getaddrinfo(session.host, session.port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+        except (socket.gaierror, OSError):
+            session._done.set()
+            return False
+        self._submit(self._open, session, address)
+        return True
 
-    if province_name not in local_provinces_data:
-        # Worker thread không nên print, lỗi này sẽ khiến thread kết thúc lặng lẽ.
-        # print(f"Debug [{conn_id_str}]: Không tìm thấy tỉnh {province_name}")
-        return
+    def close_session(self, session):
+        self._submit(self._close, session)
+
+    # --- Chạy trên thread của engine ---
+    def _run(self):
+        while True:
+            timeout = None
+            if self._timers:
+                timeout = max(0.0, self._timers[0][0] - time.monotonic())
+            for key, mask in self._selector.select(timeout):
+                session = key.data
+                if session is None:
+                    self._drain_wakeups()
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self._on_writable(session)
+                if mask & selectors.EVENT_READ and session.state != "closed":
+                    self._on_readable(session)
+            self._run_due_timers()
+            while self._commands:
+                fn, args = self._commands.popleft()
+                fn(*args)
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _call_later(self, delay, fn, session):
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_seq), fn, session))
+
+    def _run_due_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, fn, session = heapq.heappop(self._timers)
+            if session.state != "closed":
+                fn(session)
+
+    def _open(self, session, address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        session.sock = sock
+        self._sessions.add(session)
+        if sock.connect_ex(address) not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self._close(session)
+            return
+        self._selector.register(sock, selectors.EVENT_WRITE, session)
+        self._call_later(session.CONNECT_TIMEOUT, self._check_handshake_timeout, session)
 
-    lat, lon = local_provinces_data[province_name]
-    
-    s = None
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(20.0) # Initial connection timeout
-        s.connect((host, port))
+    def _check_handshake_timeout(self, session):
+        if session.state in ("connecting", "handshake"):
+            self._close(session)
 
-        request = create_ntrip_request(host, mountpoint, username, password)
-        s.sendall(request.encode())
+    def _update_interest(self, session):
+        events = selectors.EVENT_READ
+        if session.outbox or session.state == "connecting":
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(session.sock, events, session)
 
-        response = s.recv(2048)
-        if not check_response_silent(response):
-            return 
+    def _send(self, session, data):
+        session.outbox += data
+        self._flush(session)
 
-        initial_gga = generate_gga(lat, lon)
-        s.sendall(initial_gga.encode())
+    def _flush(self, session):
+        try:
+            sent = session.sock.send(session.outbox)
+            del session.outbox[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close(session)
+            return
+        self._update_interest(session)
+
+    def _on_writable(self, session):
+        if session.state == "connecting":
+            if session.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                self._close(session)
+                return
+            self._send_request(session)
+        else:
+            self._flush(session)
+
+    def _on_readable(self, session):
+        try:
+            data = session.sock.recv(4096) # Kích thước buffer nhận dữ liệu
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(session)
+            return
+        if not data:
+            self._close(session)
+            return
+        self._on_data(session, data)
 
-        last_gga_time = time.time()
-        s.settimeout(1.0) # Short timeout for recv to check stop_event frequently
+    def _send_request(self, session):
+        session.state = "handshake"
+        session.response = ResponseReader()
+        self._send(session, session.request)
 
-        while not stop_event.is_set():
-            current_time = time.time()
-            if current_time - last_gga_time >= gga_interval:
-                gga_message = generate_gga(lat, lon)
+    def _on_data(self, session, data):
+        # Header phản hồi có thể tới qua nhiều lần recv; phần thân chunked (NTRIP 2.0) được giải mã tại đây
+        response = session.response
+        try:
+            pieces = response.feed(data)
+        except ValueError:
+            self._close(session)
+            return
+        if session.state == "handshake":
+            if response.head is None:
+                return
+            if not response.head.is_stream:
+                self._close(session)
+                return
+            session.state = "streaming"
+            if not session.gga_started:
+                session.gga_started = True
+                self._send_gga(session)
+        # Dữ liệu RTCM đã nhận được phát tới các phiên đang dùng chung upstream
+        if session.on_data is not None:
+            for piece in pieces:
                 try:
-                    s.sendall(gga_message.encode())
-                    last_gga_time = current_time
-                except socket.error:
-                    break 
-            
+                    session.on_data(piece)
+                except Exception:
+                    pass # Lỗi ở phía tiêu thụ dữ liệu không được làm dừng engine
+        if response.finished and session.state == "streaming":
+            # Caster kết thúc luồng bằng chunk cuối: giữ kết nối thì yêu cầu lại trên cùng socket
+            if not response.head.keep_alive:
+                self._close(session)
+                return
+            self._send_request(session)
+            if response.leftover and session.state != "closed":
+                self._on_data(session, response.leftover)
+
+    def _send_gga(self, session):
+        self._send(session, session.gga.render())
+        if session.state != "closed":
+            self._call_later(session.gga_interval, self._send_gga, session)
+
+    def _close(self, session):
+        if session.state == "closed":
+            return
+        session.state = "closed"
+        self._sessions.discard(session)
+        if session.sock is not None:
             try:
-                data = s.recv(4096) # Kích thước buffer nhận dữ liệu
-                if not data:
-                    break 
-                # Dữ liệu RTCM đã nhận (biến `data`)
-                # Có thể xử lý ở đây: ghi file, chuyển tiếp, etc. (hiện tại bỏ qua)
-
-            except socket.timeout:
-                continue # Bình thường, không có dữ liệu, tiếp tục check stop_event/send GGA
-            except socket.error:
-                break 
-            except Exception: # Lỗi không mong muốn khác
-                break
-    
-    except (socket.timeout, socket.error, ConnectionRefusedError):
-        pass # Các lỗi kết nối dự kiến, thread sẽ tự kết thúc
-    except Exception:
-        pass # Các lỗi không mong muốn khác, thread sẽ tự kết thúc
-    finally:
-        if s:
+                self._selector.unregister(session.sock)
+            except (KeyError, ValueError):
+                pass
             try:
-                s.shutdown(socket.SHUT_RDWR)
-            except:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
                 pass
-            s.close()
+            session.sock.close()
+        session._done.set()
+
+
+_client_engine = None
+
+def get_client_engine():
+    global _client_engine
+    with thread_lock:
+        if _client_engine is None:
+            _client_engine = NtripClientEngine()
+        return _client_engine
+
+# ====== Pool kết nối upstream: nhiều phiên dùng chung một socket ======
+def upstream_key(connection_details, coordinates=None):
+    # Phiên luôn gửi GGA: upstream VRS/NEAREST trả số hiệu chỉnh theo vị trí nên mỗi vị trí một socket,
+    # trừ kết nối khai báo "position_independent": true (mountpoint trạm đơn)
+    position = None if connection_details.get("position_independent") else coordinates
+    return (connection_details["host"], int(connection_details["port"]), connection_details["mountpoint"],
+            connection_details.get("username", ""), connection_details.get("password", ""), position)
+
+def _dispatch_upstream_data(key, data):
+    upstream = upstream_pool.get(key)
+    if upstream is None:
+        return
+    recorder = upstream['recorder']
+    if recorder is not None:
+        recorder(data)
+    for callback in tuple(upstream['subscribers'].values()):
+        if callback is not None:
+            callback(data)
+
+def _province_coordinates(province_name):
+    # Không in lỗi ở đây; lỗi đọc tệp tỉnh đã được xử lý ở menu hoặc khi khởi tạo
+    try:
+        with open(PROVINCES_FILE, "r", encoding="utf-8") as f:
+            provinces_data = json.load(f)
+    except: # Bất kỳ lỗi nào khi đọc file tỉnh, dùng default
+        provinces_data = DEFAULT_PROVINCES
+    return provinces_data.get(province_name)
+
+def _start_recorder(connection_details):
+    # Kết nối có "record": true ghi dữ liệu RTCM vào <archive.directory>/<host>_<port>_<mountpoint>/
+    settings = load_config().get("archive") or {}
+    name = f"{connection_details['host']}_{connection_details['port']}_{connection_details['mountpoint']}"
+    return ArchiveRecorder(archive_directory(settings.get("directory", DEFAULT_ARCHIVE_DIRECTORY), name), settings)
+
+def acquire_upstream(connection_details, province_name, gga_interval, conn_id, on_data=None):
+    """Đăng ký phiên conn_id vào upstream tương ứng, chỉ mở socket mới nếu chưa có.
+
+    Trả về (upstream, is_shared), hoặc (None, False) nếu không tìm thấy tọa độ tỉnh.
+    Chỉ các phiên cùng tọa độ (hoặc kết nối "position_independent") dùng chung một upstream;
+    upstream dùng chung gửi GGA theo tỉnh của phiên đầu tiên.
+    """
+    coordinates = _province_coordinates(province_name)
+    if coordinates is None:
+        return None, False
+    lat, lon = coordinates
+    key = upstream_key(connection_details, (float(lat), float(lon)))
+    with thread_lock:
+        upstream = upstream_pool.get(key)
+        if upstream is not None and upstream['session'].is_alive():
+            upstream['subscribers'][conn_id] = on_data
+            if upstream['recorder'] is None and connection_details.get("record"):
+                upstream['recorder'] = _start_recorder(connection_details)
+            return upstream, True
+    session = NtripSession(connection_details, lat, lon, gga_interval,
+                           on_data=lambda data: _dispatch_upstream_data(key, data))
+    upstream = {'key': key, 'session': session, 'province': province_name, 'subscribers': {conn_id: on_data},
+                'recorder': _start_recorder(connection_details) if connection_details.get("record") else None}
+    with thread_lock:
+        upstream_pool[key] = upstream
+    get_client_engine().add_session(session)
+    return upstream, False
+
+def release_upstream(key, conn_id):
+    """Hủy đăng ký phiên; đóng socket upstream khi không còn phiên nào dùng."""
+    with thread_lock:
+        upstream = upstream_pool.get(key)
+        if upstream is None:
+            return
+        upstream['subscribers'].pop(conn_id, None)
+        if upstream['subscribers']:
+            return
+        del upstream_pool[key]
+    get_client_engine().close_session(upstream['session'])
+    if upstream['recorder'] is not None:
+        upstream['recorder'].close()
 
 # ====== Quản lý thông tin kết nối (Menu prints giữ nguyên) ======
 def add_connection():
@@ -208,6 +426,8 @@ def add_connection():
     mountpoint = input("Mountpoint (VD: RTCM3_GPS): ").strip()
     username = input("Tên đăng nhập (bỏ trống nếu không có): ").strip()
     password = input("Mật khẩu (bỏ trống nếu không có): ").strip()
+    record = input("Ghi dữ liệu RTCM nhận được ra file lưu trữ? (y/N): ").strip().lower() == "y"
+    position_independent = input("Mountpoint trạm đơn, dữ liệu không phụ thuộc vị trí GGA (dùng chung cho mọi tỉnh)? (y/N): ").strip().lower() == "y"
 
     if not all([name, host, port_str, mountpoint]):
         print("❌ Tên, host, port, và mountpoint không được để trống.")
@@ -220,7 +440,8 @@ def add_connection():
 
     new_connection = {
         "name": name, "host": host, "port": port,
-        "mountpoint": mountpoint, "username": username, "password": password
+        "mountpoint": mountpoint, "username": username, "password": password, "record": record,
+        "position_independent": position_independent
     }
     config_data = load_config()
     config_data["connections"].append(new_connection)
@@ -295,7 +516,7 @@ def manage_running_connections():
     cleaned_list = []
     with thread_lock:
         for conn_info in running_connection_threads:
-            if conn_info['thread'].is_alive():
+            if conn_info['session'].is_alive():
                 cleaned_list.append(conn_info)
         running_connection_threads = cleaned_list
 
@@ -305,7 +526,11 @@ def manage_running_connections():
         return
 
     for i, conn_info in enumerate(running_connection_threads):
-        print(f"{i+1}. {conn_info['name']} ({conn_info['province']}) - ID: {conn_info['id']}")
+        shared_note = ""
+        upstream = upstream_pool.get(conn_info['upstream_key'])
+        if upstream is not None and len(upstream['subscribers']) > 1:
+            shared_note = f" [dùng chung upstream với {len(upstream['subscribers']) - 1} phiên khác]"
+        print(f"{i+1}. {conn_info['name']} ({conn_info['province']}) - ID: {conn_info['id']}{shared_note}")
 
     try:
         choice_str = input("Nhập số thứ tự của kết nối để dừng (hoặc 0 để quay lại): ").strip()
@@ -315,8 +540,10 @@ def manage_running_connections():
         if 1 <= choice <= len(running_connection_threads):
             selected_conn_info = running_connection_threads[choice-1] # Lấy trước khi có thể bị remove
             print(f"🛑 Đang yêu cầu dừng kết nối {selected_conn_info['name']} (ID: {selected_conn_info['id']})...")
-            selected_conn_info['stop_event'].set()
-            # Thread sẽ tự dọn dẹp và thoát, không cần join ở đây để tránh block menu
+            release_upstream(selected_conn_info['upstream_key'], selected_conn_info['id'])
+            with thread_lock:
+                running_connection_threads = [c for c in running_connection_threads if c is not selected_conn_info]
+            # Thread upstream chỉ dừng khi phiên cuối cùng rời đi, không cần join ở đây để tránh block menu
         else:
             print("❌ Lựa chọn không hợp lệ.")
     except (ValueError, IndexError):
@@ -354,23 +581,23 @@ def main_menu():
                             global_conn_counter += 1
                             conn_id = f"NTRIP-{global_conn_counter}"
                         
-                        stop_event = threading.Event()
-                        thread = threading.Thread(
-                            target=connect_ntrip_silent,
-                            args=(selected_connection, selected_province_name, gga_interval, stop_event, conn_id),
-                            daemon=True 
-                        )
-                        thread.start()
+                        upstream, is_shared = acquire_upstream(selected_connection, selected_province_name, gga_interval, conn_id)
+                        if upstream is None:
+                            print(f"❌ Không tìm thấy tọa độ của tỉnh '{selected_province_name}'.")
+                            continue
 
                         with thread_lock:
                             running_connection_threads.append({
                                 'id': conn_id,
-                                'thread': thread,
+                                'session': upstream['session'],
                                 'name': selected_connection['name'],
                                 'province': selected_province_name,
-                                'stop_event': stop_event
+                                'upstream_key': upstream['key']
                             })
-                        print(f"✅ Đã bắt đầu kết nối ngầm cho '{selected_connection['name']}' tại '{selected_province_name}' (ID: {conn_id}).")
+                        if is_shared:
+                            print(f"✅ '{selected_connection['name']}' dùng chung kết nối upstream đang chạy (GGA theo '{upstream['province']}') (ID: {conn_id}).")
+                        else:
+                            print(f"✅ Đã bắt đầu kết nối ngầm cho '{selected_connection['name']}' tại '{selected_province_name}' (ID: {conn_id}).")
 
                     except ValueError:
                         print("❌ Khoảng thời gian không hợp lệ.")
@@ -406,29 +633,40 @@ def main_menu():
             print("❌ Lựa chọn không hợp lệ! Vui lòng chọn lại.")
 
 def shutdown_all_connections(wait_timeout=2.0):
-    """Yêu cầu dừng tất cả các thread kết nối và chờ chúng kết thúc."""
+    """Yêu cầu dừng tất cả các kết nối trong engine và chờ chúng kết thúc."""
+    global running_connection_threads
     print("👋 Đang yêu cầu dừng tất cả các kết nối ngầm...")
     
-    threads_to_wait_for = []
+    sessions_to_wait_for = []
+    recorders = []
     with thread_lock:
-        for conn_info in running_connection_threads:
-            if conn_info['thread'].is_alive():
-                conn_info['stop_event'].set()
-                threads_to_wait_for.append(conn_info['thread'])
+        for upstream in upstream_pool.values():
+            if upstream['session'].is_alive():
+                sessions_to_wait_for.append(upstream['session'])
+            if upstream['recorder'] is not None:
+                recorders.append(upstream['recorder'])
+        upstream_pool.clear()
+    # Ghi nốt dữ liệu đang đệm của các file lưu trữ trước khi thoát
+    for recorder in recorders:
+        recorder.close()
     
-    if not threads_to_wait_for:
+    if not sessions_to_wait_for:
         print("ℹ️ Không có kết nối nào đang hoạt động để dừng.")
         return
 
+    engine = get_client_engine()
+    for session in sessions_to_wait_for:
+        engine.close_session(session)
+
     print(f"⏳ Đang chờ các kết nối dừng (tối đa {wait_timeout} giây mỗi kết nối)...")
-    for t in threads_to_wait_for:
-        t.join(timeout=wait_timeout)
+    for session in sessions_to_wait_for:
+        session.join(timeout=wait_timeout)
     
     # Dọn dẹp danh sách lần cuối
     final_alive_threads = []
     with thread_lock:
         for conn_info in running_connection_threads:
-            if conn_info['thread'].is_alive():
+            if conn_info['session'].is_alive():
                 final_alive_threads.append(conn_info)
         running_connection_threads = final_alive_threads # Cập nhật lại list toàn cục
 
@@ -0,0 +1,293 @@
+import base64
+
+# ==============================================================================
+# HTTP/1.1 cho NTRIP 2.0: đọc header qua nhiều lần recv, mã hóa/giải mã chunked
+# ==============================================================================
+# NTRIP 2.0 là HTTP/1.1: rover gửi "Ntrip-Version: Ntrip/2.0" và caster trả lời
+# "HTTP/1.1 200 OK" kèm "Transfer-Encoding: chunked"; NTRIP 1.0 vẫn là "ICY 200 OK" rồi
+# tới dữ liệu thô. Bộ giải mã chunked trả về memoryview trỏ thẳng vào bytes đã nhận (không
+# ghép lại thành buffer mới), bộ mã hóa trả về danh sách buffer để ghi bằng sendmsg/writelines.
+
+HEAD_END = b"\r\n\r\n"
+MAX_HEAD_SIZE = 8192
+MAX_CHUNK_LINE = 1024
+RTCM3_PREAMBLE = 0xD3
+
+CHUNK_END = b"\r\n"
+LAST_CHUNK = b"0\r\n\r\n"
+
+ICY_STREAM_RESPONSE = b"ICY 200 OK\r\n\r\n"
+V2_STREAM_RESPONSE = (b"HTTP/1.1 200 OK\r\n"
+                      b"Ntrip-Version: Ntrip/2.0\r\n"
+                      b"Server: PythonNTRIPCaster/1.0\r\n"
+                      b"Cache-Control: no-store, no-cache, max-age=0\r\n"
+                      b"Pragma: no-cache\r\n"
+                      b"Connection: close\r\n"
+                      b"Content-Type: gnss/data\r\n"
+                      b"Transfer-Encoding: chunked\r\n\r\n")
+# Base NTRIP 2.0 đẩy dữ liệu bằng POST: caster chỉ xác nhận rồi đọc phần thân
+V2_SOURCE_RESPONSE = (b"HTTP/1.1 200 OK\r\n"
+                      b"Ntrip-Version: Ntrip/2.0\r\n"
+                      b"Server: PythonNTRIPCaster/1.0\r\n"
+                      b"Connection: close\r\n\r\n")
+METHOD_NOT_ALLOWED_RESPONSE = (b"HTTP/1.1 405 Method Not Allowed\r\n"
+                               b"Allow: GET, POST, SOURCE\r\n"
+                               b"Connection: close\r\n\r\n")
+
+
+# ==============================================================================
+# Yêu cầu (phía caster)
+# ==============================================================================
+def header_value(request_data, name):
+    """Giá trị header `name` (không phân biệt hoa thường) trong yêu cầu dạng str, hoặc None."""
+    prefix = name.lower() + ':'
+    for line in request_data.partition('\r\n\r\n')[0].split('\r\n')[1:]:
+        if line.lower().startswith(prefix):
+            return line[len(prefix):].strip()
+    return None
+
+def request_method(request_data):
+    return request_data.partition(' ')[0]
+
+def request_chunked(request_data):
+    return 'chunked' in (header_value(request_data, 'Transfer-Encoding') or '').lower()
+
+def basic_auth_credentials(request_data):
+    """(username, password) từ header "Authorization: Basic ...", hoặc None nếu thiếu/sai định dạng."""
+    value = header_value(request_data, 'Authorization') or ''
+    auth_type, _, token = value.partition(' ')
+    if auth_type.lower() != 'basic':
+        return None
+    try:
+        username, password = base64.b64decode(token.strip(), validate=True).decode().split(':', 1)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return username, password
+
+def ntrip_version(request_data):
+    """2 nếu client gửi "Ntrip-Version: Ntrip/2.0", ngược lại 1."""
+    version = header_value(request_data, 'Ntrip-Version') or ''
+    return 2 if version.lower().startswith('ntrip/2') else 1
+
+def request_keep_alive(request_data):
+    """HTTP/1.1 mặc định giữ kết nối, trừ khi client gửi "Connection: close"."""
+    request_line = request_data.partition('\r\n')[0]
+    connection = (header_value(request_data, 'Connection') or '').lower()
+    if request_line.endswith('HTTP/1.1'):
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+def stream_response(version):
+    return V2_STREAM_RESPONSE if version == 2 else ICY_STREAM_RESPONSE
+
+def source_response(request_data):
+    """Phản hồi chấp nhận Base: "ICY 200 OK" cho SOURCE, HTTP/1.1 cho POST (NTRIP 2.0)."""
+    return V2_SOURCE_RESPONSE if request_method(request_data) == 'POST' else ICY_STREAM_RESPONSE
+
+def recv_head(sock, max_size=MAX_HEAD_SIZE):
+    """Đọc từ socket chặn tới khi có trọn header, kể cả khi header bị chia qua nhiều gói.
+
+    Trả về mọi byte đã đọc (header và phần thân gửi kèm nếu có); b"" nếu client đóng ngay.
+    """
+    data = b""
+    while len(data) < max_size:
+        chunk = sock.recv(max_size - len(data))
+        if not chunk:
+            break
+        # Dấu kết thúc header có thể nằm vắt qua ranh giới hai lần recv
+        search_from = max(0, len(data) - len(HEAD_END) + 1)
+        data += chunk
+        if data.find(HEAD_END, search_from) >= 0:
+            break
+    return data
+
+def split_head(data):
+    """Tách bytes đã đọc thành (header dạng str kèm CRLF CRLF, phần byte theo sau header).
+
+    Phần theo sau (RTCM mà Base gửi ngay sau SOURCE) giữ nguyên byte, không qua decode.
+    """
+    end = data.find(HEAD_END)
+    if end < 0:
+        return data.decode(errors='ignore'), b""
+    end += len(HEAD_END)
+    return data[:end].decode(errors='ignore'), data[end:]
+
+
+# ==============================================================================
+# Phản hồi (phía client)
+# ==============================================================================
+class ResponseHead:
+    """Dòng trạng thái và header của phản hồi: "ICY 200 OK", "HTTP/1.1 200 OK", "SOURCETABLE 200 OK"."""
+    def __init__(self, raw):
+        lines = raw.decode('latin-1').split('\r\n')
+        parts = lines[0].split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise ValueError(f"Dòng trạng thái không hợp lệ: {lines[0]!r}")
+        self.status_line = lines[0]
+        self.protocol = parts[0].upper()
+        self.status = int(parts[1])
+        self.headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                self.headers[name.strip().lower()] = value.strip()
+
+    @property
+    def chunked(self):
+        return 'chunked' in self.headers.get('transfer-encoding', '').lower()
+
+    @property
+    def is_stream(self):
+        # Caster NTRIP 2.0 trả sourcetable (cũng là 200 OK) khi mountpoint không tồn tại
+        if self.status != 200 or self.protocol == 'SOURCETABLE':
+            return False
+        return not self.headers.get('content-type', '').lower().startswith('gnss/sourcetable')
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.protocol == 'HTTP/1.1':
+            return connection != 'close'
+        return self.protocol == 'HTTP/1.0' and connection == 'keep-alive'
+
+
+def _head_end(buffer):
+    """(vị trí hết header, vị trí bắt đầu phần thân) hoặc None nếu header chưa đủ."""
+    end = buffer.find(HEAD_END)
+    if end >= 0:
+        return end, end + len(HEAD_END)
+    # Một số caster NTRIP 1.0 chỉ gửi "ICY 200 OK\r\n" rồi vào thẳng dữ liệu RTCM
+    if buffer[:4] == b"ICY ":
+        line_end = buffer.find(b"\r\n")
+        if 0 <= line_end < len(buffer) - 2 and buffer[line_end + 2] == RTCM3_PREAMBLE:
+            return line_end, line_end + 2
+    return None
+
+
+class ChunkedDecoder:
+    """Giải mã Transfer-Encoding: chunked theo luồng, dữ liệu có thể bị cắt ở bất kỳ byte nào.
+
+    feed() trả về các memoryview trỏ vào chính `data` đã truyền vào; chỉ dòng kích thước
+    chunk bị cắt đôi mới được chép tạm. Sau chunk cuối (kích thước 0), `finished` là True
+    và phần byte còn thừa (phản hồi kế tiếp trên kết nối keep-alive) nằm ở `leftover`.
+    """
+    _SIZE, _DATA, _DATA_END, _TRAILER = range(4)
+
+    def __init__(self):
+        self._state = self._SIZE
+        self._line = bytearray()
+        self._remaining = 0
+        self.finished = False
+        self.leftover = b""
+
+    def _read_line(self, data, pos):
+        # Trả về (dòng đã bỏ CRLF hoặc None nếu chưa đủ, vị trí mới)
+        newline = data.find(b"\n", pos)
+        if newline < 0:
+            self._line += data[pos:]
+            if len(self._line) > MAX_CHUNK_LINE:
+                raise ValueError("Dòng kích thước chunk quá dài")
+            return None, len(data)
+        if self._line:
+            self._line += data[pos:newline]
+            line = bytes(self._line)
+            self._line.clear()
+        else:
+            line = data[pos:newline]
+        return line.rstrip(b"\r"), newline + 1
+
+    def feed(self, data):
+        if isinstance(data, memoryview):
+            data = data.obj if data.contiguous and data.nbytes == len(data.obj) else data.tobytes()
+        if self.finished:
+            self.leftover += data
+            return []
+        view = memoryview(data)
+        pieces = []
+        pos, end = 0, len(data)
+        while pos < end:
+            if self._state == self._DATA:
+                take = min(self._remaining, end - pos)
+                pieces.append(view[pos:pos + take])
+                pos += take
+                self._remaining -= take
+                if not self._remaining:
+                    self._state = self._DATA_END
+                continue
+            line, pos = self._read_line(data, pos)
+            if line is None:
+                break
+            if self._state == self._SIZE:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+                if size < 0:
+                    raise ValueError("Kích thước chunk âm")
+                if size:
+                    self._remaining = size
+                    self._state = self._DATA
+                else:
+                    self._state = self._TRAILER
+            elif self._state == self._DATA_END:
+                if line:
+                    raise ValueError("Thiếu CRLF sau dữ liệu chunk")
+                self._state = self._SIZE
+            elif not line:
+                # Dòng trống kết thúc phần trailer: hết phản hồi
+                self.finished = True
+                self.leftover = bytes(view[pos:])
+                break
+        return pieces
+
+
+class ResponseReader:
+    """Tách header phản hồi (qua nhiều lần recv) rồi trả về phần thân đã giải mã.
+
+    feed() trả về danh sách đoạn thân (memoryview); danh sách rỗng khi header chưa đủ.
+    Sau khi có header, `head` là ResponseHead để kiểm tra trạng thái trước khi dùng dữ liệu.
+    """
+    def __init__(self):
+        self.head = None
+        self._buffer = b""
+        self._decoder = None
+
+    @property
+    def finished(self):
+        """Phản hồi chunked đã tới chunk cuối (kết nối keep-alive có thể gửi yêu cầu mới)."""
+        return self._decoder is not None and self._decoder.finished
+
+    @property
+    def leftover(self):
+        return b"" if self._decoder is None else self._decoder.leftover
+
+    def feed(self, data):
+        if self.head is None:
+            buffer = self._buffer + data if self._buffer else data
+            bounds = _head_end(buffer)
+            if bounds is None:
+                if len(buffer) > MAX_HEAD_SIZE:
+                    raise ValueError("Header phản hồi quá dài")
+                self._buffer = bytes(buffer)
+                return []
+            self.head = ResponseHead(bytes(buffer[:bounds[0]]))
+            self._buffer = b""
+            if self.head.chunked:
+                self._decoder = ChunkedDecoder()
+            data = buffer[bounds[1]:]
+            if not data:
+                return []
+        if self._decoder is not None:
+            return self._decoder.feed(data)
+        return [memoryview(data)]
+
+
+# ==============================================================================
+# Mã hóa chunked (phía caster)
+# ==============================================================================
+def chunk_header(size):
+    return b"%X\r\n" % size
+
+def encode_chunk(buffers):
+    """Bọc các buffer thành một chunk: [header, *buffers, CRLF], không chép dữ liệu."""
+    size = sum(len(buffer) for buffer in buffers)
+    if not size:
+        return []
+    return [chunk_header(size), *buffers, CHUNK_END]
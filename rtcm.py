@@ -0,0 +1,141 @@
+# ==============================================================================
+# Tiện ích RTCM 3: tách frame tăng dần từ luồng byte và kiểm tra CRC-24Q
+# ==============================================================================
+# Cấu trúc một frame RTCM 3:
+#   0xD3 | 6 bit dự trữ (=0) + 10 bit độ dài payload | payload (0..1023 byte) | CRC-24Q (3 byte)
+# 12 bit đầu tiên của payload là số hiệu message (1005, 1077, ...).
+
+RTCM3_PREAMBLE = 0xD3
+RTCM3_HEADER_LEN = 3
+RTCM3_CRC_LEN = 3
+RTCM3_MAX_PAYLOAD = 1023
+CRC24Q_POLY = 0x1864CFB
+
+# Message "tĩnh": vị trí/anten trạm và lịch thiên văn, thay đổi chậm nhưng rover cần có
+# trước khi fix RTK. Thứ tự ở đây là thứ tự gửi mồi cho rover mới (thông tin trạm trước).
+STATION_MESSAGE_TYPES = (1005, 1006, 1007, 1008, 1033, 1230)
+EPHEMERIS_MESSAGE_TYPES = (1019, 1020, 1041, 1042, 1044, 1045, 1046)
+DEFAULT_PRIMING_MESSAGE_TYPES = STATION_MESSAGE_TYPES + EPHEMERIS_MESSAGE_TYPES
+
+
+def _build_crc24q_table():
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24Q_POLY
+        table.append(crc & 0xFFFFFF)
+    return tuple(table)
+
+CRC24Q_TABLE = _build_crc24q_table()
+
+
+def crc24q(data, crc=0):
+    """CRC-24Q theo bảng 256 phần tử (mỗi byte một lần tra bảng)."""
+    table = CRC24Q_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ byte]
+    return crc
+
+
+def message_type(frame):
+    """Số hiệu message của một frame hoàn chỉnh (0 nếu payload ngắn hơn 2 byte)."""
+    if len(frame) < RTCM3_HEADER_LEN + 2 + RTCM3_CRC_LEN:
+        return 0
+    return (frame[3] << 4) | (frame[4] >> 4)
+
+
+def is_msm(msg_type):
+    """MSM1..MSM7 của GPS, GLONASS, Galileo, SBAS, QZSS, BeiDou, NavIC (1071..1137)."""
+    return 1071 <= msg_type <= 1137 and 1 <= msg_type % 10 <= 7
+
+
+def is_end_of_epoch(msg_type, frame):
+    """True nếu frame là message quan trắc cuối cùng của một epoch.
+
+    MSM và 1001-1004 có cờ "multiple message" ở bit 54 của payload, 1009-1012 ở bit 51;
+    cờ = 0 nghĩa là không còn message quan trắc nào khác cho cùng epoch.
+    Trả về None nếu frame không phải message quan trắc.
+    """
+    if is_msm(msg_type) or 1001 <= msg_type <= 1004:
+        return len(frame) > 9 and not (frame[9] >> 1) & 1
+    if 1009 <= msg_type <= 1012:
+        return len(frame) > 9 and not (frame[9] >> 4) & 1
+    return None
+
+
+def encode_frame(payload):
+    """Đóng gói payload thành frame RTCM 3 hoàn chỉnh (dùng cho test/giả lập Base)."""
+    if len(payload) > RTCM3_MAX_PAYLOAD:
+        raise ValueError(f"Payload RTCM3 quá dài: {len(payload)} byte")
+    header = bytes((RTCM3_PREAMBLE, len(payload) >> 8, len(payload) & 0xFF))
+    body = header + bytes(payload)
+    return body + crc24q(body).to_bytes(3, 'big')
+
+
+class RtcmFramer:
+    """Ghép các chunk recv() thành frame RTCM3 hoàn chỉnh trên một bytearray dùng lại.
+
+    feed() trả về danh sách (message_type, memoryview). Các frame của một lần feed được
+    sao chép một lần duy nhất vào một khối bytes bất biến rồi cắt thành memoryview,
+    nên có thể chia sẻ cho mọi rover mà bytearray nội bộ vẫn được tái sử dụng.
+    """
+    def __init__(self, validate_crc=True):
+        self.validate_crc = validate_crc
+        self._buffer = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.discarded_bytes = 0
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        spans = []
+        pos = 0
+        size = len(buf)
+        with memoryview(buf) as view:
+            while pos < size:
+                start = buf.find(RTCM3_PREAMBLE, pos)
+                if start < 0:
+                    self.discarded_bytes += size - pos
+                    pos = size
+                    break
+                self.discarded_bytes += start - pos
+                pos = start
+                if start + RTCM3_HEADER_LEN > size:
+                    break
+                if buf[start + 1] & 0xFC:
+                    # Bit dự trữ khác 0: không phải đầu frame, dò tiếp từ byte sau
+                    self.discarded_bytes += 1
+                    pos = start + 1
+                    continue
+                length = ((buf[start + 1] & 0x03) << 8) | buf[start + 2]
+                end = start + RTCM3_HEADER_LEN + length + RTCM3_CRC_LEN
+                if end > size:
+                    break
+                if self.validate_crc:
+                    crc_pos = end - RTCM3_CRC_LEN
+                    expected = (buf[crc_pos] << 16) | (buf[crc_pos + 1] << 8) | buf[crc_pos + 2]
+                    if crc24q(view[start:crc_pos]) != expected:
+                        self.crc_errors += 1
+                        self.discarded_bytes += 1
+                        pos = start + 1
+                        continue
+                spans.append((start, end))
+                pos = end
+
+            frames = []
+            if spans:
+                base = spans[0][0]
+                block = memoryview(bytes(view[base:spans[-1][1]]))
+                for start, end in spans:
+                    frame = block[start - base:end - base]
+                    frames.append((message_type(frame), frame))
+        del buf[:pos]
+        self.frames += len(frames)
+        return frames
+
+    def reset(self):
+        del self._buffer[:]
@@ -0,0 +1,394 @@
+import bisect
+import calendar
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+from rtcm import RtcmFramer
+
+# ==============================================================================
+# Lưu trữ RTCM: file phân đoạn chỉ ghi nối + chỉ mục (thời điểm, offset, message type)
+# ==============================================================================
+# Mỗi luồng dữ liệu ghi vào một thư mục riêng:
+#   <thư mục>/20261016T230047123Z.rtcm   frame RTCM3 nối liền nhau, đúng như nhận được
+#   <thư mục>/20261016T230047123Z.idx    mỗi frame một bản ghi 16 byte INDEX_RECORD
+# Luồng nhận dữ liệu chỉ nối frame vào bộ đệm trong RAM; thread ghi đẩy cả lô xuống đĩa
+# mỗi flush_interval giây và fsync mỗi fsync_interval giây. Dữ liệu được ghi trước chỉ mục,
+# nên sau khi mất điện chỉ mục không bao giờ trỏ tới byte chưa có (bản ghi lửng bị bỏ qua).
+# Đọc bằng mmap và tìm nhị phân trên chỉ mục, không phải quét cả file.
+
+INDEX_RECORD = struct.Struct("<qIHH")  # thời điểm nhận (ns, UTC), offset trong .rtcm, message type, độ dài
+DATA_SUFFIX = ".rtcm"
+INDEX_SUFFIX = ".idx"
+DEFAULT_ARCHIVE_DIRECTORY = "rtcm_archive"
+DEFAULT_SEGMENT_MB = 64
+DEFAULT_SEGMENT_MINUTES = 60
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_FSYNC_INTERVAL = 5.0
+DEFAULT_MAX_PENDING_MB = 16
+MAX_SEGMENT_BYTES = 1 << 31  # offset trong chỉ mục là uint32
+
+_SEGMENT_NAME = re.compile(r"^\d{8}T\d{9}Z(-\d+)?$")
+
+
+def archive_directory(root, name):
+    """Thư mục con cho một luồng (mountpoint, upstream...), tên đã bỏ ký tự không hợp lệ."""
+    return os.path.join(root, re.sub(r"[^\w.-]+", "_", name))
+
+
+def _segment_stem(ts_ns):
+    seconds, ns = divmod(ts_ns, 1_000_000_000)
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(seconds)) + f"{ns // 1_000_000:03d}Z"
+
+
+# ==============================================================================
+# Ghi
+# ==============================================================================
+class RtcmArchiveWriter(threading.Thread):
+    """Ghi nối frame RTCM vào các phân đoạn trong `directory`.
+
+    append()/append_frames() an toàn khi gọi từ bất kỳ thread nào và không chạm tới đĩa.
+    Nếu đĩa chậm tới mức lô chờ ghi vượt max_pending_mb, frame mới bị bỏ và được đếm
+    trong dropped_frames thay vì làm chậm luồng nhận dữ liệu.
+    """
+    def __init__(self, directory, settings=None):
+        super().__init__(name=f"RtcmArchive-{os.path.basename(directory)}", daemon=True)
+        settings = settings or {}
+        self.directory = directory
+        self.segment_bytes = min(int(settings.get('segment_mb', DEFAULT_SEGMENT_MB) * 2**20), MAX_SEGMENT_BYTES)
+        self.segment_seconds = settings.get('segment_minutes', DEFAULT_SEGMENT_MINUTES) * 60
+        self.flush_interval = settings.get('flush_interval', DEFAULT_FLUSH_INTERVAL)
+        self.fsync_interval = settings.get('fsync_interval', DEFAULT_FSYNC_INTERVAL)
+        self.max_pending = int(settings.get('max_pending_mb', DEFAULT_MAX_PENDING_MB) * 2**20)
+        self.frames = 0
+        self.bytes = 0
+        self.dropped_frames = 0
+        self.segments = 0
+        self.error = None
+        self._data = bytearray()
+        self._entries = []  # (thời điểm ns, message type, độ dài) theo thứ tự trong _data
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._data_file = None
+        self._index_file = None
+        self._segment_size = 0
+        self._segment_started = 0.0
+        self._last_fsync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, frame, msg_type=0, ts_ns=None):
+        self.append_frames(((msg_type, frame),), ts_ns)
+
+    def append_frames(self, frames, ts_ns=None):
+        """Nối các (message type, frame) nhận cùng lúc; dùng chung một thời điểm nhận."""
+        ts_ns = time.time_ns() if ts_ns is None else ts_ns
+        with self._lock:
+            for msg_type, frame in frames:
+                if len(self._data) >= self.max_pending:
+                    self.dropped_frames += 1
+                    continue
+                self._data += frame
+                self._entries.append((ts_ns, msg_type or 0, len(frame)))
+
+    def close(self, timeout=10.0):
+        """Ghi nốt dữ liệu còn trong bộ đệm, fsync và đóng phân đoạn hiện tại."""
+        self._closing = True
+        self._wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+        else:
+            self._flush(force_sync=True)
+            self._close_segment()
+
+    def run(self):
+        while not self._closing:
+            self._wakeup.wait(self.flush_interval)
+            self._flush()
+        self._flush(force_sync=True)
+        self._close_segment()
+
+    def _flush(self, force_sync=False):
+        with self._lock:
+            data, self._data = self._data, bytearray()
+            entries, self._entries = self._entries, []
+        try:
+            if entries:
+                self._write_batch(data, entries)
+            if self._data_file is not None and (force_sync or time.monotonic() - self._last_fsync >= self.fsync_interval):
+                self._sync()
+        except OSError as e:
+            # Lỗi đĩa: giữ thread sống để lần sau thử lại với phân đoạn mới, lô hiện tại bị mất
+            self.error = e
+            self.dropped_frames += len(entries)
+            self._close_segment()
+
+    def _write_batch(self, data, entries):
+        view = memoryview(data)
+        position = 0
+        start = 0
+        while start < len(entries):
+            if (self._data_file is None or self._segment_size >= self.segment_bytes
+                    or time.monotonic() - self._segment_started >= self.segment_seconds):
+                self._open_segment(entries[start][0])
+            # Lấy các frame tới khi phân đoạn đầy (ít nhất một frame)
+            room = self.segment_bytes - self._segment_size
+            index = bytearray()
+            end = start
+            length = 0
+            while end < len(entries) and (end == start or length + entries[end][2] <= room):
+                ts_ns, msg_type, size = entries[end]
+                index += INDEX_RECORD.pack(ts_ns, self._segment_size + length, msg_type, size)
+                length += size
+                end += 1
+            # Dữ liệu trước, chỉ mục sau
+            self._data_file.write(view[position:position + length])
+            self._index_file.write(index)
+            self._segment_size += length
+            self.frames += end - start
+            self.bytes += length
+            position += length
+            start = end
+        self._data_file.flush()
+        self._index_file.flush()
+
+    def _open_segment(self, ts_ns):
+        self._close_segment()
+        stem = _segment_stem(ts_ns)
+        path = os.path.join(self.directory, stem)
+        suffix = 1
+        while os.path.exists(path + DATA_SUFFIX):
+            path = os.path.join(self.directory, f"{stem}-{suffix}")
+            suffix += 1
+        self._data_file = open(path + DATA_SUFFIX, "ab")
+        self._index_file = open(path + INDEX_SUFFIX, "ab")
+        self._segment_size = 0
+        self._segment_started = time.monotonic()
+        self.segments += 1
+
+    def _sync(self):
+        os.fsync(self._data_file.fileno())
+        os.fsync(self._index_file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _close_segment(self):
+        for f in (self._data_file, self._index_file):
+            if f is None:
+                continue
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            except OSError:
+                pass
+        self._data_file = self._index_file = None
+
+
+class ArchiveRecorder:
+    """Ghép chunk thô (chưa tách frame) thành frame RTCM3 rồi ghi vào một RtcmArchiveWriter."""
+    def __init__(self, directory, settings=None):
+        self.framer = RtcmFramer()
+        self.writer = RtcmArchiveWriter(directory, settings)
+        self.writer.start()
+
+    def __call__(self, data):
+        frames = self.framer.feed(data)
+        if frames:
+            self.writer.append_frames(frames)
+
+    def close(self):
+        self.writer.close()
+
+
+# ==============================================================================
+# Đọc
+# ==============================================================================
+class _IndexTimestamps:
+    """Dãy thời điểm trong một file chỉ mục đã mmap, để bisect trực tiếp trên file."""
+    def __init__(self, index_map):
+        self._map = index_map
+        self._count = len(index_map) // INDEX_RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return INDEX_RECORD.unpack_from(self._map, i * INDEX_RECORD.size)[0]
+
+
+class ArchiveSegment:
+    """Một cặp .rtcm/.idx đã mmap (chỉ đọc). Dùng với `with` hoặc gọi close()."""
+    def __init__(self, stem):
+        self.stem = stem
+        self._files = []
+        self.data = self._map(stem + DATA_SUFFIX)
+        self.index = self._map(stem + INDEX_SUFFIX)
+        self.timestamps = _IndexTimestamps(self.index)
+        # Bỏ các bản ghi chỉ mục trỏ quá phần dữ liệu đã thực sự xuống đĩa
+        count = len(self.timestamps)
+        while count and self._record_end(count - 1) > len(self.data):
+            count -= 1
+        self.count = count
+
+    def _map(self, path):
+        f = open(path, "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _record_end(self, i):
+        _, offset, _, length = INDEX_RECORD.unpack_from(self.index, i * INDEX_RECORD.size)
+        return offset + length
+
+    def record(self, i):
+        """(thời điểm ns, offset, message type, độ dài) của frame thứ i."""
+        return INDEX_RECORD.unpack_from(self.index, i * INDEX_RECORD.size)
+
+    @property
+    def first_ns(self):
+        return self.timestamps[0] if self.count else None
+
+    @property
+    def last_ns(self):
+        return self.timestamps[self.count - 1] if self.count else None
+
+    def locate(self, start_ns=None, end_ns=None):
+        """Khoảng chỉ số frame [lo, hi) có thời điểm trong [start_ns, end_ns)."""
+        lo = 0 if start_ns is None else bisect.bisect_left(self.timestamps, start_ns, 0, self.count)
+        hi = self.count if end_ns is None else bisect.bisect_left(self.timestamps, end_ns, lo, self.count)
+        return lo, hi
+
+    def close(self):
+        for m in (self.data, self.index):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self.close_files()
+
+    def close_files(self):
+        """Chỉ đóng file; mmap còn sống tới khi memoryview cuối cùng trỏ vào nó được giải phóng."""
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RtcmArchiveReader:
+    """Đọc một thư mục lưu trữ theo khoảng thời gian (ns UTC, time.time_ns())."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segment_stems(self):
+        stems = set()
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == INDEX_SUFFIX and _SEGMENT_NAME.match(stem) and os.path.exists(
+                    os.path.join(self.directory, stem + DATA_SUFFIX)):
+                stems.add(stem)
+        # Tên phân đoạn là thời điểm bắt đầu, hậu tố -N cho phân đoạn cùng mili giây
+        return [os.path.join(self.directory, stem)
+                for stem in sorted(stems, key=lambda s: (s.split('-')[0], int(s.partition('-')[2] or 0)))]
+
+    def segments(self, start_ns=None, end_ns=None):
+        """Các ArchiveSegment có thể chứa dữ liệu trong [start_ns, end_ns), theo thứ tự thời gian."""
+        stems = self.segment_stems()
+        for i, stem in enumerate(stems):
+            # Phân đoạn kế tiếp bắt đầu trước start_ns thì phân đoạn này chắc chắn đã kết thúc trước đó
+            if start_ns is not None and i + 1 < len(stems) and _stem_ns(stems[i + 1]) <= start_ns:
+                continue
+            if end_ns is not None and _stem_ns(stem) >= end_ns:
+                break
+            segment = ArchiveSegment(stem)
+            if segment.count == 0:
+                segment.close()
+                continue
+            yield segment
+
+    def frames(self, start_ns=None, end_ns=None, message_types=None):
+        """Sinh (thời điểm ns, message type, frame bytes) trong khoảng thời gian, lọc theo message type."""
+        wanted = None if message_types is None else set(message_types)
+        for segment in self.segments(start_ns, end_ns):
+            with segment:
+                lo, hi = segment.locate(start_ns, end_ns)
+                for i in range(lo, hi):
+                    ts_ns, offset, msg_type, length = segment.record(i)
+                    if wanted is None or msg_type in wanted:
+                        yield ts_ns, msg_type, segment.data[offset:offset + length]
+
+    def frame_views(self, start_ns=None, end_ns=None):
+        """Như frames() nhưng sinh memoryview trỏ thẳng vào mmap thay vì bản sao bytes.
+
+        Phân đoạn không bị đóng tường minh: mmap được chính các memoryview giữ sống, nên
+        chúng có thể nằm trong ring của caster lâu hơn vòng lặp đọc.
+        """
+        for segment in self.segments(start_ns, end_ns):
+            segment.close_files()
+            lo, hi = segment.locate(start_ns, end_ns)
+            data = memoryview(segment.data)
+            records = memoryview(segment.index)[lo * INDEX_RECORD.size:hi * INDEX_RECORD.size]
+            for ts_ns, offset, msg_type, length in INDEX_RECORD.iter_unpack(records):
+                yield ts_ns, msg_type, data[offset:offset + length]
+
+    def time_range(self):
+        """(thời điểm frame đầu, frame cuối) của cả thư mục, hoặc (None, None) nếu rỗng."""
+        first = last = None
+        for segment in self.segments():
+            with segment:
+                if first is None:
+                    first = segment.first_ns
+                last = segment.last_ns
+        return first, last
+
+
+def _stem_ns(stem):
+    name = os.path.basename(stem).split('-')[0]
+    seconds = calendar.timegm(time.strptime(name[:15], "%Y%m%dT%H%M%S"))
+    return seconds * 1_000_000_000 + int(name[15:18]) * 1_000_000
+
+
+def parse_time(value):
+    """'2026-10-16T23:00:47' (UTC) hoặc số giây epoch -> ns."""
+    try:
+        return int(float(value) * 1e9)
+    except ValueError:
+        pass
+    value = value.rstrip('Z')
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, fmt)) * 1_000_000_000
+        except ValueError:
+            continue
+    raise ValueError(f"Không hiểu thời điểm '{value}'")
+
+
+def _format_ns(ts_ns):
+    return "n/a" if ts_ns is None else time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts_ns / 1e9)) + "Z"
+
+
+if __name__ == "__main__":
+    # python rtcm_archive.py <thư mục>                          : liệt kê phân đoạn
+    # python rtcm_archive.py <thư mục> <từ> <đến> <file ra>     : xuất frame trong khoảng thời gian (UTC)
+    if len(sys.argv) not in (2, 5):
+        print("Cách dùng: python rtcm_archive.py <thư mục> [<từ> <đến> <file ra>]")
+        sys.exit(1)
+    reader = RtcmArchiveReader(sys.argv[1])
+    if len(sys.argv) == 2:
+        for segment in reader.segments():
+            with segment:
+                print(f"{os.path.basename(segment.stem)}: {segment.count} frame, {len(segment.data)} byte, "
+                      f"{_format_ns(segment.first_ns)} -> {_format_ns(segment.last_ns)}")
+        sys.exit(0)
+    count = 0
+    with open(sys.argv[4], "wb") as out:
+        for _, _, frame in reader.frames(parse_time(sys.argv[2]), parse_time(sys.argv[3])):
+            out.write(frame)
+            count += 1
+    print(f"[+] Đã xuất {count} frame vào {sys.argv[4]}")
@@ -0,0 +1,169 @@
+import socket
+import struct
+import threading
+from multiprocessing import shared_memory
+
+# ==============================================================================
+# Ring RTCM trên shared memory: tiến trình chính ghi, các worker cùng đọc
+# ==============================================================================
+# Bố cục một vùng SharedMemory:
+#   header (64 byte) | bảng slot (slots x SLOT) | vùng dữ liệu vòng (data_size byte)
+# Header gồm cặp (write_seq, write_pos) đã commit và cặp (reserve_seq, reserve_pos) mà
+# writer đặt TRƯỚC khi ghi đè. Reader chép một lô frame ra bytes của riêng mình rồi đọc
+# lại cặp reserve: nếu writer đã lấn vào slot/byte vừa chép thì lô bị bỏ (tính là overrun).
+# Không có khóa liên tiến trình; chỉ được có một writer cho mỗi ring.
+
+_COMMIT = struct.Struct("<QQ")      # write_seq, write_pos
+_RESERVE = struct.Struct("<QQ")     # reserve_seq, reserve_pos
+_GEOMETRY = struct.Struct("<QQ")    # data_size, slots
+_RESERVE_OFFSET = _COMMIT.size
+_GEOMETRY_OFFSET = _RESERVE_OFFSET + _RESERVE.size
+HEADER_SIZE = 64
+SLOT = struct.Struct("<QIH2x")      # vị trí tuyệt đối trong vùng dữ liệu, độ dài, message type
+
+DEFAULT_SHARED_RING_MB = 4
+DEFAULT_SHARED_RING_SLOTS = 8192
+
+
+class SharedRtcmRing:
+    """Ring một writer - nhiều reader. name=None tạo vùng mới, ngược lại gắn vào vùng có sẵn."""
+    def __init__(self, data_size=DEFAULT_SHARED_RING_MB * 2**20, slots=DEFAULT_SHARED_RING_SLOTS, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + slots * SLOT.size + data_size)
+            _GEOMETRY.pack_into(self.shm.buf, _GEOMETRY_OFFSET, data_size, slots)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            data_size, slots = _GEOMETRY.unpack_from(self.shm.buf, _GEOMETRY_OFFSET)
+            self.owner = False
+        self.name = self.shm.name
+        self.data_size = data_size
+        self.slots = slots
+        self._buf = self.shm.buf
+        self._data = self._buf[HEADER_SIZE + slots * SLOT.size:]
+        self._seq, self._pos = _COMMIT.unpack_from(self._buf, 0)
+        self._lock = threading.Lock()
+        # Gọi sau mỗi lần publish, dùng để đánh thức các worker
+        self.notify = None
+
+    def committed(self):
+        return _COMMIT.unpack_from(self._buf, 0)
+
+    def publish_many(self, frames):
+        """Ghi một lô (msg_type, frame) và commit một lần."""
+        data_size, slots = self.data_size, self.slots
+        slot_base = HEADER_SIZE
+        with self._lock:
+            data = self._data
+            if data is None:
+                return  # Ring đã đóng khi caster đang dừng
+            # Lô lớn hơn cả vùng dữ liệu: chỉ giữ phần cuối vừa đủ chỗ
+            total = 0
+            first = len(frames)
+            while first > 0 and total + len(frames[first - 1][1]) <= data_size:
+                first -= 1
+                total += len(frames[first][1])
+            frames = frames[first:]
+            if not frames:
+                return
+            seq, pos = self._seq, self._pos
+            _RESERVE.pack_into(self._buf, _RESERVE_OFFSET, seq + len(frames), pos + total)
+            for msg_type, frame in frames:
+                length = len(frame)
+                offset = pos % data_size
+                head = min(length, data_size - offset)
+                data[offset:offset + head] = frame[:head]
+                if head < length:
+                    data[:length - head] = frame[head:]
+                SLOT.pack_into(self._buf, slot_base + (seq % slots) * SLOT.size, pos, length, msg_type or 0)
+                seq += 1
+                pos += length
+            _COMMIT.pack_into(self._buf, 0, seq, pos)
+            self._seq, self._pos = seq, pos
+        if self.notify is not None:
+            self.notify()
+
+    def cursor(self):
+        return SharedRingCursor(self)
+
+    def close(self):
+        with self._lock:
+            if self._data is None:
+                return
+            self._data.release()
+            self._buf = self._data = None
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+
+
+class SharedRingCursor:
+    """Con trỏ đọc của một worker; bắt đầu tại vị trí writer hiện tại."""
+    MAX_RETRIES = 3
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.seq = ring.committed()[0]
+        self.overruns = 0
+
+    def read(self):
+        """Các frame mới: danh sách (msg_type, memoryview) trên một bản sao bytes chung của cả lô."""
+        ring = self.ring
+        buf, data, data_size, slots = ring._buf, ring._data, ring.data_size, ring.slots
+        for _ in range(self.MAX_RETRIES):
+            write_seq, _ = _COMMIT.unpack_from(buf, 0)
+            if write_seq == self.seq:
+                return []
+            start = self.seq
+            if write_seq - start > slots:
+                self.overruns += 1
+                start = write_seq - slots
+            entries = [SLOT.unpack_from(buf, HEADER_SIZE + (s % slots) * SLOT.size) for s in range(start, write_seq)]
+            first_pos = entries[0][0]
+            length = entries[-1][0] + entries[-1][1] - first_pos
+            if length <= data_size:
+                offset = first_pos % data_size
+                if offset + length <= data_size:
+                    block = bytes(data[offset:offset + length])
+                else:
+                    block = bytes(data[offset:]) + bytes(data[:length - (data_size - offset)])
+                reserve_seq, reserve_pos = _RESERVE.unpack_from(buf, _RESERVE_OFFSET)
+                if reserve_seq <= start + slots and reserve_pos <= first_pos + data_size:
+                    self.seq = write_seq
+                    view = memoryview(block)
+                    return [(msg_type or None, view[pos - first_pos:pos - first_pos + size])
+                            for pos, size, msg_type in entries]
+            # Writer đã ghi đè trong lúc chép: bỏ phần cũ, thử lại từ vị trí mới nhất
+            self.overruns += 1
+            self.seq = write_seq
+        return []
+
+
+# ==============================================================================
+# Kênh giữa tiến trình chính và worker
+# ==============================================================================
+class WorkerWakeup:
+    """Socket datagram (AF_UNIX) tới từng worker; publish chỉ gửi 1 byte báo có dữ liệu mới."""
+    def __init__(self):
+        self._sockets = []
+
+    def add(self, sock):
+        sock.setblocking(False)
+        self._sockets.append(sock)
+
+    def __call__(self):
+        for sock in self._sockets:
+            try:
+                sock.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass  # Hàng đợi đầy nghĩa là worker chưa kịp đọc lần báo trước, vẫn sẽ thức dậy
+
+    def close(self):
+        for sock in self._sockets:
+            sock.close()
+        self._sockets = []
+
+
+def channel_pair():
+    """Cặp socket AF_UNIX datagram, giữ ranh giới thông điệp và cho phép gửi kèm file descriptor."""
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
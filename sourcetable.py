@@ -0,0 +1,102 @@
+import gzip
+import hashlib
+
+from ntrip_http import header_value
+
+# ==============================================================================
+# Sourcetable mã hóa sẵn: ETag, bản gzip và phản hồi đầy đủ theo từng biến thể
+# ==============================================================================
+# Caster dựng một EncodedSourcetable mỗi khi cấu hình trạm đổi; mọi GET / sau đó chỉ
+# tra dict biến thể (phiên bản NTRIP, keep-alive, gzip, 304) rồi ghi một bytes có sẵn.
+# ETag là băm nội dung nên nạp lại cấu hình không đổi sourcetable thì ETag cũng không đổi.
+
+DEFAULT_GZIP_MIN_BYTES = 1024
+SERVER_NAME = "PythonNTRIPCaster/1.0"
+
+
+def station_entry(mountpoint, name, position):
+    """Dòng STR mặc định cho trạm không khai báo "sourcetable" trong caster_settings."""
+    lat, lon = position if position is not None else (0.0, 0.0)
+    return f"STR;{mountpoint};{name};RTCM 3;;;;;;{lat:.2f};{lon:.2f};0;0;PythonCaster;none;B;N;0;"
+
+def _etag_matches(if_none_match, etag):
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag == etag or tag == 'W/' + etag:
+            return True
+    return False
+
+def _accepts_gzip(accept_encoding):
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        if coding.strip().lower() != 'gzip':
+            continue
+        # "gzip;q=0" nghĩa là client từ chối gzip
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+class EncodedSourcetable:
+    """Nội dung sourcetable (bytes), ETag, bản gzip và cache phản hồi theo biến thể.
+
+    settings (server_settings["sourcetable"]): "gzip" (mặc định True) và "gzip_min_bytes":
+    chỉ nén khi nội dung đủ lớn để bù được công giải nén của client. "generate_missing"
+    được NtripCasterServer dùng khi gom các dòng STR.
+    """
+    def __init__(self, entries, settings=None):
+        settings = settings or {}
+        self.body = ("\r\n".join(entries) + "\r\nENDSOURCETABLE\r\n").encode()
+        self.etag = '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+        self.gzip_body = None
+        if settings.get('gzip', True) and len(self.body) >= settings.get('gzip_min_bytes', DEFAULT_GZIP_MIN_BYTES):
+            compressed = gzip.compress(self.body, mtime=0)
+            if len(compressed) < len(self.body):
+                self.gzip_body = compressed
+        self._responses = {}
+
+    def variant(self, version, keep_alive, request_data):
+        """Khóa biến thể cho yêu cầu: (phiên bản, keep-alive, "not_modified" | "gzip" | "full")."""
+        if_none_match = header_value(request_data, 'If-None-Match')
+        if if_none_match and _etag_matches(if_none_match, self.etag):
+            kind = 'not_modified'
+        elif self.gzip_body is not None and _accepts_gzip(header_value(request_data, 'Accept-Encoding') or ''):
+            kind = 'gzip'
+        else:
+            kind = 'full'
+        return version, keep_alive, kind
+
+    def response(self, variant):
+        """Phản hồi đầy đủ (header + nội dung) của biến thể, dựng một lần rồi dùng lại."""
+        response = self._responses.get(variant)
+        if response is None:
+            response = self._responses[variant] = self._build(*variant)
+        return response
+
+    def _build(self, version, keep_alive, kind):
+        connection = 'keep-alive' if keep_alive else 'close'
+        lines = []
+        if kind == 'not_modified':
+            lines.append("HTTP/1.1 304 Not Modified")
+        else:
+            lines.append("HTTP/1.1 200 OK")
+        if version == 2:
+            lines += ["Ntrip-Version: Ntrip/2.0", f"Server: {SERVER_NAME}"]
+        body = b""
+        if kind != 'not_modified':
+            body = self.gzip_body if kind == 'gzip' else self.body
+            lines.append("Content-Type: gnss/sourcetable" if version == 2 else "Content-Type: text/plain")
+            if kind == 'gzip':
+                lines.append("Content-Encoding: gzip")
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"ETag: {self.etag}")
+        if self.gzip_body is not None:
+            lines.append("Vary: Accept-Encoding")
+        lines.append(f"Connection: {connection}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
@@ -0,0 +1,68 @@
+import math
+
+# ==============================================================================
+# Chỉ mục không gian cho các trạm: k-d tree 3 chiều trên vector đơn vị ECEF
+# ==============================================================================
+# Khoảng cách dây cung giữa hai vector đơn vị tăng đơn điệu theo khoảng cách
+# vòng lớn, nên tìm điểm gần nhất theo Euclid 3D cho đúng trạm gần nhất trên
+# mặt cầu mà không bị méo ở gần kinh tuyến 180 hay hai cực.
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vector(lat, lon):
+    lat_rad = math.radians(lat)
+    lon_rad = math.radians(lon)
+    cos_lat = math.cos(lat_rad)
+    return (cos_lat * math.cos(lon_rad), cos_lat * math.sin(lon_rad), math.sin(lat_rad))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    a, b = to_unit_vector(lat1, lon1), to_unit_vector(lat2, lon2)
+    return chord_to_km(math.dist(a, b))
+
+
+class KdTree:
+    """k-d tree tĩnh dựng một lần từ danh sách (lat, lon, value); nearest() là O(log n) trung bình."""
+    def __init__(self, items):
+        points = [(to_unit_vector(lat, lon), value) for lat, lon, value in items]
+        self.size = len(points)
+        self._root = self._build(points, 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        median = len(points) // 2
+        point, value = points[median]
+        return (point, value, axis,
+                self._build(points[:median], depth + 1),
+                self._build(points[median + 1:], depth + 1))
+
+    def nearest(self, lat, lon):
+        """Trả về (value, khoảng cách km) của điểm gần nhất, hoặc (None, None) nếu cây rỗng."""
+        if self._root is None:
+            return None, None
+        target = to_unit_vector(lat, lon)
+        best = [None, float('inf')]  # value, bình phương khoảng cách
+
+        def visit(node):
+            point, value, axis, left, right = node
+            dist_sq = ((point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2
+                       + (point[2] - target[2]) ** 2)
+            if dist_sq < best[1]:
+                best[0], best[1] = value, dist_sq
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if near is not None:
+                visit(near)
+            if far is not None and diff * diff < best[1]:
+                visit(far)
+
+        visit(self._root)
+        return best[0], chord_to_km(math.sqrt(best[1]))
@@ -0,0 +1,134 @@
+import time
+from bisect import bisect_left
+
+from event_log import EventLogger
+from metrics import SOURCE_ARRIVAL_GAP_SECONDS, SOURCE_EPOCH_SECONDS, SOURCE_STALLS
+from rtcm import is_end_of_epoch
+
+# ==============================================================================
+# Giám sát luồng nguồn: khoảng trống giữa các lần nhận và nhịp epoch RTCM
+# ==============================================================================
+# Timeout socket cố định (30 giây với Base, 15 giây với upstream) phát hiện nguồn chết quá muộn:
+# rover đã mất fix RTK từ lâu. StreamWatchdog học nhịp bình thường của chính nguồn đó - khoảng
+# cách giữa các epoch quan trắc (cờ "multiple message" của MSM/1001-1012), hoặc khi chưa thấy
+# epoch nào thì phân vị cao của khoảng cách giữa các lần recv - và coi nguồn là chết khi im
+# lặng quá gap_multiple lần nhịp đó. Timeout cũ vẫn là trần (max_gap) khi chưa học đủ mẫu.
+
+DEFAULT_GAP_MULTIPLE = 5.0
+DEFAULT_MIN_GAP = 2.0
+# Số mẫu tối thiểu trước khi tin nhịp đã học; phân vị khoảng cách nhận dùng khi không có epoch
+MIN_ARRIVAL_SAMPLES = 16
+MIN_EPOCH_SAMPLES = 3
+ARRIVAL_PERCENTILE = 0.9
+# Histogram nội bộ giảm một nửa khi đủ số mẫu này để theo kịp nguồn đổi nhịp
+DECAY_SAMPLES = 512
+# Khoảng message quan trắc (1001-1012 và MSM 1071-1137) để khỏi gọi is_end_of_epoch cho mọi frame
+OBSERVATION_TYPES = range(1001, 1138)
+
+log = EventLogger("health")
+
+
+class StreamWatchdog:
+    """Theo dõi một nguồn dữ liệu và cho biết thời gian còn lại trước khi coi nguồn là im lặng.
+
+    settings ("watchdog" của trạm): "enabled" (mặc định True), "gap_multiple", "min_gap" và
+    "max_gap" (giây; mặc định là timeout socket cũ của nơi dùng). Chỉ thread đọc nguồn gọi
+    on_arrival/on_frames, nên không cần khóa.
+    """
+    def __init__(self, source, settings=None, max_gap=30.0):
+        self.source = source
+        self._default_max_gap = max_gap
+        self.configure(settings)
+        self._arrival_gaps = SOURCE_ARRIVAL_GAP_SECONDS.labels(source=source)
+        self._epoch_intervals = SOURCE_EPOCH_SECONDS.labels(source=source)
+        self._stalls = SOURCE_STALLS.labels(source=source)
+        self._bounds = self._arrival_gaps.bounds
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._samples = 0
+        self._epochs = 0
+        self.epoch_interval = None  # EWMA khoảng cách epoch (giây)
+        self.last_arrival = None
+        self.last_epoch = None
+
+    def configure(self, settings):
+        """Áp dụng tham số mới (nạp lại cấu hình) mà không bỏ nhịp đã học."""
+        settings = settings or {}
+        self.enabled = settings.get('enabled', True)
+        self.gap_multiple = settings.get('gap_multiple', DEFAULT_GAP_MULTIPLE)
+        self.min_gap = settings.get('min_gap', DEFAULT_MIN_GAP)
+        self.max_gap = settings.get('max_gap', self._default_max_gap)
+
+    def start(self, now=None):
+        """Nguồn vừa (kết nối lại): tính khoảng im lặng từ lúc này, giữ nhịp đã học."""
+        self.last_arrival = time.monotonic() if now is None else now
+        self.last_epoch = None
+
+    def on_arrival(self, now):
+        last, self.last_arrival = self.last_arrival, now
+        if last is None:
+            return
+        gap = now - last
+        self._arrival_gaps.observe(gap)
+        self._counts[bisect_left(self._bounds, gap)] += 1
+        self._samples += 1
+        if self._samples >= DECAY_SAMPLES:
+            self._counts = [count >> 1 for count in self._counts]
+            self._samples = sum(self._counts)
+
+    def on_frames(self, frames, now):
+        """Ghi nhận epoch nếu trong các frame vừa tách có message quan trắc cuối của một epoch."""
+        for msg_type, frame in frames:
+            if msg_type in OBSERVATION_TYPES and is_end_of_epoch(msg_type, frame):
+                break
+        else:
+            return
+        last, self.last_epoch = self.last_epoch, now
+        if last is None:
+            return
+        interval = now - last
+        self._epoch_intervals.observe(interval)
+        self._epochs += 1
+        self.epoch_interval = interval if self.epoch_interval is None else 0.8 * self.epoch_interval + 0.2 * interval
+
+    def expected_interval(self):
+        """Nhịp bình thường của nguồn (giây), hoặc None khi chưa đủ mẫu."""
+        if self._epochs >= MIN_EPOCH_SAMPLES:
+            return self.epoch_interval
+        return self.arrival_gap(ARRIVAL_PERCENTILE)
+
+    def arrival_gap(self, fraction):
+        """Phân vị `fraction` của khoảng cách giữa các lần nhận (giây), hoặc None khi chưa đủ mẫu."""
+        if self._samples < MIN_ARRIVAL_SAMPLES:
+            return None
+        # Cận trên của bucket chứa phân vị: sai số bị chặn bởi độ rộng bucket log-tuyến tính
+        target = self._samples * fraction
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return self._bounds[index] if index < len(self._bounds) else self.max_gap
+        return None
+
+    def gap_limit(self):
+        expected = self.expected_interval()
+        if not self.enabled or expected is None:
+            return self.max_gap
+        return min(self.max_gap, max(self.min_gap, self.gap_multiple * expected))
+
+    def remaining(self, now=None):
+        """Số giây còn lại trước khi nguồn bị coi là im lặng (dùng làm timeout cho lần đọc kế tiếp)."""
+        if self.last_arrival is None:
+            return self.gap_limit()
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.gap_limit() - (now - self.last_arrival))
+
+    def stalled(self, now=None):
+        return self.last_arrival is not None and self.remaining(now) <= 0
+
+    def on_stall(self):
+        """Đếm và ghi log một lần nguồn bị coi là im lặng; nơi gọi tự ngắt kết nối nguồn."""
+        self._stalls.inc()
+        expected = self.expected_interval()
+        log.warning("source_stalled", "[!] %s: Không nhận được dữ liệu trong %.1f giây (nhịp bình thường %s). Ngắt kết nối nguồn.",
+                    self.source, time.monotonic() - self.last_arrival, "%.2f giây" % expected if expected else "chưa rõ",
+                    source=self.source)
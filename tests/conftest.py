@@ -0,0 +1,43 @@
+import base64
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ntrip_caster  # noqa: E402
+
+
+@pytest.fixture
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def run_caster():
+    """Chạy NtripCasterServer trong thread nền; server được dừng khi test kết thúc."""
+    servers = []
+
+    def start(stations, accounts=({"username": "u", "password": "p"},), settings=None, wait=0.5):
+        server = ntrip_caster.NtripCasterServer(stations, list(accounts), dict(settings or {}, metrics_path=None))
+        threading.Thread(target=server.start, daemon=True).start()
+        servers.append(server)
+        time.sleep(wait)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def rover_request(mountpoint, user=b"u", password=b"p", version=1):
+    auth = b"Authorization: Basic " + base64.b64encode(user + b":" + password) + b"\r\n"
+    if version == 2:
+        return b"GET /" + mountpoint.encode() + b" HTTP/1.1\r\nNtrip-Version: Ntrip/2.0\r\n" + auth + b"\r\n"
+    return b"GET /" + mountpoint.encode() + b" HTTP/1.0\r\n" + auth + b"\r\n"
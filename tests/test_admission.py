@@ -0,0 +1,31 @@
+import selectors
+import socket
+
+import ntrip_caster
+from admission import AdmissionController
+
+
+def test_accept_charges_global_token_only_for_real_connections():
+    caster = ntrip_caster.NtripCasterServer.__new__(ntrip_caster.NtripCasterServer)
+    caster.admission = AdmissionController({"global_rate": 1, "global_burst": 2, "per_ip_rate": 0})
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    listener.setblocking(False)
+    selector = selectors.DefaultSelector()
+    pending = {}
+    try:
+        # Đánh thức giả: backlog rỗng thì không được mất token
+        caster._accept_pending(listener, selector, pending)
+        assert caster.admission.global_bucket.tokens >= 2
+
+        client = socket.create_connection(listener.getsockname())
+        caster._accept_pending(listener, selector, pending)
+        assert len(pending) == 1
+        assert 1 <= caster.admission.global_bucket.tokens < 2
+    finally:
+        client.close()
+        for sock in pending:
+            selector.unregister(sock)
+            sock.close()
+        listener.close()
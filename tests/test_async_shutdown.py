@@ -0,0 +1,39 @@
+import logging
+import socket
+import threading
+import time
+
+import ntrip_caster
+from conftest import rover_request
+
+
+def test_stop_closes_open_connections_without_tracebacks(free_port, caplog):
+    station = {"name": "B", "mode": "NtripCaster", "base_source_password": "pw",
+               "caster_settings": {"host": "127.0.0.1", "port": free_port, "mountpoint": "B"}}
+    server = ntrip_caster.NtripCasterServer([station], [{"username": "u", "password": "p"}],
+                                            {"engine": "asyncio", "metrics_path": None})
+    thread = threading.Thread(target=server.start)
+    thread.start()
+    time.sleep(0.5)
+    rovers = []
+    for _ in range(3):
+        rover = socket.create_connection(("127.0.0.1", free_port))
+        rover.settimeout(5)
+        rover.sendall(rover_request("B"))
+        assert rover.recv(14).startswith(b"ICY 200 OK")
+        rovers.append(rover)
+    base = socket.create_connection(("127.0.0.1", free_port))
+    base.settimeout(5)
+    base.sendall(b"SOURCE pw /B\r\n\r\n")
+    assert base.recv(14).startswith(b"ICY 200 OK")
+    idle = socket.create_connection(("127.0.0.1", free_port))  # Chưa gửi yêu cầu
+    time.sleep(0.3)
+
+    with caplog.at_level(logging.ERROR, logger="asyncio"):
+        server.stop()
+        thread.join(10)
+    assert not thread.is_alive()
+    assert not [record for record in caplog.records if record.name == "asyncio"]
+    for client in rovers + [base, idle]:
+        assert client.recv(16) == b""
+        client.close()
@@ -0,0 +1,40 @@
+import base64
+import json
+
+from credentials import RoverAccountStore, migrate_accounts, migrate_config_file
+
+SETTINGS = {"hash_iterations": 1000}
+
+
+def basic(user, password):
+    return "Authorization: Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+
+
+def test_reload_reuses_records_of_unchanged_accounts():
+    accounts = [{"username": "a", "password": "pa"}, {"username": "b", "password": "pb"}]
+    old = RoverAccountStore(accounts, SETTINGS)
+    new = RoverAccountStore([accounts[0], {"username": "b", "password": "pb2"}], SETTINGS, previous=old)
+    assert new._records["a"] is old._records["a"]
+    assert new._records["b"] is not old._records["b"]
+    assert new.authenticate(basic("a", "pa"))[0]
+    assert new.authenticate(basic("b", "pb2"))[0]
+    assert not new.authenticate(basic("b", "pb"))[0]
+    # Đổi số vòng băm thì không được dùng lại bản ghi cũ
+    rehashed = RoverAccountStore(accounts, {"hash_iterations": 2000}, previous=old)
+    assert rehashed._records["a"] is not old._records["a"]
+    for store in (old, new, rehashed):
+        store.shutdown()
+
+
+def test_migrate_config_file(tmp_path):
+    path = tmp_path / "caster_config.json"
+    config = {"server_settings": {"rover_auth": SETTINGS},
+              "global_rover_accounts": [{"username": "a", "password": "pa"}]}
+    path.write_text(json.dumps(config, indent=2, ensure_ascii=False))
+    assert migrate_config_file(str(path)) == 1
+    accounts = json.loads(path.read_text())["global_rover_accounts"]
+    assert "password" not in accounts[0] and accounts[0]["password_hash"].startswith("pbkdf2_sha256$1000$")
+    assert migrate_accounts(accounts)[1] == 0
+    store = RoverAccountStore(accounts, SETTINGS)
+    assert store.authenticate(basic("a", "pa"))[0]
+    store.shutdown()
@@ -0,0 +1,36 @@
+import ntrip_caster
+from stream_health import StreamWatchdog
+
+
+def failover_with(settings=None):
+    failover = ntrip_caster.UpstreamFailover.__new__(ntrip_caster.UpstreamFailover)
+    failover.silence_timeout = None
+    failover.silence_multiple = ntrip_caster.DEFAULT_FAILOVER_SILENCE_MULTIPLE
+    failover.min_silence = ntrip_caster.DEFAULT_FAILOVER_MIN_SILENCE
+    for key, value in (settings or {}).items():
+        setattr(failover, key, value)
+    return failover
+
+
+def learned_watchdog(gaps):
+    watchdog = StreamWatchdog("test-failover", {"gap_multiple": 5, "min_gap": 2, "max_gap": 15}, 15)
+    now = 0.0
+    watchdog.on_arrival(now)
+    for gap in gaps:
+        now += gap
+        watchdog.on_arrival(now)
+    return watchdog
+
+
+def test_silence_limit_is_about_two_epochs_of_a_steady_source():
+    watchdog = learned_watchdog([1.0] * 40)
+    limit = failover_with()._silence_limit(watchdog)
+    assert 2.0 <= limit <= 3.0  # Cận trên bucket histogram làm tròn nhịp lên tới ~30%
+    assert limit < watchdog.gap_limit()
+
+
+def test_silence_limit_covers_bursts_and_falls_back_before_learning():
+    bursty = learned_watchdog([0.5] * 6 * 8 + [1.8] * 8)
+    assert failover_with()._silence_limit(bursty) > 1.8
+    assert failover_with()._silence_limit(learned_watchdog([1.0] * 3)) == 15
+    assert failover_with({"silence_timeout": 0.7})._silence_limit(bursty) == 0.7
@@ -0,0 +1,68 @@
+import base64
+import socket
+import time
+
+import pytest
+
+from conftest import rover_request
+from ntrip_http import LAST_CHUNK, chunk_header, recv_head
+from rtcm import RtcmFramer, encode_frame
+
+FRAMES = 200
+
+
+def caster_station(port):
+    return {"name": "B", "mode": "NtripCaster", "base_source_password": "pw",
+            "caster_settings": {"host": "127.0.0.1", "port": port, "mountpoint": "B"}}
+
+
+def post_request(password=b"pw"):
+    return (b"POST /B HTTP/1.1\r\nHost: caster\r\nNtrip-Version: Ntrip/2.0\r\nUser-Agent: NTRIP test\r\n"
+            b"Authorization: Basic " + base64.b64encode(b"base:" + password) + b"\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n")
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_ntrip2_post_source_feeds_rovers(engine, free_port, run_caster):
+    run_caster([caster_station(free_port)], settings={"engine": engine})
+    rover = socket.create_connection(("127.0.0.1", free_port))
+    rover.settimeout(5)
+    rover.sendall(rover_request("B"))
+    assert rover.recv(14).startswith(b"ICY 200 OK")
+
+    payload = b"".join(encode_frame((1077 << 4).to_bytes(2, 'big') + i.to_bytes(4, 'big') + bytes(40))
+                       for i in range(FRAMES))
+    base = socket.create_connection(("127.0.0.1", free_port))
+    base.settimeout(5)
+    # Chunk đầu đi cùng header; kích thước chunk lẻ để ranh giới chunk cắt ngang frame
+    first, rest = payload[:100], payload[100:]
+    base.sendall(post_request() + chunk_header(len(first)) + first + b"\r\n")
+    assert recv_head(base).startswith(b"HTTP/1.1 200 OK")
+    for pos in range(0, len(rest), 333):
+        piece = rest[pos:pos + 333]
+        base.sendall(chunk_header(len(piece)) + piece + b"\r\n")
+        time.sleep(0.001)
+    base.sendall(LAST_CHUNK)
+
+    framer, seqs = RtcmFramer(), []
+    while len(seqs) < FRAMES:
+        data = rover.recv(65536)
+        assert data
+        seqs += [int.from_bytes(frame[5:9], 'big') for _, frame in framer.feed(data)]
+    assert seqs == list(range(FRAMES))
+    # Chunk cuối kết thúc luồng: caster đóng kết nối Base
+    assert base.recv(64) == b""
+    base.close()
+    rover.close()
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_ntrip2_source_rejections(engine, free_port, run_caster):
+    run_caster([caster_station(free_port)], settings={"engine": engine})
+    for request, status in ((post_request(b"wrong"), b"HTTP/1.1 401"),
+                            (b"PUT /B HTTP/1.1\r\nHost: caster\r\n\r\n", b"HTTP/1.1 405")):
+        client = socket.create_connection(("127.0.0.1", free_port))
+        client.settimeout(5)
+        client.sendall(request)
+        assert client.recv(64).startswith(status)
+        client.close()
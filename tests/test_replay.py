@@ -0,0 +1,42 @@
+import socket
+import time
+
+import pytest
+
+from conftest import rover_request
+from rtcm import RtcmFramer, encode_frame
+from rtcm_archive import RtcmArchiveWriter
+
+
+def write_archive(directory, epochs=200, per_epoch=10):
+    writer = RtcmArchiveWriter(str(directory))
+    t0 = 1_700_000_000 * 10**9
+    for epoch in range(epochs):
+        frames = [(1077, encode_frame((1077 << 4).to_bytes(2, 'big') + bytes([epoch % 256, k]) + bytes(60)))
+                  for k in range(per_epoch)]
+        writer.append_frames(frames, t0 + epoch * 100_000_000)
+    writer.close()
+
+
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_max_speed_replay_keeps_live_rover(engine, tmp_path, free_port, run_caster):
+    write_archive(tmp_path / "SRC")
+    station = {"name": "R", "mode": "Replay", "replay": {"directory": str(tmp_path / "SRC"), "speed": "max"},
+               "caster_settings": {"host": "127.0.0.1", "port": free_port, "mountpoint": "R"}}
+    run_caster([station], settings={"engine": engine})
+
+    rover = socket.create_connection(("127.0.0.1", free_port))
+    rover.settimeout(2)
+    rover.sendall(rover_request("R"))
+    assert rover.recv(14).startswith(b"ICY 200 OK")
+    framer, frames = RtcmFramer(), 0
+    deadline = time.monotonic() + 3
+    try:
+        while time.monotonic() < deadline:
+            data = rover.recv(65536)
+            assert data, "rover bị ngắt khi phát lại ở tốc độ tối đa"
+            frames += len(framer.feed(data))
+    finally:
+        rover.close()
+    # Ring mặc định 256 slot: rover phải nhận được nhiều vòng ring mà không bị ngắt
+    assert frames > 10 * 256
@@ -0,0 +1,100 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import ntrip_caster
+import ntrip_client
+from ntrip_http import recv_head
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def fake_upstream():
+    """Caster upstream giả: trả ICY 200 OK và ghi lại câu GGA đầu tiên của mỗi kết nối."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    connections = []
+    clients = []
+
+    def serve(client):
+        # Giữ socket mở tới cuối test để phiên upstream không bị EOF giữa chừng
+        clients.append(client)
+        recv_head(client)
+        client.sendall(b"ICY 200 OK\r\n\r\n")
+        client.settimeout(5)
+        try:
+            connections.append(client.recv(200))
+        except OSError:
+            pass
+
+    def accept():
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(client,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()[1], connections
+    server.close()
+    for client in clients:
+        client.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_caster_pool_separates_gga_positions(fake_upstream):
+    port, connections = fake_upstream
+    pool = ntrip_caster.UpstreamPool()
+    config = {"host": "127.0.0.1", "port": port, "mountpoint": "VRS", "gga_interval": 5}
+    north = dict(config, location={"lat": 21.03, "lon": 105.85})
+    south = dict(config, location={"lat": 10.78, "lon": 106.70})
+    first = pool.acquire(north, lambda data: None)
+    second = pool.acquire(south, lambda data: None)
+    same_place = pool.acquire(dict(north), lambda data: None)
+    try:
+        assert first is not second
+        assert same_place is first
+        assert wait_for(lambda: len(connections) == 2)
+        assert sorted(gga.split(b",")[2][:2] for gga in connections) == [b"10", b"21"]
+    finally:
+        for upstream in (first, second):
+            for on_data in upstream.subscribers:
+                pool.release(upstream, on_data)
+
+
+def test_caster_pool_shares_position_independent_streams():
+    config = {"host": "127.0.0.1", "port": 2101, "mountpoint": "BASE", "gga_interval": 5, "position_independent": True}
+    north = dict(config, location={"lat": 21.03, "lon": 105.85})
+    south = dict(config, location={"lat": 10.78, "lon": 106.70})
+    assert ntrip_caster.UpstreamPool.key_for(north) == ntrip_caster.UpstreamPool.key_for(south)
+    no_gga = {"host": "127.0.0.1", "port": 2101, "mountpoint": "BASE"}
+    assert ntrip_caster.UpstreamPool.key_for(no_gga) == ntrip_caster.UpstreamPool.key_for(dict(no_gga, location={"lat": 1, "lon": 2}))
+
+
+def test_client_sessions_for_different_provinces_get_separate_upstreams(fake_upstream, monkeypatch):
+    port, connections = fake_upstream
+    monkeypatch.setattr(ntrip_client, "PROVINCES_FILE", os.path.join(REPO_DIR, "provinces.json"))
+    details = {"name": "VRS", "host": "127.0.0.1", "port": port, "mountpoint": "VRS", "username": "u", "password": "p"}
+    hanoi, shared = ntrip_client.acquire_upstream(details, "Hà Nội", 5, "T-1")
+    saigon, shared_saigon = ntrip_client.acquire_upstream(details, "TP. Hồ Chí Minh", 5, "T-2")
+    hanoi_again, shared_again = ntrip_client.acquire_upstream(details, "Hà Nội", 5, "T-3")
+    try:
+        assert not shared and not shared_saigon and shared_again
+        assert hanoi is not saigon and hanoi_again is hanoi
+        assert wait_for(lambda: len(connections) == 2)
+    finally:
+        for key, conn_id in ((hanoi['key'], "T-1"), (hanoi['key'], "T-3"), (saigon['key'], "T-2")):
+            ntrip_client.release_upstream(key, conn_id)
+    assert not ntrip_client.upstream_pool